@@ -0,0 +1,97 @@
+# benchmarks/bench_billing_matcher.py
+"""
+Costo por llamada de la detección de consultas de facturación.
+
+Compara la detección anterior (minúsculas + un `in` por palabra clave en bucles
+de Python) contra el matcher compilado de billing_matcher.py, con listas de
+reglas sintéticas de distintos tamaños. Las consultas son en su mayoría
+preguntas generales que no coinciden con ninguna regla, el peor caso para los
+bucles porque recorren la lista completa.
+
+Uso:
+    python benchmarks/bench_billing_matcher.py [--sizes 30,1000,5000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billing_matcher import BillingMatcher, BILLING_KEYWORDS_FILE
+import json
+
+GENERAL_QUESTIONS = [
+    "¿Cómo fuiste construido?", "¿Qué es UiPath Agent Builder?", "Hola, ¿quién eres?",
+    "Explícame la arquitectura del sistema", "¿Qué diferencia hay entre un agente de IA y un bot?",
+    "¿Puedes repetir lo último que dijiste?", "Gracias por la ayuda, eso es todo",
+]
+BILLING_QUESTIONS = [
+    "¿Por qué me están cobrando el dashboard?", "¿Cuánto cuesta el desarrollador senior?",
+    "La tarifa no es correcta", "El soporte fuera de horario no hace parte del contrato",
+]
+
+
+def synthetic_rules(rng: random.Random, count: int):
+    """Palabras y frases aleatorias que no aparecen en las consultas de prueba."""
+    def word():
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+    keywords = [word() for _ in range(count * 2 // 3)]
+    phrases = [" ".join(word() for _ in range(rng.randint(2, 4))) for _ in range(count - len(keywords))]
+    return keywords, phrases
+
+
+def loop_detector(keywords, phrases):
+    """Réplica de la detección anterior basada en bucles."""
+    def detect(text: str) -> bool:
+        text_lower = text.lower()
+        for keyword in keywords:
+            if keyword in text_lower:
+                return True
+        for phrase in phrases:
+            if phrase in text_lower:
+                return True
+        return False
+    return detect
+
+
+def time_per_call(detect, queries) -> float:
+    started = time.perf_counter()
+    for query in queries:
+        detect(query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="30,1000,5000", help="Cantidad de reglas sintéticas adicionales")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(BILLING_KEYWORDS_FILE, encoding="utf-8") as f:
+        base = json.load(f)
+
+    rng = random.Random(args.seed)
+    queries = [rng.choice(GENERAL_QUESTIONS if rng.random() < 0.8 else BILLING_QUESTIONS) for _ in range(args.queries)]
+
+    print(f"{args.queries} consultas (80% generales)\n")
+    print(f"{'reglas':>8} {'compilar':>10} {'bucles':>12} {'compilado':>12} {'aceleración':>12}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        extra_keywords, extra_phrases = synthetic_rules(rng, size)
+        keywords = base["keywords"] + extra_keywords
+        phrases = base["phrases"] + extra_phrases
+
+        started = time.perf_counter()
+        matcher = BillingMatcher(keywords, phrases)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        loop_us = time_per_call(loop_detector(keywords, phrases), queries)
+        compiled_us = time_per_call(matcher.match, queries)
+        print(f"{len(matcher):>8} {compile_ms:>8.1f}ms {loop_us:>10.2f}µs {compiled_us:>10.2f}µs {loop_us / compiled_us:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# benchmarks/bench_image_preprocessing.py
+"""
+Mide el efecto del preprocesamiento de imágenes de facturas.
+
+Para cada configuración reporta bytes enviados al modelo, número de bloques y
+tiempo de preprocesamiento/codificación sobre un conjunto de facturas sintéticas
+(escaneos con márgenes, inclinación leve y ruido; algunas muy altas).
+Con --with-model además envía cada variante a OpenAI y mide la exactitud de la
+extracción (conceptos y total) contra los valores reales.
+
+Uso:
+    python benchmarks/bench_image_preprocessing.py [--invoices 10] [--with-model]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from image_preprocessing import ImagePreprocessConfig, preprocess_invoice_image
+
+SERVICES = [
+    "Desarrollador RPA Senior", "Desarrollador RPA Junior", "Soporte fuera de horario",
+    "Dashboard interactivo", "Configuración inicial", "Implementación de bots",
+    "Mantenimiento mensual", "Licencia Orchestrator", "Capacitación usuarios",
+]
+
+SETTINGS = {
+    # Equivalente al flujo anterior: thumbnail 2048, RGB, JPEG calidad por defecto
+    "original": dict(autocrop=False, deskew=False, color_mode="color", image_format="JPEG",
+                     target_bytes=0, max_quality=75, tile_aspect_ratio=0),
+    "recorte+gris": dict(autocrop=True, deskew=True, color_mode="grayscale", image_format="JPEG",
+                         target_bytes=0, max_quality=75, tile_aspect_ratio=0),
+    "gris adaptativo": dict(autocrop=True, deskew=True, color_mode="grayscale", image_format="JPEG",
+                            target_bytes=350000, tile_aspect_ratio=0),
+    "binario webp": dict(autocrop=True, deskew=True, color_mode="binary", image_format="WEBP",
+                         target_bytes=250000, tile_aspect_ratio=0),
+    "gris + bloques": dict(autocrop=True, deskew=True, color_mode="grayscale", image_format="JPEG",
+                           target_bytes=350000, tile_aspect_ratio=2.2),
+}
+
+
+def colombian_amount(value: int) -> str:
+    return f"{value:,}".replace(",", ".")
+
+
+def build_invoice(rng: random.Random, tall: bool):
+    """Devuelve (bytes PNG, conceptos esperados, total esperado)."""
+    rows = []
+    for service in rng.sample(SERVICES, rng.randint(4, 8) if not tall else 8):
+        quantity = rng.randint(1, 160)
+        unit = rng.choice([85000, 120000, 250000, 1500000])
+        rows.append((service, quantity, unit, quantity * unit))
+    total = sum(row[3] for row in rows)
+
+    width, height = 1700, 4800 if tall else 2200
+    image = Image.new("RGB", (width, height), (252, 250, 246))
+    draw = ImageDraw.Draw(image)
+    top = 260
+    draw.text((220, top), "NovaIA S.A.S. - FACTURA ELECTRÓNICA DE VENTA FE-" + str(rng.randint(1000, 9999)), fill=(20, 20, 20))
+    y = top + 120
+    row_gap = 400 if tall else 70
+    for index, (service, quantity, unit, line_total) in enumerate(rows):
+        draw.rectangle((200, y - 10, 1500, y + 40), outline=(90, 90, 90))
+        draw.text((220, y), f"{index + 1}   {service}   {quantity}   ${colombian_amount(unit)}   ${colombian_amount(line_total)}", fill=(10, 10, 10))
+        y += row_gap
+    draw.text((220, y + 40), f"TOTAL A PAGAR: ${colombian_amount(total)}", fill=(0, 0, 0))
+
+    image = image.rotate(rng.uniform(-2.5, 2.5), resample=Image.Resampling.BICUBIC, fillcolor=(250, 250, 250))
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    # Grano de escáner
+    noise = Image.effect_noise(image.size, 40).convert("RGB")
+    image = Image.blend(image, noise, 0.06)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue(), rows, total
+
+
+async def extraction_accuracy(file_data: bytes, config: ImagePreprocessConfig, rows, total) -> float:
+    """Envía la variante al modelo y devuelve la fracción de valores acertados."""
+    os.environ.setdefault("HEYGEN_API_KEY", "benchmark")
+    import main
+
+    request, _ = await main.prepare_invoice_request(file_data, "image/png", image_config=config)
+    client = main.get_openai_client(main.current_openai_key)
+    async with main.model_slot(request["model"]):
+        response = await client.chat.completions.create(**request)
+    data = main.parse_invoice_response(response.choices[0].message.content.strip(), "image/png", "")
+
+    extracted_totals = {int(float(c.get("total_concepto") or 0)) for c in data.get("conceptos") or []}
+    hits = sum(1 for row in rows if row[3] in extracted_totals)
+    hits += 1 if int(float(data.get("total_factura") or 0)) == total else 0
+    return hits / (len(rows) + 1)
+
+
+async def corpus_accuracy(corpus, config: ImagePreprocessConfig):
+    """Mide la exactitud de todo el corpus con el cliente compartido y cierra su pool al terminar."""
+    import main
+
+    try:
+        return await asyncio.gather(*(extraction_accuracy(data, config, rows, total) for data, rows, total in corpus))
+    finally:
+        await main.close_openai_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--with-model", action="store_true", help="Medir exactitud llamando a OpenAI (tiene costo)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [build_invoice(rng, tall=index % 3 == 2) for index in range(args.invoices)]
+    print(f"{args.invoices} facturas sintéticas ({sum(1 for i in range(args.invoices) if i % 3 == 2)} altas)\n")
+
+    header = f"{'configuración':<18} {'KB prom':>9} {'bloques':>8} {'ms prom':>9}"
+    if args.with_model:
+        header += f" {'exactitud':>10}"
+    print(header)
+
+    baseline_bytes = None
+    for name, overrides in SETTINGS.items():
+        config = ImagePreprocessConfig(**overrides)
+        total_bytes, total_tiles, started = 0, 0, time.perf_counter()
+        for file_data, _, _ in corpus:
+            images = preprocess_invoice_image(file_data, config)
+            total_bytes += sum(len(data) for data, _ in images)
+            total_tiles += len(images)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(corpus)
+        baseline_bytes = baseline_bytes or total_bytes
+
+        line = (f"{name:<18} {total_bytes / len(corpus) / 1024:>9.1f} {total_tiles / len(corpus):>8.1f} "
+                f"{elapsed_ms:>9.1f}")
+        if args.with_model:
+            scores = asyncio.run(corpus_accuracy(corpus, config))
+            line += f" {sum(scores) / len(scores):>10.1%}"
+        print(line + f"   ({total_bytes / baseline_bytes:.0%} del original)")
+
+
+if __name__ == "__main__":
+    main()
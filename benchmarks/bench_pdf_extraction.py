@@ -0,0 +1,126 @@
+# benchmarks/bench_pdf_extraction.py
+"""
+Compara el motor de extracción "tiered" (PyMuPDF + tablas con pdfplumber solo
+en páginas tabulares) contra el análisis completo con pdfplumber.
+
+Genera un corpus de facturas sintéticas tipo NovaIA (tabla de conceptos con
+bordes más páginas de condiciones en texto corrido) y reporta tiempo total y
+calidad de salida: porcentaje de celdas de la tabla recuperadas como filas de
+tabla y porcentaje de palabras del texto recuperadas.
+
+Uso:
+    python benchmarks/bench_pdf_extraction.py [--invoices 20] [--terms-pages 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # pymupdf
+
+from pdf_extraction import extract_pages_pdfplumber, extract_pages_tiered, count_pages
+
+SERVICES = [
+    "Desarrollador RPA Senior", "Desarrollador RPA Junior", "Soporte fuera de horario",
+    "Dashboard interactivo", "Configuración inicial", "Implementación de bots",
+    "Mantenimiento mensual", "Licencia Orchestrator", "Capacitación usuarios",
+]
+
+TERMS_WORDS = (
+    "el proveedor prestará los servicios descritos en el contrato marco de acuerdo con "
+    "las tarifas pactadas y los niveles de servicio acordados entre las partes durante "
+    "la vigencia del mismo incluyendo soporte en horario hábil y festivos"
+).split()
+
+
+def colombian_amount(value: int) -> str:
+    return f"{value:,}".replace(",", ".")
+
+
+def build_invoice(rng: random.Random, terms_pages: int):
+    """Devuelve (bytes del PDF, celdas esperadas, palabras esperadas)."""
+    doc = fitz.open()
+    page = doc.new_page()
+    expected_words = ["NovaIA", "FACTURA"]
+    page.insert_text((72, 60), "NovaIA S.A.S. - FACTURA ELECTRÓNICA DE VENTA", fontsize=12)
+    invoice_number = f"FE-{rng.randint(1000, 9999)}"
+    page.insert_text((72, 80), f"Número: {invoice_number}   Fecha: 2025-0{rng.randint(1, 9)}-15")
+    expected_words.append(invoice_number)
+
+    headers = ["Ítem", "Descripción", "Cantidad", "Valor unitario", "Total"]
+    widths = [40, 190, 60, 100, 100]
+    rows = []
+    for index, service in enumerate(rng.sample(SERVICES, rng.randint(3, 7))):
+        quantity = rng.randint(1, 160)
+        unit = rng.choice([85000, 120000, 250000, 1500000])
+        rows.append([str(index + 1), service, str(quantity), colombian_amount(unit), colombian_amount(quantity * unit)])
+
+    y = 110
+    expected_cells = []
+    for row in [headers] + rows:
+        x = 50
+        for cell, width in zip(row, widths):
+            page.draw_rect(fitz.Rect(x, y, x + width, y + 18), width=0.5)
+            page.insert_text((x + 3, y + 13), cell, fontsize=8)
+            x += width
+        if row is not headers:
+            expected_cells.extend(row)
+        y += 18
+
+    for _ in range(terms_pages):
+        terms_page = doc.new_page()
+        words = [rng.choice(TERMS_WORDS) for _ in range(400)]
+        expected_words.extend(words[:50])
+        text = " ".join(words)
+        terms_page.insert_textbox(fitz.Rect(60, 60, 540, 780), text, fontsize=9)
+
+    return doc.tobytes(), expected_cells, expected_words
+
+
+def table_rows(output: str):
+    return [line for line in output.splitlines() if " | " in line]
+
+
+def score(output: str, expected_cells, expected_words):
+    rows = "\n".join(table_rows(output))
+    cell_recall = sum(1 for cell in expected_cells if cell in rows) / max(1, len(expected_cells))
+    word_recall = sum(1 for word in expected_words if word in output) / max(1, len(expected_words))
+    return cell_recall, word_recall
+
+
+def run(engine_name, extractor, corpus):
+    started = time.perf_counter()
+    cell_scores, word_scores = [], []
+    for pdf_data, expected_cells, expected_words in corpus:
+        output = extractor(pdf_data, 0, count_pages(pdf_data))
+        cell_recall, word_recall = score(output, expected_cells, expected_words)
+        cell_scores.append(cell_recall)
+        word_scores.append(word_recall)
+    elapsed = time.perf_counter() - started
+    print(f"{engine_name:<12} {elapsed:>9.3f}s {elapsed / len(corpus) * 1000:>10.1f}ms "
+          f"{sum(cell_scores) / len(cell_scores):>10.1%} {sum(word_scores) / len(word_scores):>10.1%}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=20)
+    parser.add_argument("--terms-pages", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [build_invoice(rng, args.terms_pages) for _ in range(args.invoices)]
+
+    print(f"{args.invoices} facturas sintéticas, {1 + args.terms_pages} páginas cada una\n")
+    print(f"{'motor':<12} {'total':>10} {'por doc':>12} {'celdas':>10} {'palabras':>10}")
+    baseline = run("pdfplumber", extract_pages_pdfplumber, corpus)
+    tiered = run("tiered", extract_pages_tiered, corpus)
+    print(f"\nAceleración tiered vs pdfplumber: {baseline / tiered:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# billing_matcher.py
+"""
+Detector de consultas de facturación con un único patrón compilado.
+
+Las palabras clave y frases se leen al arrancar desde un archivo JSON
+(BILLING_KEYWORDS_FILE) con las listas "keywords" y "phrases". Se normalizan
+sin tildes ni mayúsculas ("cuánto" y "cuanto" son la misma regla) y se
+compilan en una sola expresión regular construida a partir de un trie, así el
+costo por consulta apenas crece aunque las listas lleguen a miles de reglas.
+La coincidencia es por subcadena, igual que la detección anterior ("cobr"
+detecta "cobran" y "cobro").
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BILLING_KEYWORDS_FILE = os.getenv(
+    "BILLING_KEYWORDS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "billing_keywords.json")
+)
+
+
+# Tildes habituales del español; otros caracteres se resuelven con la descomposición Unicode
+ACCENT_TABLE = str.maketrans("áéíóúüàèìòùâêîôûäëïö", "aeiouuaeiouaeiouaeio")
+UNCOMMON_CHARS = re.compile(r"[^\x00-\x7fñ¿¡]")
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes; la ñ se conserva."""
+    text = (text or "").lower().translate(ACCENT_TABLE)
+    if not UNCOMMON_CHARS.search(text):
+        return text
+    decomposed = unicodedata.normalize("NFD", text)
+    kept = []
+    for char in decomposed:
+        if unicodedata.combining(char) and not (char == "\u0303" and kept and kept[-1] == "n"):
+            continue
+        kept.append(char)
+    return unicodedata.normalize("NFC", "".join(kept))
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Expresión regular equivalente a la alternancia de todas las palabras, con los
+    prefijos comunes factorizados: "cobro|cobran" -> "cobr(?:an|o)".
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        if list(node) == [""]:
+            return ""
+        optional = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if optional:
+            # La palabra puede terminar aquí: el resto es opcional
+            body = ("(?:" + body + ")?") if len(branches) == 1 else body + "?"
+        return body
+
+    return build(trie)
+
+
+@dataclass
+class BillingMatch:
+    rule: str   # Regla tal como aparece en el archivo
+    kind: str   # "keyword" o "phrase"
+
+
+class BillingMatcher:
+    """Matcher compilado de reglas de facturación."""
+
+    def __init__(self, keywords: List[str], phrases: List[str]):
+        self._rules: Dict[str, BillingMatch] = {}
+        # Las frases se registran primero para que una regla repetida se reporte como frase
+        for kind, rules in (("phrase", phrases), ("keyword", keywords)):
+            for rule in rules:
+                normalized = normalize_text(rule).strip()
+                if normalized and normalized not in self._rules:
+                    self._rules[normalized] = BillingMatch(rule=rule, kind=kind)
+        # Los opcionales del trie son codiciosos: en cada posición gana la regla más larga
+        self._pattern = re.compile(trie_pattern(self._rules)) if self._rules else None
+
+    @classmethod
+    def from_file(cls, path: str = BILLING_KEYWORDS_FILE) -> "BillingMatcher":
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        matcher = cls(config.get("keywords", []), config.get("phrases", []))
+        logger.info(f"[BILLING DETECTION] {len(matcher)} reglas cargadas desde {path}")
+        return matcher
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def match(self, text: str) -> Optional[BillingMatch]:
+        """Primera regla encontrada en el texto (la más larga en esa posición), o None."""
+        if self._pattern is None:
+            return None
+        found = self._pattern.search(normalize_text(text))
+        if found is None:
+            return None
+        return self._rules.get(found.group(0))
+
+
+def load_billing_matcher() -> BillingMatcher:
+    """Carga las reglas del archivo configurado; si no se puede leer, el matcher queda vacío."""
+    try:
+        return BillingMatcher.from_file(BILLING_KEYWORDS_FILE)
+    except (OSError, ValueError) as e:
+        logger.error(f"[BILLING DETECTION] No se pudo cargar {BILLING_KEYWORDS_FILE}: {e}")
+        return BillingMatcher([], [])
+
+
+billing_matcher = load_billing_matcher()
@@ -0,0 +1,138 @@
+# heygen_token.py
+"""
+Ciclo de vida del token de sesión de HeyGen (streaming.create_token).
+
+Guarda el token junto con su vencimiento, tomado del claim "exp" si el token es
+un JWT o, si no, de HEYGEN_TOKEN_TTL. Cuando faltan menos de
+HEYGEN_TOKEN_REFRESH_MARGIN segundos para que venza, se renueva en segundo
+plano y los llamadores siguen usando el token vigente, sin esperar. Solo se
+espera la renovación si no hay token o ya venció. Las renovaciones
+concurrentes comparten una única petición en vuelo.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+HEYGEN_TOKEN_TTL = float(os.getenv("HEYGEN_TOKEN_TTL", "600"))  # Vida asumida si el token no trae "exp"
+HEYGEN_TOKEN_REFRESH_MARGIN = float(os.getenv("HEYGEN_TOKEN_REFRESH_MARGIN", "60"))
+HEYGEN_TOKEN_RETRY_DELAY = 5.0
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Claim "exp" (epoch en segundos) de un JWT, o None si el token no es un JWT legible."""
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        payload = parts[1] + "=" * (-len(parts[1]) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class HeyGenTokenManager:
+    """
+    Token compartido con renovación anticipada y single-flight.
+
+    fetch_token() debe pedir un token nuevo a HeyGen y devolverlo como str.
+    """
+
+    def __init__(self, fetch_token: Callable[[], Awaitable[str]], ttl: float = HEYGEN_TOKEN_TTL,
+                 refresh_margin: float = HEYGEN_TOKEN_REFRESH_MARGIN):
+        self._fetch_token = fetch_token
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = 0.0     # time.monotonic()
+        self._refresh_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.stats = {"refreshes": 0, "background_refreshes": 0, "failures": 0, "invalidations": 0, "shared_waits": 0}
+
+    def _valid(self, now: float) -> bool:
+        return self._token is not None and now < self._expires_at
+
+    async def get_token(self) -> str:
+        """Token vigente; solo espera a HeyGen si no hay ninguno utilizable."""
+        now = time.monotonic()
+        if self._valid(now):
+            if now >= self._refresh_at and self._refresh_task is None:
+                self.stats["background_refreshes"] += 1
+                self._start_refresh()
+            return self._token
+        return await self.refresh()
+
+    async def refresh(self) -> str:
+        """Pide un token nuevo; las llamadas concurrentes esperan la misma petición."""
+        if self._refresh_task is None:
+            self._start_refresh()
+        else:
+            self.stats["shared_waits"] += 1
+        # shield: cancelar a un llamador no cancela la renovación que esperan los demás
+        return await asyncio.shield(self._refresh_task)
+
+    def invalidate(self, token: Optional[str] = None):
+        """Descarta el token (p. ej. tras un 401). Si se indica uno, solo si sigue siendo el vigente."""
+        if token is not None and token != self._token:
+            return
+        self._token = None
+        self._expires_at = 0.0
+        self.stats["invalidations"] += 1
+
+    def _start_refresh(self):
+        self._refresh_task = asyncio.create_task(self._do_refresh())
+        self._refresh_task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refresh_task = None
+        # Evita el aviso de excepción no recuperada en renovaciones de fondo que nadie espera
+        if not task.cancelled():
+            task.exception()
+
+    async def _do_refresh(self) -> str:
+        logger.info("[HEYGEN TOKEN] Obteniendo nuevo token de sesión...")
+        try:
+            token = await self._fetch_token()
+        except Exception as e:
+            self.stats["failures"] += 1
+            # Si el token actual sigue vigente, no reintentar en cada uso mientras HeyGen falla
+            self._refresh_at = time.monotonic() + HEYGEN_TOKEN_RETRY_DELAY
+            logger.warning(f"[HEYGEN TOKEN] Error renovando el token: {e}")
+            raise
+        now = time.monotonic()
+        exp = token_expiry(token)
+        lifetime = exp - time.time() if exp is not None else self.ttl
+        lifetime = max(0.0, lifetime)
+        self._token = token
+        self._expires_at = now + lifetime
+        # Con tokens de vida corta el margen se limita a la mitad de su vida para no renovar en cada uso
+        self._refresh_at = self._expires_at - min(self.refresh_margin, lifetime / 2)
+        self.stats["refreshes"] += 1
+        logger.info(f"[HEYGEN TOKEN] Token renovado, vence en {lifetime:.0f}s")
+        return token
+
+    async def aclose(self):
+        """Cancela una renovación en curso."""
+        task = self._refresh_task
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def metrics(self) -> Dict:
+        """Estado del token y contadores de renovación."""
+        remaining = self._expires_at - time.monotonic() if self._token is not None else 0.0
+        return {
+            **self.stats,
+            "has_token": self._token is not None,
+            "expires_in": round(max(0.0, remaining), 1),
+            "refreshing": self._refresh_task is not None
+        }
@@ -0,0 +1,196 @@
+# image_preprocessing.py
+"""
+Preprocesamiento de imágenes de facturas antes de enviarlas al modelo de visión.
+
+Recorta márgenes, corrige la inclinación, reduce color (escala de grises o
+binarizado), ajusta la calidad JPEG/WebP a un tamaño objetivo y divide las
+facturas muy altas en bloques. Todo es CPU-bound: se ejecuta en un hilo aparte.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+from typing import List, Tuple
+
+from PIL import Image, ImageOps
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePreprocessConfig(BaseModel):
+    # Recorte, enderezado, reducción de color y división en bloques quedan desactivados
+    # por defecto (imagen original a color, una sola imagen) hasta medir su efecto en la
+    # exactitud con benchmarks/bench_image_preprocessing.py --with-model. Los bloques
+    # además se cobran por separado con detail="high".
+    max_side: int = Field(default_factory=lambda: int(os.getenv("INVOICE_IMAGE_MAX_SIDE", "2048")))
+    autocrop: bool = Field(default_factory=lambda: os.getenv("INVOICE_IMAGE_AUTOCROP", "false").lower() == "true")
+    deskew: bool = Field(default_factory=lambda: os.getenv("INVOICE_IMAGE_DESKEW", "false").lower() == "true")
+    color_mode: str = Field(default_factory=lambda: os.getenv("INVOICE_IMAGE_COLOR_MODE", "color"))  # color, grayscale o binary
+    image_format: str = Field(default_factory=lambda: os.getenv("INVOICE_IMAGE_FORMAT", "JPEG").upper())  # JPEG o WEBP
+    target_bytes: int = Field(default_factory=lambda: int(os.getenv("INVOICE_IMAGE_TARGET_BYTES", "350000")))  # 0 = calidad fija
+    min_quality: int = Field(default_factory=lambda: int(os.getenv("INVOICE_IMAGE_MIN_QUALITY", "40")))
+    max_quality: int = Field(default_factory=lambda: int(os.getenv("INVOICE_IMAGE_MAX_QUALITY", "85")))
+    tile_aspect_ratio: float = Field(default_factory=lambda: float(os.getenv("INVOICE_IMAGE_TILE_ASPECT", "0")))  # 0 = sin bloques
+    tile_overlap: float = Field(default_factory=lambda: float(os.getenv("INVOICE_IMAGE_TILE_OVERLAP", "0.04")))
+    detail: str = Field(default_factory=lambda: os.getenv("INVOICE_IMAGE_DETAIL", "high"))
+
+    def signature(self) -> str:
+        """Huella corta de la configuración, para incluirla en claves de caché."""
+        payload = json.dumps(self.model_dump(), sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def auto_crop(image: Image.Image, threshold: int = 235, margin: int = 12) -> Image.Image:
+    """Recorta los márgenes casi blancos alrededor del contenido."""
+    gray = image.convert("L")
+    content_mask = gray.point(lambda value: 255 if value < threshold else 0)
+    bbox = content_mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - margin), max(0, top - margin),
+        min(image.width, right + margin), min(image.height, bottom + margin)
+    ))
+
+
+def estimate_skew(gray: Image.Image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """
+    Estima la inclinación del texto por perfil de proyección: el ángulo que
+    produce los cambios más bruscos entre filas es el que alinea los renglones.
+    """
+    scale = min(1.0, 800 / max(gray.size))
+    small = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.Resampling.BILINEAR)
+    ink = ImageOps.invert(small)
+
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle / step)
+    for index in range(-steps, steps + 1):
+        angle = index * step
+        rotated = ink.rotate(angle, resample=Image.Resampling.BILINEAR, fillcolor=0)
+        # Reducir a una columna da el promedio de tinta por fila
+        profile = list(rotated.resize((1, rotated.height), Image.Resampling.BOX).getdata())
+        score = sum((profile[i + 1] - profile[i]) ** 2 for i in range(len(profile) - 1))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def otsu_threshold(gray: Image.Image) -> int:
+    """Umbral de binarización de Otsu a partir del histograma."""
+    histogram = gray.histogram()[:256]
+    total = sum(histogram)
+    sum_total = sum(index * count for index, count in enumerate(histogram))
+    sum_background, weight_background = 0.0, 0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_total - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def split_tiles(image: Image.Image, aspect_ratio: float, overlap: float) -> List[Image.Image]:
+    """Divide una imagen muy alta en bloques horizontales con un pequeño solape."""
+    if aspect_ratio <= 0 or image.height / image.width <= aspect_ratio:
+        return [image]
+    tile_count = math.ceil(image.height / (image.width * aspect_ratio))
+    tile_height = math.ceil(image.height / tile_count)
+    overlap_px = int(tile_height * overlap)
+    tiles = []
+    for index in range(tile_count):
+        top = max(0, index * tile_height - overlap_px)
+        bottom = min(image.height, (index + 1) * tile_height + overlap_px)
+        tiles.append(image.crop((0, top, image.width, bottom)))
+    return tiles
+
+
+def encode_image(image: Image.Image, config: ImagePreprocessConfig) -> bytes:
+    """
+    Codifica la imagen en JPEG/WebP. Con target_bytes > 0 busca por bisección
+    la mayor calidad que no supere ese tamaño.
+    """
+    image_format = "WEBP" if config.image_format == "WEBP" else "JPEG"
+
+    def encode(quality: int) -> bytes:
+        buffered = io.BytesIO()
+        image.save(buffered, format=image_format, quality=quality, optimize=image_format == "JPEG")
+        return buffered.getvalue()
+
+    if config.target_bytes <= 0:
+        return encode(config.max_quality)
+
+    low, high = config.min_quality, config.max_quality
+    best = encode(low)
+    if len(best) > config.target_bytes:
+        return best
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(quality)
+        if len(data) <= config.target_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def preprocess_invoice_image(file_data: bytes, config: ImagePreprocessConfig) -> List[Tuple[bytes, str]]:
+    """
+    Aplica el pipeline completo a una imagen de factura.
+
+    Returns:
+        Lista de (bytes codificados, mime type), un elemento por bloque
+    """
+    image = Image.open(io.BytesIO(file_data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if config.autocrop:
+        image = auto_crop(image)
+
+    if config.deskew:
+        angle = estimate_skew(image.convert("L"))
+        if abs(angle) >= 0.25:
+            logger.info(f"[INVOICE IMAGE] Corrigiendo inclinación de {angle:.1f}°")
+            image = image.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=(255, 255, 255))
+
+    if config.color_mode == "grayscale":
+        image = image.convert("L")
+    elif config.color_mode == "binary":
+        gray = image.convert("L")
+        threshold = otsu_threshold(gray)
+        image = gray.point(lambda value: 255 if value > threshold else 0)
+
+    mime_type = "image/webp" if config.image_format == "WEBP" else "image/jpeg"
+    encoded = []
+    for tile in split_tiles(image, config.tile_aspect_ratio, config.tile_overlap):
+        if tile.width > config.max_side or tile.height > config.max_side:
+            tile = tile.copy()
+            tile.thumbnail((config.max_side, config.max_side), Image.Resampling.LANCZOS)
+        encoded.append((encode_image(tile, config), mime_type))
+    return encoded
+
+
+async def preprocess_invoice_image_async(file_data: bytes, config: ImagePreprocessConfig) -> List[Tuple[bytes, str]]:
+    """Ejecuta preprocess_invoice_image en un hilo para no bloquear el event loop."""
+    return await asyncio.to_thread(preprocess_invoice_image, file_data, config)
+
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
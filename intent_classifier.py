@@ -0,0 +1,180 @@
+# intent_classifier.py
+"""
+Clasificador local de intención para enrutar los mensajes del WebSocket.
+
+Regresión logística multinomial sobre características con hashing (palabras,
+bigramas y n-gramas de caracteres del texto normalizado), entrenada al arrancar
+a partir de un CSV etiquetado (INTENTS_DATA_FILE, columnas text,intent). Predice
+en microsegundos y sin llamadas de red. Intenciones:
+
+    billing  - consulta sobre una factura o tarifa: se activa UiPath
+    general  - conversación general: responde OpenAI
+    meta     - preguntas sobre el asistente y su construcción: responde OpenAI
+
+Si el modelo no está disponible o su confianza queda bajo el umbral, se usan
+las reglas de palabras clave de billing_matcher.py.
+"""
+import csv
+import logging
+import math
+import os
+import random
+import re
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from billing_matcher import billing_matcher, normalize_text
+
+logger = logging.getLogger(__name__)
+
+INTENT_CLASSIFIER_ENABLED = os.getenv("INTENT_CLASSIFIER_ENABLED", "true").lower() == "true"
+INTENTS_DATA_FILE = os.getenv(
+    "INTENTS_DATA_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intents.csv")
+)
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.6"))
+INTENT_HASH_FEATURES = int(os.getenv("INTENT_HASH_FEATURES", str(2 ** 15)))
+
+INTENTS = ("billing", "general", "meta")
+
+
+@dataclass
+class IntentPrediction:
+    intent: str
+    confidence: float
+    source: str  # "model" o "keywords"
+
+
+def extract_features(text: str, dimensions: int) -> Dict[int, float]:
+    """Índices hasheados de palabras, bigramas y 4-gramas de caracteres, normalizados a norma 1."""
+    normalized = re.sub(r"[^a-z0-9ñ ]+", " ", normalize_text(text))
+    words = normalized.split()
+    tokens = [f"w:{word}" for word in words]
+    tokens += [f"b:{first}_{second}" for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        tokens += [f"c:{padded[index:index + 4]}" for index in range(max(1, len(padded) - 3))]
+
+    features: Dict[int, float] = {}
+    for token in tokens:
+        index = zlib.crc32(token.encode("utf-8")) % dimensions
+        features[index] = features.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in features.values())) or 1.0
+    return {index: value / norm for index, value in features.items()}
+
+
+def softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+class IntentClassifier:
+    """Regresión logística multinomial con características hasheadas, entrenada por SGD."""
+
+    def __init__(self, dimensions: int = INTENT_HASH_FEATURES, intents: Tuple[str, ...] = INTENTS):
+        self.dimensions = dimensions
+        self.intents = intents
+        self._weights: List[Dict[int, float]] = [{} for _ in intents]
+        self._bias = [0.0 for _ in intents]
+        # Tras entrenar: índice -> pesos de todas las intenciones, para predecir con un solo recorrido
+        self._table: Dict[int, Tuple[float, ...]] = {}
+        self.trained = False
+
+    def _probabilities(self, features: Dict[int, float]) -> List[float]:
+        scores = [
+            self._bias[k] + sum(value * weights.get(index, 0.0) for index, value in features.items())
+            for k, weights in enumerate(self._weights)
+        ]
+        return softmax(scores)
+
+    def fit(self, samples: List[Tuple[str, str]], epochs: int = 30, learning_rate: float = 0.5,
+            l2: float = 1e-4, seed: int = 13):
+        """Entrena con pares (texto, intención); las intenciones desconocidas se ignoran."""
+        data = [
+            (extract_features(text, self.dimensions), self.intents.index(intent))
+            for text, intent in samples if intent in self.intents
+        ]
+        if not data:
+            raise ValueError("No hay ejemplos etiquetados con intenciones conocidas")
+
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for features, label in data:
+                probabilities = self._probabilities(features)
+                for k, weights in enumerate(self._weights):
+                    gradient = probabilities[k] - (1.0 if k == label else 0.0)
+                    self._bias[k] -= rate * gradient
+                    for index, value in features.items():
+                        weight = weights.get(index, 0.0)
+                        weights[index] = weight - rate * (gradient * value + l2 * weight)
+
+        indexes = set().union(*self._weights)
+        self._table = {index: tuple(weights.get(index, 0.0) for weights in self._weights) for index in indexes}
+        self.trained = True
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Intención más probable y su probabilidad."""
+        scores = list(self._bias)
+        for index, value in extract_features(text, self.dimensions).items():
+            row = self._table.get(index)
+            if row is not None:
+                for k, weight in enumerate(row):
+                    scores[k] += value * weight
+        probabilities = softmax(scores)
+        best = max(range(len(self.intents)), key=lambda k: probabilities[k])
+        return self.intents[best], probabilities[best]
+
+
+def load_samples(path: str) -> List[Tuple[str, str]]:
+    with open(path, encoding="utf-8", newline="") as f:
+        return [(row["text"], row["intent"].strip()) for row in csv.DictReader(f) if row.get("text")]
+
+
+class IntentRouter:
+    """Clasificador entrenado más reglas de palabras clave como respaldo."""
+
+    def __init__(self, classifier: Optional[IntentClassifier], threshold: float = INTENT_CONFIDENCE_THRESHOLD):
+        self.classifier = classifier
+        self.threshold = threshold
+        self.stats = {"model": 0, "keywords": 0, **{intent: 0 for intent in INTENTS}}
+
+    def classify(self, text: str) -> IntentPrediction:
+        prediction = None
+        if self.classifier is not None and self.classifier.trained:
+            intent, confidence = self.classifier.predict(text)
+            if confidence >= self.threshold:
+                prediction = IntentPrediction(intent, round(confidence, 3), "model")
+        if prediction is None:
+            match = billing_matcher.match(text)
+            prediction = IntentPrediction("billing" if match else "general", 1.0 if match else 0.0, "keywords")
+        self.stats[prediction.source] += 1
+        self.stats[prediction.intent] += 1
+        return prediction
+
+
+def load_intent_router() -> IntentRouter:
+    """Entrena el clasificador con INTENTS_DATA_FILE; si falla, el router usa solo palabras clave."""
+    if not INTENT_CLASSIFIER_ENABLED:
+        return IntentRouter(None)
+    try:
+        started = time.perf_counter()
+        samples = load_samples(INTENTS_DATA_FILE)
+        classifier = IntentClassifier()
+        classifier.fit(samples)
+        logger.info(
+            f"[INTENT] Clasificador entrenado con {len(samples)} ejemplos en "
+            f"{(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return IntentRouter(classifier)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"[INTENT] No se pudo entrenar el clasificador con {INTENTS_DATA_FILE}: {e}")
+        return IntentRouter(None)
+
+
+intent_router = load_intent_router()
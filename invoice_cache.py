@@ -0,0 +1,173 @@
+# invoice_cache.py
+"""
+Caché de resultados de extracción de facturas direccionada por contenido.
+
+La clave es un hash del archivo más la versión de modelo/prompt, así que volver
+a subir la misma factura devuelve el resultado anterior sin llamar a OpenAI.
+Tiene un nivel LRU en memoria y un nivel opcional en disco (SQLite), ambos con
+límite de tamaño y expiración por TTL.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INVOICE_CACHE_ENABLED = os.getenv("INVOICE_CACHE_ENABLED", "true").lower() == "true"
+INVOICE_CACHE_MAX_ENTRIES = int(os.getenv("INVOICE_CACHE_MAX_ENTRIES", "256"))
+INVOICE_CACHE_TTL = float(os.getenv("INVOICE_CACHE_TTL", "86400"))
+INVOICE_CACHE_DB_PATH = os.getenv("INVOICE_CACHE_DB_PATH", "")
+INVOICE_CACHE_DISK_MAX_ENTRIES = int(os.getenv("INVOICE_CACHE_DISK_MAX_ENTRIES", "5000"))
+
+
+def make_cache_key(file_data: bytes, content_type: str, version: str) -> str:
+    """Clave de caché: SHA-256 del archivo, su tipo y la versión de modelo/prompt."""
+    digest = hashlib.sha256()
+    digest.update(version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content_type.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(file_data)
+    return digest.hexdigest()
+
+
+class SQLiteInvoiceStore:
+    """Nivel en disco de la caché. Las operaciones son síncronas y se llaman desde un hilo."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invoice_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_cache_access ON invoice_cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM invoice_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM invoice_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE invoice_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO invoice_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._conn.execute("DELETE FROM invoice_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM invoice_cache WHERE key IN ("
+                "SELECT key FROM invoice_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoice_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class InvoiceCache:
+    """Caché de dos niveles (memoria LRU + SQLite opcional) para resultados de extracción."""
+
+    def __init__(self, max_entries: int = INVOICE_CACHE_MAX_ENTRIES, ttl: float = INVOICE_CACHE_TTL,
+                 db_path: str = INVOICE_CACHE_DB_PATH, disk_max_entries: int = INVOICE_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._disk: Optional[SQLiteInvoiceStore] = None
+        if db_path:
+            try:
+                self._disk = SQLiteInvoiceStore(db_path, disk_max_entries, ttl)
+                logger.info(f"[INVOICE CACHE] Nivel en disco activo: {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"[INVOICE CACHE] No se pudo abrir la caché en disco {db_path}: {e}")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Devuelve una copia del resultado en caché, o None si no existe o expiró."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if time.time() - stored_at <= self.ttl:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return copy.deepcopy(value)
+            del self._memory[key]
+
+        if self._disk is not None:
+            try:
+                value = await asyncio.to_thread(self._disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"[INVOICE CACHE] Error leyendo caché en disco: {e}")
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                self.stats["disk_hits"] += 1
+                return copy.deepcopy(value)
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict):
+        """Guarda un resultado en memoria y, si está configurado, en disco."""
+        self._remember(key, copy.deepcopy(value))
+        self.stats["stores"] += 1
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"[INVOICE CACHE] Error escribiendo caché en disco: {e}")
+
+    def _remember(self, key: str, value: Dict):
+        self._memory[key] = (time.time(), value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def metrics(self) -> Dict:
+        """Contadores de aciertos/fallos y tamaño de cada nivel."""
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._disk is not None
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+invoice_cache = InvoiceCache() if INVOICE_CACHE_ENABLED else None
@@ -0,0 +1,323 @@
+# invoice_parser.py
+"""
+Parser local y determinista de facturas a partir del texto extraído del PDF.
+
+Toma las filas de las secciones "--- TABLAS PÁGINA n ---" que produce
+extract_text_from_pdf, identifica las columnas por su encabezado, normaliza los
+valores en formato colombiano ($ 1.234.567,89) y arma el mismo esquema que
+devuelve el modelo. Solo se acepta el resultado si los totales cuadran; si no,
+se devuelve None y la factura sigue su camino normal hacia el LLM.
+
+"observaciones" se llena con las notas escritas en la factura y con los conceptos
+de LOCAL_NON_CONTRACT_ITEMS; observaciones_evaluadas="reglas_locales" indica que
+no hubo criterio del modelo.
+"""
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INVOICE_LOCAL_PARSER_ENABLED = os.getenv("INVOICE_LOCAL_PARSER_ENABLED", "true").lower() == "true"
+
+# Sinónimos de encabezado por columna del esquema (ya normalizados: minúsculas y sin tildes)
+COLUMN_SYNONYMS = {
+    "item": ["item", "no", "nro", "n", "#", "linea"],
+    "descripcion": ["descripcion", "concepto", "detalle", "servicio", "descripcion del servicio"],
+    "cantidad": ["cantidad", "cant", "horas", "unidades", "qty"],
+    "valor_unitario": ["valor unitario", "vr unitario", "precio unitario", "valor unit", "tarifa", "precio", "vlr unitario"],
+    "total_concepto": ["total", "valor total", "vr total", "importe", "valor", "vlr total", "total linea"],
+}
+
+SUMMARY_LABELS = {
+    "subtotal": ["subtotal", "sub total", "base gravable"],
+    "descuento": ["descuento", "descuentos"],
+    "impuestos": ["iva", "impuesto", "impuestos"],
+    "total_factura": ["total a pagar", "total factura", "valor total factura", "total"],
+}
+
+# Conceptos que se reportan como posibles servicios no contractuales. Es más estricta que
+# NON_CONTRACT_HINTS de prompt_builder.py: al modelo "Desarrollador" le indica qué revisar,
+# pero aquí marcaría el servicio principal contratado en cada factura.
+LOCAL_NON_CONTRACT_ITEMS = ("configuracion inicial", "implementacion")
+
+NOTE_PATTERN = re.compile(r"^\s*(?:notas?|observaci[oó]n(?:es)?)\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+NUMBER_PATTERN = re.compile(r"-?\$?\s*\d[\d.,]*")
+PERCENT_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
+
+
+def normalize_label(text: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación, espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    text = re.sub(r"[^a-z0-9#%]+", " ", text)
+    return text.strip()
+
+
+def parse_colombian_number(raw: str) -> Optional[float]:
+    """
+    Convierte un valor en formato colombiano a número.
+    "$ 1.234.567,89" -> 1234567.89, "1.500" -> 1500, "19,5" -> 19.5.
+    También acepta formato anglosajón cuando no es ambiguo ("1,234,567.89").
+    """
+    if raw is None:
+        return None
+    text = re.sub(r"[^\d.,-]", "", str(raw))
+    if not re.search(r"\d", text):
+        return None
+    negative = text.startswith("-")
+    text = text.lstrip("-")
+
+    if "." in text and "," in text:
+        decimal_separator = "," if text.rfind(",") > text.rfind(".") else "."
+        thousands_separator = "." if decimal_separator == "," else ","
+        text = text.replace(thousands_separator, "").replace(decimal_separator, ".")
+    elif "." in text:
+        parts = text.split(".")
+        # Puntos como separadores de miles: varios puntos o grupo final de tres dígitos
+        if len(parts) > 2 or len(parts[-1]) == 3:
+            text = text.replace(".", "")
+    elif "," in text:
+        parts = text.split(",")
+        text = text.replace(",", "") if len(parts) > 2 else text.replace(",", ".")
+
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def parse_tables(extracted_text: str) -> List[List[List[str]]]:
+    """Reconstruye las tablas escritas por format_tables a partir del texto extraído."""
+    tables: List[List[List[str]]] = []
+    current: Optional[List[List[str]]] = None
+    in_tables_section = False
+
+    for line in extracted_text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("--- TABLAS PÁGINA"):
+            in_tables_section = True
+            current = None
+            continue
+        if stripped.startswith("--- PÁGINA"):
+            in_tables_section = False
+            current = None
+            continue
+        if not in_tables_section:
+            continue
+        if re.match(r"^Tabla \d+:$", stripped):
+            current = []
+            tables.append(current)
+            continue
+        if current is not None and " | " in line:
+            current.append([cell.strip() for cell in line.split(" | ")])
+    return tables
+
+
+def match_header(row: List[str]) -> Optional[Dict[str, int]]:
+    """Devuelve columna del esquema -> índice si la fila parece un encabezado de conceptos."""
+    columns: Dict[str, int] = {}
+    for index, cell in enumerate(row):
+        label = normalize_label(cell)
+        if not label:
+            continue
+        # Preferir la coincidencia más específica (sinónimo más largo)
+        best_column, best_length = None, 0
+        for column, synonyms in COLUMN_SYNONYMS.items():
+            if column in columns:
+                continue
+            for synonym in synonyms:
+                if (label == synonym or label.startswith(synonym + " ")) and len(synonym) > best_length:
+                    best_column, best_length = column, len(synonym)
+        if best_column:
+            columns[best_column] = index
+    if "descripcion" in columns and "total_concepto" in columns:
+        return columns
+    return None
+
+
+def summary_label(text: str) -> Optional[str]:
+    """Identifica filas/líneas de totales: subtotal, descuento, impuestos o total."""
+    label = normalize_label(text)
+    words = set(label.split())
+    if words & {"iva", "impuesto", "impuestos"}:
+        return "impuestos"
+    if words & {"descuento", "descuentos"}:
+        return "descuento"
+    for field in ("subtotal", "total_factura"):
+        for name in SUMMARY_LABELS[field]:
+            if label == name or label.startswith(name + " "):
+                return field
+    return None
+
+
+def last_number(cells: List[str]) -> Optional[float]:
+    for cell in reversed(cells):
+        value = parse_colombian_number(cell)
+        if value is not None:
+            return value
+    return None
+
+
+def find_summary_in_text(extracted_text: str) -> Dict[str, float]:
+    """Busca subtotal, IVA, descuento y total en líneas de texto como "IVA 19% $ 456.000"."""
+    summary: Dict[str, float] = {}
+    for line in extracted_text.splitlines():
+        field = summary_label(line)
+        if not field:
+            continue
+        numbers = NUMBER_PATTERN.findall(line)
+        percent = PERCENT_PATTERN.search(line)
+        if field == "impuestos" and percent:
+            summary.setdefault("tasa_impuestos", parse_colombian_number(percent.group(1)))
+            numbers = [n for n in numbers if n.strip() not in (percent.group(1),)]
+        value = parse_colombian_number(numbers[-1]) if numbers else None
+        if value is not None:
+            summary[field] = value
+    return summary
+
+
+def find_header_fields(extracted_text: str) -> Dict[str, str]:
+    """Datos de encabezado que se pueden leer con expresiones simples."""
+    fields = {"empresa_emisora": "", "numero_factura": "", "fecha_emision": "", "fecha_vencimiento": "", "periodo_facturado": ""}
+    date = r"(\d{1,4}[-/]\d{1,2}[-/]\d{1,4})"
+    for line in extracted_text.splitlines():
+        label = normalize_label(line)
+        if not fields["empresa_emisora"]:
+            company = re.search(r"([A-ZÁÉÍÓÚÑ][\w&.\- ]+?\s+S\.?\s?A\.?(?:\s?S\.?)?)\b", line)
+            if company:
+                fields["empresa_emisora"] = company.group(1).strip()
+        if not fields["numero_factura"] and ("factura" in label or "numero" in label or label.startswith("no ")):
+            number = re.search(r"\b([A-Z]{1,5}-?\d{2,}[\w-]*)\b", line)
+            if number:
+                fields["numero_factura"] = number.group(1)
+        if "vencimiento" in label:
+            found = re.search(date, line)
+            if found and not fields["fecha_vencimiento"]:
+                fields["fecha_vencimiento"] = found.group(1)
+        elif "periodo" in label and not fields["periodo_facturado"]:
+            fields["periodo_facturado"] = line.split(":", 1)[-1].strip()
+        elif "fecha" in label and not fields["fecha_emision"]:
+            found = re.search(date, line)
+            if found:
+                fields["fecha_emision"] = found.group(1)
+    return fields
+
+
+def build_observations(extracted_text: str, conceptos: List[Dict]) -> str:
+    """Notas de la factura y conceptos que coinciden con LOCAL_NON_CONTRACT_ITEMS."""
+    observations = []
+    for note in NOTE_PATTERN.findall(extracted_text):
+        note = note.strip()
+        if note and note not in observations:
+            observations.append(note)
+
+    flagged = [
+        concepto["descripcion"] for concepto in conceptos
+        if any(item in normalize_label(concepto.get("descripcion") or "") for item in LOCAL_NON_CONTRACT_ITEMS)
+    ]
+    if flagged:
+        observations.append("Posibles servicios no contractuales: " + "; ".join(flagged))
+    return ". ".join(observations)
+
+
+def amounts_match(expected: float, actual: float) -> bool:
+    return abs(expected - actual) <= max(1.0, abs(expected) * 0.005)
+
+
+def parse_invoice_text(extracted_text: str) -> Optional[Dict]:
+    """
+    Intenta extraer la factura sin modelo a partir de las tablas del PDF.
+
+    Returns:
+        Diccionario con el esquema de extracción si los totales cuadran, o None
+    """
+    conceptos: List[Dict] = []
+    summary: Dict[str, float] = {}
+
+    for table in parse_tables(extracted_text):
+        columns = None
+        for row in table:
+            if columns is None:
+                columns = match_header(row)
+                continue
+
+            first_text = " ".join(cell for cell in row if cell and not NUMBER_PATTERN.fullmatch(cell.strip()))
+            field = summary_label(first_text)
+            if field:
+                value = last_number(row)
+                if value is not None:
+                    summary[field] = value
+                continue
+
+            def cell(column: str) -> str:
+                index = columns.get(column)
+                return row[index] if index is not None and index < len(row) else ""
+
+            descripcion = cell("descripcion")
+            total_concepto = parse_colombian_number(cell("total_concepto"))
+            if not descripcion or total_concepto is None:
+                continue
+            conceptos.append({
+                "item": cell("item") or str(len(conceptos) + 1),
+                "descripcion": descripcion,
+                "cantidad": parse_colombian_number(cell("cantidad")),
+                "valor_unitario": parse_colombian_number(cell("valor_unitario")),
+                "total_concepto": total_concepto
+            })
+
+    if not conceptos:
+        return None
+
+    # Los totales que no estén en las tablas se buscan en el texto de la página
+    for field, value in find_summary_in_text(extracted_text).items():
+        summary.setdefault(field, value)
+
+    lines_total = sum(concepto["total_concepto"] for concepto in conceptos)
+    subtotal = summary.get("subtotal", lines_total)
+    descuento = summary.get("descuento", 0.0)
+    impuestos = summary.get("impuestos")
+    tasa_impuestos = summary.get("tasa_impuestos")
+    total_factura = summary.get("total_factura")
+
+    if impuestos is None and tasa_impuestos is not None:
+        impuestos = round((subtotal - descuento) * tasa_impuestos / 100, 2)
+    if tasa_impuestos is None and impuestos is not None and subtotal - descuento > 0:
+        tasa_impuestos = round(impuestos / (subtotal - descuento) * 100, 2)
+
+    # Reconciliación: cada línea, la suma de líneas y el total deben cuadrar
+    for concepto in conceptos:
+        if concepto["cantidad"] is not None and concepto["valor_unitario"] is not None:
+            if not amounts_match(concepto["cantidad"] * concepto["valor_unitario"], concepto["total_concepto"]):
+                logger.info(f"[INVOICE PARSER] Línea no cuadra: {concepto['descripcion']}")
+                return None
+    if not amounts_match(subtotal, lines_total):
+        logger.info(f"[INVOICE PARSER] Suma de conceptos {lines_total} no cuadra con subtotal {subtotal}")
+        return None
+    if total_factura is None or not amounts_match(subtotal - descuento + (impuestos or 0.0), total_factura):
+        logger.info("[INVOICE PARSER] Total de la factura ausente o no cuadra")
+        return None
+
+    def as_number(value: Optional[float]):
+        return int(value) if value is not None and float(value).is_integer() else value
+
+    for concepto in conceptos:
+        for key in ("cantidad", "valor_unitario", "total_concepto"):
+            concepto[key] = as_number(concepto[key])
+
+    return {
+        "tipo_documento": "factura",
+        **find_header_fields(extracted_text),
+        "conceptos": conceptos,
+        "subtotal": as_number(subtotal),
+        "descuento": as_number(descuento),
+        "tasa_impuestos": as_number(tasa_impuestos),
+        "impuestos": as_number(impuestos or 0.0),
+        "total_factura": as_number(total_factura),
+        "observaciones": build_observations(extracted_text, conceptos),
+        "observaciones_evaluadas": "reglas_locales",
+        "fuente_extraccion": "parser_local"
+    }
@@ -0,0 +1,126 @@
+# invoice_stream.py
+"""
+Parser incremental para la respuesta JSON de extracción de facturas.
+
+Recibe el texto del modelo a medida que llegan los tokens y emite cada campo
+de primer nivel (numero_factura, empresa_emisora, ...) y cada elemento del
+arreglo "conceptos" en cuanto está completo, sin esperar al JSON entero.
+"""
+import json
+from typing import Any, Dict, List
+
+STREAMED_ARRAY_FIELD = "conceptos"
+
+
+class InvoiceStreamParser:
+    """
+    Escáner de JSON tolerante a fragmentos.
+
+    Uso:
+        parser = InvoiceStreamParser()
+        for delta in tokens:
+            for event in parser.feed(delta):
+                ...
+
+    Eventos emitidos:
+        {"type": "field", "name": str, "value": Any}
+        {"type": "concepto", "index": int, "data": dict}
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start = None
+        self._current_key = None
+        self._value_start = None
+        self._item_start = None
+        self._item_count = 0
+
+    @property
+    def finished(self) -> bool:
+        """True cuando se cerró el objeto raíz."""
+        return self._finished
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Agrega un fragmento de texto y devuelve los eventos que quedaron completos."""
+        self.text += chunk
+        events: List[Dict[str, Any]] = []
+        text = self.text
+
+        while self._pos < len(text) and not self._finished:
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+
+            if not self._started:
+                # Ignorar cercas de markdown o texto antes del objeto raíz
+                if c == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._current_key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+            elif c == ":" and self._depth == 1:
+                self._expect_key = False
+                self._value_start = i + 1
+            elif c in "{[":
+                if self._depth == 2 and c == "{" and self._current_key == STREAMED_ARRAY_FIELD:
+                    self._item_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 2 and c == "}" and self._item_start is not None:
+                    self._emit_item(text[self._item_start:i + 1], events)
+                    self._item_start = None
+                elif self._depth == 0:
+                    self._emit_field(text[self._value_start:i] if self._value_start is not None else "", events)
+                    self._finished = True
+            elif c == "," and self._depth == 1:
+                self._emit_field(text[self._value_start:i], events)
+                self._expect_key = True
+                self._value_start = None
+
+        return events
+
+    def _emit_item(self, raw_item: str, events: List[Dict[str, Any]]):
+        try:
+            item = json.loads(raw_item)
+        except json.JSONDecodeError:
+            return
+        events.append({"type": "concepto", "index": self._item_count, "data": item})
+        self._item_count += 1
+
+    def _emit_field(self, raw_value: str, events: List[Dict[str, Any]]):
+        name = self._current_key
+        self._current_key = None
+        raw_value = raw_value.strip()
+        if name is None or not raw_value or name == STREAMED_ARRAY_FIELD:
+            # Los conceptos ya se emitieron uno a uno
+            return
+        try:
+            value = json.loads(raw_value)
+        except json.JSONDecodeError:
+            value = raw_value
+        events.append({"type": "field", "name": name, "value": value})
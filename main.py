@@ -2,10 +2,11 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Dict, Optional, Any
-import requests
+from typing import Dict, List, Optional, Any, Tuple
+import asyncio
+import httpx
 import json
 import logging
 from datetime import datetime
@@ -14,17 +15,42 @@ import uuid
 from deepgram import DeepgramClient, PrerecordedOptions
 import tempfile
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
-import base64
-from PIL import Image
 import io
 import json
-from uipath_integration import get_uipath_manager
+import mimetypes
+import time
+import zipfile
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Módulos locales que leen su configuración del entorno al importarse
+from intent_classifier import intent_router
+from invoice_cache import invoice_cache, make_cache_key
+from invoice_parser import INVOICE_LOCAL_PARSER_ENABLED, parse_invoice_text
+from image_preprocessing import ImagePreprocessConfig, preprocess_invoice_image_async, to_data_url
+from invoice_stream import InvoiceStreamParser
+from sentence_stream import SentenceChunker
+from session_pool import WarmSessionPool
+from session_store import session_store
+from session_reaper import SessionReaper
+from session_pipeline import REJECTED, SessionTaskPipeline
+from heygen_token import HeyGenTokenManager
+from openai_client import (
+    breaker_metrics, close_openai_client, get_breaker, get_openai_client, model_concurrency_metrics, model_slot,
+    set_default_model_concurrency
+)
+from prompt_builder import (
+    build_chat_messages, build_image_invoice_messages, build_pdf_invoice_messages, prompt_cache_stats
+)
+from response_cache import response_cache
+from pdf_extraction import (
+    PDF_EXTRACTION_ENGINE, extract_in_pool, extract_pages_pdfplumber, extract_pages_pymupdf,
+    extract_pages_tiered, shutdown_pdf_executor
+)
+from uipath_integration import get_uipath_job_queue, get_uipath_job_tracker, get_uipath_manager, shutdown_uipath_manager
+
 # Configuración de logging detallado para backend
 logging.basicConfig(
     level=logging.INFO,
@@ -54,6 +80,13 @@ app.add_middleware(
 HEYGEN_API_KEY = os.getenv("HEYGEN_API_KEY")
 HEYGEN_BASE_URL = os.getenv("HEYGEN_BASE_URL", "https://api.heygen.com/v1")
 
+# Configuración del pool HTTP asíncrono hacia HeyGen
+HEYGEN_HTTP_TIMEOUT = float(os.getenv("HEYGEN_HTTP_TIMEOUT", "30"))
+HEYGEN_HTTP_CONNECT_TIMEOUT = float(os.getenv("HEYGEN_HTTP_CONNECT_TIMEOUT", "10"))
+HEYGEN_MAX_CONNECTIONS = int(os.getenv("HEYGEN_MAX_CONNECTIONS", "50"))
+HEYGEN_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HEYGEN_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HEYGEN_KEEPALIVE_EXPIRY = float(os.getenv("HEYGEN_KEEPALIVE_EXPIRY", "60"))
+
 # Configuración Deepgram
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
 
@@ -119,16 +152,38 @@ Tono de comunicación:
 - Técnico cuando se requiera, pero explicando en términos comprensibles
 """)
 
+# Modelo y versión de prompt para extracción de facturas.
+# Forman parte de la clave de caché: incrementar la versión al cambiar los prompts.
+INVOICE_MODEL = os.getenv("INVOICE_MODEL", "gpt-4o")
+INVOICE_PROMPT_VERSION = "4"
+
+# Preprocesamiento de imágenes de facturas (ver image_preprocessing.py)
+invoice_image_config = ImagePreprocessConfig()
+
+# Extracción por lotes: llamadas simultáneas al modelo y límites de entrada
+INVOICE_BATCH_CONCURRENCY = int(os.getenv("INVOICE_BATCH_CONCURRENCY", "4"))
+INVOICE_BATCH_MAX_FILES = int(os.getenv("INVOICE_BATCH_MAX_FILES", "100"))
+INVOICE_MAX_FILE_BYTES = int(os.getenv("INVOICE_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+INVOICE_ALLOWED_TYPES = ["image/jpeg", "image/png", "image/jpg", "application/pdf"]
+ZIP_CONTENT_TYPES = ["application/zip", "application/x-zip-compressed"]
+
+# Limita las llamadas concurrentes al modelo de extracción de facturas
+# (OPENAI_MODEL_CONCURRENCY tiene prioridad si define un límite para INVOICE_MODEL)
+set_default_model_concurrency(INVOICE_MODEL, INVOICE_BATCH_CONCURRENCY)
+
+# Modelo de las respuestas conversacionales
+CHAT_MODEL = "gpt-5-nano"
+
+# Respuesta cuando el modelo no devuelve texto (nunca se guarda en caché)
+EMPTY_RESPONSE_MESSAGE = "Lo siento, no pude generar una respuesta en este momento."
+
+# Streaming de respuestas: el avatar empieza a hablar con la primera frase completa
+OPENAI_STREAMING_ENABLED = os.getenv("OPENAI_STREAMING_ENABLED", "true").lower() == "true"
+OPENAI_STREAM_MIN_SENTENCE_CHARS = int(os.getenv("OPENAI_STREAM_MIN_SENTENCE_CHARS", "20"))
+
 # Variables globales para configuración dinámica
 current_openai_key = OPENAI_API_KEY
 current_system_message = OPENAI_SYSTEM_MESSAGE
-openai_client = None
-
-# Almacenamiento de sesiones activas
-active_sessions: Dict[str, dict] = {}
-
-# Almacenamiento de emails validados por sesión
-validated_emails: Dict[str, str] = {}
 
 # Mensajes alternantes para respuestas de UiPath
 UIPATH_RESPONSES = [
@@ -207,39 +262,66 @@ class HeyGenSessionManager:
             "content-type": "application/json",
             "x-api-key": HEYGEN_API_KEY
         }
-        self.session_token: Optional[str] = None
+        self.tokens = HeyGenTokenManager(self._fetch_session_token)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Devuelve el cliente HTTP compartido (pool keep-alive) creándolo la primera vez."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=HEYGEN_BASE_URL,
+                timeout=httpx.Timeout(HEYGEN_HTTP_TIMEOUT, connect=HEYGEN_HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HEYGEN_MAX_CONNECTIONS,
+                    max_keepalive_connections=HEYGEN_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HEYGEN_KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
 
-    async def _get_session_token(self):
-        """Obtiene un token de sesión temporal de la API de HeyGen."""
-        if self.session_token:
-            return
-        url = f"{HEYGEN_BASE_URL}/streaming.create_token"
-        logger.info("Obteniendo nuevo token de sesión de HeyGen...")
+    async def aclose(self):
+        """Cierra el pool de conexiones hacia HeyGen."""
+        await self.tokens.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch_session_token(self) -> str:
+        """Pide un token de sesión temporal a la API de HeyGen."""
         try:
-            response = requests.post(url, headers=self.api_key_headers)
+            response = await self._get_client().post("/streaming.create_token", headers=self.api_key_headers)
             response.raise_for_status()
-            data = response.json().get('data', {})
-            self.session_token = data.get('token')
-            if not self.session_token:
-                raise HTTPException(status_code=500, detail="Failed to retrieve session token from HeyGen.")
-            logger.info("Token de sesión obtenido con éxito.")
-        except requests.exceptions.RequestException as e:
+            token = response.json().get('data', {}).get('token')
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Error getting session token: {str(e)}")
+        if not token:
+            raise HTTPException(status_code=500, detail="Failed to retrieve session token from HeyGen.")
+        return token
 
-    async def _get_auth_headers(self) -> dict:
-        """Asegura que hay un token y devuelve los headers de autorización."""
-        await self._get_session_token()
+    def _auth_headers(self, token: str) -> dict:
         return {
             "accept": "application/json",
             "content-type": "application/json",
             "x-api-key": HEYGEN_API_KEY,
-            "authorization": f"Bearer {self.session_token}"
+            "authorization": f"Bearer {token}"
         }
 
+    async def _post(self, path: str, payload: dict) -> httpx.Response:
+        """
+        POST autenticado con el token compartido. Ante un 401 descarta el token,
+        pide uno nuevo y reintenta una sola vez. Devuelve la respuesta sin validar el status.
+        """
+        token = await self.tokens.get_token()
+        response = await self._get_client().post(path, json=payload, headers=self._auth_headers(token))
+        if response.status_code == 401:
+            logger.warning(f"Token de HeyGen rechazado en {path}, renovando y reintentando")
+            self.tokens.invalidate(token)
+            token = await self.tokens.refresh()
+            response = await self._get_client().post(path, json=payload, headers=self._auth_headers(token))
+        return response
+
     async def create_session(self, config: SessionConfig) -> dict:
         """Crea una nueva sesión en HeyGen y devuelve los datos, incluyendo credenciales de LiveKit."""
-        auth_headers = await self._get_auth_headers()
-        url = f"{HEYGEN_BASE_URL}/streaming.new"
         payload = {
             "quality": config.quality,
             "avatar_id": config.avatar_id,
@@ -251,28 +333,24 @@ class HeyGenSessionManager:
             "activity_idle_timeout": config.activity_idle_timeout
         }
         try:
-            response = requests.post(url, json=payload, headers=auth_headers)
+            response = await self._post("/streaming.new", payload)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Error creating session: {str(e)}")
 
     async def start_session(self, session_id: str) -> dict:
         """Inicia una sesión creada."""
-        auth_headers = await self._get_auth_headers()
-        url = f"{HEYGEN_BASE_URL}/streaming.start"
         payload = {"session_id": session_id}
         try:
-            response = requests.post(url, json=payload, headers=auth_headers)
+            response = await self._post("/streaming.start", payload)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Error starting session: {str(e)}")
 
     async def send_task(self, session_id: str, text: str, task_type: str) -> dict:
         """Envía una tarea a la sesión activa."""
-        auth_headers = await self._get_auth_headers()
-        url = f"{HEYGEN_BASE_URL}/streaming.task"
         payload = {
             "session_id": session_id,
             "text": text,
@@ -280,256 +358,298 @@ class HeyGenSessionManager:
         }
         try:
             logger.debug(f"Enviando tarea a HeyGen: {payload}")
-            response = requests.post(url, json=payload, headers=auth_headers)
+            response = await self._post("/streaming.task", payload)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPStatusError as e:
             logger.error(f"Error enviando tarea a HeyGen: {str(e)}")
             logger.error(f"Payload enviado: {payload}")
-            logger.error(f"Status code: {getattr(e.response, 'status_code', 'N/A')}")
-            if hasattr(e.response, 'text'):
-                logger.error(f"Respuesta HeyGen: {e.response.text}")
+            logger.error(f"Status code: {e.response.status_code}")
+            logger.error(f"Respuesta HeyGen: {e.response.text}")
 
             # Detectar si es un error de sesión expirada o inválida (400 BAD REQUEST)
-            if hasattr(e.response, 'status_code') and e.response.status_code == 400:
+            if e.response.status_code == 400:
                 logger.warning(f"Sesión {session_id} parece estar expirada o inválida")
                 raise HTTPException(status_code=400, detail="Session expired or invalid")
 
             raise HTTPException(status_code=500, detail=f"Error sending task: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error(f"Error enviando tarea a HeyGen: {str(e)}")
+            logger.error(f"Payload enviado: {payload}")
+            raise HTTPException(status_code=500, detail=f"Error sending task: {str(e)}")
 
     async def close_session(self, session_id: str) -> dict:
         """Cierra una sesión activa."""
-        auth_headers = await self._get_auth_headers()
-        url = f"{HEYGEN_BASE_URL}/streaming.stop"
         payload = {"session_id": session_id}
         try:
-            response = requests.post(url, json=payload, headers=auth_headers)
+            response = await self._post("/streaming.stop", payload)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(status_code=500, detail=f"Error closing session: {str(e)}")
 
 session_manager = HeyGenSessionManager()
 
-# Función para procesar facturas con OpenAI
-async def process_invoice_with_vision(file_data: bytes, content_type: str) -> dict:
+
+async def create_started_session(config: SessionConfig) -> dict:
+    """Crea una sesión en HeyGen, la inicia y devuelve sus datos (session_id, url, access_token)."""
+    create_response = await session_manager.create_session(config)
+    session_data = create_response.get('data')
+    if not session_data or 'session_id' not in session_data:
+        raise HTTPException(status_code=500, detail="Respuesta inválida al crear sesión en HeyGen.")
+    await session_manager.start_session(session_data['session_id'])
+    return session_data
+
+
+# Sesiones precalentadas con la configuración por defecto (HEYGEN_WARM_POOL_SIZE > 0)
+session_pool = WarmSessionPool(SessionConfig(), create_started_session, session_manager.close_session)
+
+# Purga de sesiones vencidas y emails validados antiguos
+session_reaper = SessionReaper(session_store, session_manager.close_session)
+
+# Mínimo de segundos entre registros de actividad de una misma conexión WebSocket
+SESSION_TOUCH_INTERVAL = 5.0
+
+
+@app.on_event("startup")
+async def start_background_services():
+    """Arranca el pool de sesiones calientes (si está habilitado) y la purga de sesiones."""
+    session_pool.start()
+    session_reaper.start()
+
+@app.on_event("shutdown")
+async def release_shared_resources():
+    """Libera los pools de conexiones HTTP y de procesos al apagar el servidor."""
+    await session_reaper.stop()
+    await session_pool.stop()
+    await session_manager.aclose()
+    await shutdown_uipath_manager()
+    shutdown_pdf_executor()
+    await close_openai_client()
+    if invoice_cache is not None:
+        invoice_cache.close()
+    session_store.close()
+
+# Funciones para procesar facturas con OpenAI
+async def prepare_invoice_request(file_data: bytes, content_type: str,
+                                  image_config: Optional[ImagePreprocessConfig] = None) -> Tuple[dict, str]:
     """
-    Procesa una factura (PDF o imagen) usando OpenAI para extraer datos financieros estructurados.
+    Prepara la petición de chat.completions para extraer datos de una factura.
+    Devuelve los argumentos de la llamada y el texto extraído (solo para PDFs).
+    """
+    extracted_text = ""
+
+    if content_type == "application/pdf":
+        # Procesar PDF para extraer texto
+        extracted_text = await extract_text_from_pdf(file_data)
+        logger.info(f"[INVOICE] Texto extraído del PDF: {len(extracted_text)} caracteres")
+
+        # Instrucciones fijas primero y texto de la factura al final (prefijo cacheable)
+        request = {
+            "model": INVOICE_MODEL,
+            "messages": build_pdf_invoice_messages(extracted_text),
+            "max_tokens": 1500,
+            "temperature": 0.1
+        }
+
+    else:
+        # Preprocesar imagen (recorte, inclinación, color, calidad adaptativa, bloques) fuera del event loop
+        image_config = image_config or invoice_image_config
+        images = await preprocess_invoice_image_async(file_data, image_config)
+        logger.info(f"[INVOICE] Imagen preprocesada: {len(images)} bloque(s), {sum(len(data) for data, _ in images)} bytes")
+
+        request = {
+            "model": INVOICE_MODEL,
+            "messages": build_image_invoice_messages(
+                [to_data_url(data, mime_type) for data, mime_type in images], image_config.detail
+            ),
+            "max_tokens": 1500
+        }
+
+    return request, extracted_text
+
+
+def parse_invoice_response(raw_response: str, content_type: str, extracted_text: str) -> dict:
+    """
+    Convierte la respuesta del modelo en el diccionario de datos de la factura.
+    Si el JSON no se puede parsear devuelve una estructura básica marcada con "error".
     """
     try:
-        extracted_text = ""
+        # Limpiar la respuesta si tiene markdown
+        if raw_response.startswith('```json'):
+            raw_response = raw_response.replace('```json\n', '').replace('\n```', '')
+        elif raw_response.startswith('```'):
+            raw_response = raw_response.replace('```\n', '').replace('\n```', '')
+
+        extracted_data = json.loads(raw_response)
+
+        # Validar estructura básica
+        if not isinstance(extracted_data, dict):
+            raise ValueError("Respuesta no es un objeto JSON válido")
 
+        # Agregar el texto extraído en caso de PDF para referencia
         if content_type == "application/pdf":
-            # Procesar PDF para extraer texto
-            extracted_text = await extract_text_from_pdf(file_data)
-            logger.info(f"[INVOICE] Texto extraído del PDF: {len(extracted_text)} caracteres")
-
-            # Usar OpenAI para procesar el texto extraído
-            client = OpenAI(api_key=current_openai_key)
-
-            # Prompt especializado para analizar texto de facturas
-            system_prompt = f"""
-            Analiza el siguiente texto extraído de una factura PDF y extrae los datos financieros estructurados.
-
-            TEXTO DE LA FACTURA:
-            {extracted_text}
-
-            Devuelve SOLO un JSON válido con esta estructura exacta:
-            {{
-              "tipo_documento": "factura",
-              "empresa_emisora": "nombre de la empresa",
-              "numero_factura": "número si está visible",
-              "fecha_emision": "fecha de emisión",
-              "fecha_vencimiento": "fecha de vencimiento si está visible",
-              "periodo_facturado": "período que cubre la factura",
-              "conceptos": [
-                {{
-                  "item": "número de ítem",
-                  "descripcion": "descripción del servicio/concepto",
-                  "cantidad": numero_cantidad,
-                  "valor_unitario": valor_numérico,
-                  "total_concepto": valor_numérico
-                }}
-              ],
-              "subtotal": valor_numérico,
-              "descuento": valor_numérico,
-              "tasa_impuestos": porcentaje_numérico,
-              "impuestos": valor_numérico,
-              "total_factura": valor_numérico,
-              "observaciones": "cualquier nota importante o servicios no contractuales detectados"
-            }}
-
-            IMPORTANTE:
-            - Extrae TODOS los conceptos/ítems facturados de la tabla
-            - Identifica servicios que puedan no estar en contrato original
-            - Valores numéricos sin símbolos de moneda, puntos ni comas
-            - Si no encuentras un campo, usa null o ""
-            - Busca especialmente ítems como "Configuración inicial", "Implementación", "Desarrollador"
-            """
-
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "user", "content": system_prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.1
-            )
+            extracted_data["raw_extracted_text"] = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
 
-            raw_response = response.choices[0].message.content.strip()
+        return extracted_data
 
-        else:
-            # Procesar imagen como antes
-            image = Image.open(io.BytesIO(file_data))
-
-            # Redimensionar si es muy grande (opcional)
-            max_size = (2048, 2048)
-            if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-                image.thumbnail(max_size, Image.Resampling.LANCZOS)
-
-            # Convertir a RGB si es necesario
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-
-            # Convertir a base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-            # Crear cliente OpenAI
-            client = OpenAI(api_key=current_openai_key)
-
-            # Prompt especializado para extraer datos de facturas con Vision
-            system_prompt = """
-            Eres un experto en análisis de facturas. Extrae TODOS los datos financieros de esta factura.
-
-            Devuelve SOLO un JSON válido con esta estructura exacta:
-            {
-              "tipo_documento": "factura",
-              "empresa_emisora": "nombre de la empresa",
-              "numero_factura": "número si está visible",
-              "fecha_emision": "fecha de emisión",
-              "fecha_vencimiento": "fecha de vencimiento si está visible",
-              "periodo_facturado": "período que cubre la factura",
-              "conceptos": [
-                {
-                  "item": "número de ítem",
-                  "descripcion": "descripción del servicio/concepto",
-                  "cantidad": numero_cantidad,
-                  "valor_unitario": valor_numérico,
-                  "total_concepto": valor_numérico
-                }
-              ],
-              "subtotal": valor_numérico,
-              "descuento": valor_numérico,
-              "tasa_impuestos": porcentaje_numérico,
-              "impuestos": valor_numérico,
-              "total_factura": valor_numérico,
-              "observaciones": "cualquier nota importante o servicios no contractuales detectados"
-            }
+    except json.JSONDecodeError as e:
+        logger.error(f"[INVOICE] Error parsing JSON response: {e}")
+        logger.error(f"[INVOICE] Raw response: {raw_response}")
 
-            IMPORTANTE:
-            - Extrae TODOS los conceptos facturados
-            - Identifica servicios que puedan no estar en contrato original
-            - Valores numéricos sin símbolos de moneda, puntos ni comas, solo números
-            - Si no encuentras un campo, usa null o ""
-            """
-
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": system_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1500
-            )
+        # Retornar estructura básica con texto raw
+        return {
+            "tipo_documento": "factura",
+            "error": "No se pudo parsear JSON automáticamente",
+            "raw_text": raw_response,
+            "raw_extracted_text": extracted_text if content_type == "application/pdf" else "",
+            "empresa_emisora": "Detectado automáticamente",
+            "observaciones": "Requiere revisión manual - Error en extracción automática"
+        }
 
-            raw_response = response.choices[0].message.content.strip()
 
-        # Parsear JSON de la respuesta (común para PDF e imagen)
-        try:
-            # Limpiar la respuesta si tiene markdown
-            if raw_response.startswith('```json'):
-                raw_response = raw_response.replace('```json\n', '').replace('\n```', '')
-            elif raw_response.startswith('```'):
-                raw_response = raw_response.replace('```\n', '').replace('\n```', '')
+def try_local_invoice_parse(content_type: str, extracted_text: str) -> Optional[dict]:
+    """
+    Ruta rápida sin LLM: intenta leer la factura con el parser local a partir de las
+    tablas del PDF. Devuelve None si no aplica o si los totales no cuadran.
+    """
+    if not INVOICE_LOCAL_PARSER_ENABLED or content_type != "application/pdf" or not extracted_text:
+        return None
+    extracted_data = parse_invoice_text(extracted_text)
+    if extracted_data is None:
+        return None
+    extracted_data["raw_extracted_text"] = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
+    logger.info(f"[INVOICE] Factura extraída con el parser local ({len(extracted_data['conceptos'])} conceptos)")
+    return extracted_data
+
+
+def invoice_result_events(extracted_data: dict):
+    """Eventos de streaming para un resultado que ya está completo (caché o parser local)."""
+    for name, value in extracted_data.items():
+        if name != "conceptos":
+            yield {"type": "field", "name": name, "value": value}
+    for index, concepto in enumerate(extracted_data.get("conceptos") or []):
+        yield {"type": "concepto", "index": index, "data": concepto}
+
+
+def invoice_cache_key(file_data: bytes, content_type: str) -> Optional[str]:
+    """Clave de caché de la factura, o None si la caché está desactivada."""
+    if invoice_cache is None:
+        return None
+    version = f"{INVOICE_MODEL}:{INVOICE_PROMPT_VERSION}"
+    if content_type != "application/pdf":
+        # Otra configuración de preprocesamiento puede producir otro resultado
+        version += f":{invoice_image_config.signature()}"
+    return make_cache_key(file_data, content_type, version)
 
-            extracted_data = json.loads(raw_response)
 
-            # Validar estructura básica
-            if not isinstance(extracted_data, dict):
-                raise ValueError("Respuesta no es un objeto JSON válido")
+async def process_invoice_with_vision(file_data: bytes, content_type: str) -> dict:
+    """
+    Procesa una factura (PDF o imagen) usando OpenAI para extraer datos financieros estructurados.
+    Los resultados se guardan en caché por hash del archivo, modelo y versión de prompt.
+    """
+    cache_key = invoice_cache_key(file_data, content_type)
+    if cache_key is not None:
+        cached_data = await invoice_cache.get(cache_key)
+        if cached_data is not None:
+            logger.info(f"[INVOICE] Resultado servido desde caché ({cache_key[:12]})")
+            return cached_data
 
-            # Agregar el texto extraído en caso de PDF para referencia
-            if content_type == "application/pdf":
-                extracted_data["raw_extracted_text"] = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
+    try:
+        request, extracted_text = await prepare_invoice_request(file_data, content_type)
 
-            return extracted_data
+        # Si las tablas del PDF cuadran, no hace falta llamar al modelo
+        local_data = try_local_invoice_parse(content_type, extracted_text)
+        if local_data is not None:
+            if cache_key is not None:
+                await invoice_cache.set(cache_key, local_data)
+            return local_data
 
-        except json.JSONDecodeError as e:
-            logger.error(f"[INVOICE] Error parsing JSON response: {e}")
-            logger.error(f"[INVOICE] Raw response: {raw_response}")
+        client = get_openai_client(current_openai_key)
 
-            # Retornar estructura básica con texto raw
-            return {
-                "tipo_documento": "factura",
-                "error": "No se pudo parsear JSON automáticamente",
-                "raw_text": raw_response,
-                "raw_extracted_text": extracted_text if content_type == "application/pdf" else "",
-                "empresa_emisora": "Detectado automáticamente",
-                "observaciones": "Requiere revisión manual - Error en extracción automática"
-            }
+        async with model_slot(request["model"]):
+            response = await client.chat.completions.create(**request)
+        prompt_cache_stats.record("invoice", response.usage)
+
+        raw_response = response.choices[0].message.content.strip()
+
+        # Parsear JSON de la respuesta (común para PDF e imagen)
+        extracted_data = parse_invoice_response(raw_response, content_type, extracted_text)
+        if cache_key is not None and "error" not in extracted_data:
+            await invoice_cache.set(cache_key, extracted_data)
+
+        return extracted_data
 
     except Exception as e:
         logger.error(f"[INVOICE] Error in processing: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
 
 
+async def stream_invoice_extraction(file_data: bytes, content_type: str):
+    """
+    Versión en streaming de process_invoice_with_vision.
+    Consume los tokens del modelo y produce eventos en cuanto cada campo o concepto
+    está completo; el último evento es "done" con los datos completos.
+    """
+    cache_key = invoice_cache_key(file_data, content_type)
+    if cache_key is not None:
+        cached_data = await invoice_cache.get(cache_key)
+        if cached_data is not None:
+            logger.info(f"[INVOICE] Resultado servido desde caché ({cache_key[:12]})")
+            for event in invoice_result_events(cached_data):
+                yield event
+            yield {"type": "done", "cached": True, "extracted_data": cached_data}
+            return
+
+    request, extracted_text = await prepare_invoice_request(file_data, content_type)
+
+    local_data = try_local_invoice_parse(content_type, extracted_text)
+    if local_data is not None:
+        if cache_key is not None:
+            await invoice_cache.set(cache_key, local_data)
+        for event in invoice_result_events(local_data):
+            yield event
+        yield {"type": "done", "cached": False, "extracted_data": local_data}
+        return
+
+    client = get_openai_client(current_openai_key)
+    parser = InvoiceStreamParser()
+
+    async with model_slot(request["model"]):
+        stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+        async for chunk in stream:
+            if chunk.usage is not None:
+                prompt_cache_stats.record("invoice", chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                for event in parser.feed(delta):
+                    yield event
+
+    extracted_data = parse_invoice_response(parser.text.strip(), content_type, extracted_text)
+    if cache_key is not None and "error" not in extracted_data:
+        await invoice_cache.set(cache_key, extracted_data)
+    yield {"type": "done", "cached": False, "extracted_data": extracted_data}
+
+
 # Función auxiliar para extraer texto de PDFs
 async def extract_text_from_pdf(pdf_data: bytes) -> str:
     """
-    Extrae texto de un archivo PDF usando pdfplumber para mejor manejo de tablas.
+    Extrae texto de un archivo PDF. Con el motor "tiered" el texto sale de PyMuPDF
+    y solo las páginas con aspecto de tabla pasan por pdfplumber; si eso no produce
+    texto se usa el análisis completo de pdfplumber.
+    La extracción corre en el pool de procesos, repartiendo las páginas entre workers.
     """
     try:
-        import pdfplumber
-        import io
-
-        # Crear objeto de archivo en memoria
-        pdf_file = io.BytesIO(pdf_data)
-
         extracted_text = ""
+        if PDF_EXTRACTION_ENGINE == "tiered":
+            extracted_text = await extract_in_pool(extract_pages_tiered, pdf_data)
+            if not extracted_text.strip():
+                logger.warning("[PDF] PyMuPDF no extrajo texto, usando análisis completo con pdfplumber...")
 
-        with pdfplumber.open(pdf_file) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                logger.info(f"[PDF] Procesando página {page_num + 1}")
-
-                # Extraer texto de la página
-                page_text = page.extract_text()
-                if page_text:
-                    extracted_text += f"\n--- PÁGINA {page_num + 1} ---\n"
-                    extracted_text += page_text
-
-                # Intentar extraer tablas si las hay
-                tables = page.extract_tables()
-                if tables:
-                    extracted_text += f"\n--- TABLAS PÁGINA {page_num + 1} ---\n"
-                    for table_num, table in enumerate(tables):
-                        extracted_text += f"\nTabla {table_num + 1}:\n"
-                        for row in table:
-                            if row:  # Evitar filas vacías
-                                row_text = " | ".join([str(cell) if cell else "" for cell in row])
-                                extracted_text += row_text + "\n"
+        if not extracted_text.strip():
+            extracted_text = await extract_in_pool(extract_pages_pdfplumber, pdf_data)
 
         if not extracted_text.strip():
             # Si pdfplumber no pudo extraer texto, intentar con pymupdf como fallback
@@ -538,6 +658,8 @@ async def extract_text_from_pdf(pdf_data: bytes) -> str:
 
         return extracted_text.strip()
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[PDF] Error extracting text with pdfplumber: {str(e)}")
         # Fallback a pymupdf
@@ -554,23 +676,7 @@ async def extract_text_with_pymupdf(pdf_data: bytes) -> str:
     Extrae texto de un PDF usando pymupdf como fallback.
     """
     try:
-        import fitz  # pymupdf
-        import io
-
-        # Abrir PDF desde bytes
-        pdf_document = fitz.open(stream=pdf_data, filetype="pdf")
-
-        extracted_text = ""
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            page_text = page.get_text()
-
-            if page_text.strip():
-                extracted_text += f"\n--- PÁGINA {page_num + 1} ---\n"
-                extracted_text += page_text
-
-        pdf_document.close()
+        extracted_text = await extract_in_pool(extract_pages_pymupdf, pdf_data)
 
         if not extracted_text.strip():
             raise ValueError("No se pudo extraer texto del PDF - posiblemente sea un PDF escaneado")
@@ -582,77 +688,281 @@ async def extract_text_with_pymupdf(pdf_data: bytes) -> str:
         raise HTTPException(status_code=500, detail=f"Error extrayendo texto con pymupdf: {str(e)}")
 
 # Función para procesar texto con OpenAI
+def cached_response(user_input: str) -> Optional[str]:
+    """Respuesta guardada para la pregunta (exacta o muy parecida), o None."""
+    if response_cache is None:
+        return None
+    return response_cache.get(user_input, current_system_message)
+
+
+def remember_response(user_input: str, response_text: str):
+    if response_cache is not None and response_text and response_text != EMPTY_RESPONSE_MESSAGE:
+        response_cache.set(user_input, response_text, current_system_message)
+
+
 async def process_with_openai(user_input: str) -> str:
+    """
+    Responde al usuario desde la caché de respuestas si la pregunta ya se hizo;
+    si no, consulta a OpenAI y guarda la respuesta.
+    """
+    response_text = cached_response(user_input)
+    if response_text is not None:
+        logger.info("[RESPONSE CACHE] Respuesta servida desde caché")
+        return response_text
+
+    response_text = await request_openai_response(user_input)
+    remember_response(user_input, response_text)
+    return response_text
+
+
+async def request_openai_response(user_input: str) -> str:
     """
     Procesa el input del usuario con OpenAI GPT-5-nano optimizado para máxima velocidad.
     """
-    global openai_client, current_openai_key, current_system_message
+    global current_openai_key, current_system_message
     
     if not current_openai_key:
         raise HTTPException(status_code=400, detail="OpenAI API key not configured")
     
     try:
-        # Inicializar cliente si no existe o si cambió la API key
-        if openai_client is None or openai_client.api_key != current_openai_key:
-            openai_client = OpenAI(api_key=current_openai_key)
+        # Cliente compartido (se recrea solo si cambió la API key)
+        openai_client = get_openai_client(current_openai_key)
         
-        # Intentar usar la nueva API de GPT-5 con parámetros de velocidad
+        # Intentar usar la nueva API de GPT-5 con parámetros de velocidad, salvo que su
+        # breaker esté abierto: entonces se va directo a chat completions (una sola llamada)
+        responses_breaker = get_breaker(CHAT_MODEL, "responses")
+        if responses_breaker.allow():
+            try:
+                async with model_slot(CHAT_MODEL):
+                    response = await openai_client.responses.create(
+                        model=CHAT_MODEL,
+                        input=build_chat_messages(current_system_message, user_input),
+                        reasoning={
+                            "effort": "minimal"  # Máxima velocidad, mínimo razonamiento
+                        },
+                        text={
+                            "verbosity": "low"   # Respuestas concisas
+                        }
+                    )
+                responses_breaker.record_success()
+                prompt_cache_stats.record("chat", response.usage)
+
+                # Acceder al texto de respuesta según la documentación de GPT-5 nano
+                response_text = ""
+                if hasattr(response, 'output_text'):
+                    response_text = response.output_text.strip()
+                elif hasattr(response, 'text'):
+                    response_text = response.text.strip()
+                else:
+                    logger.warning(f"Estructura de respuesta desconocida: {type(response)}")
+                    response_text = str(response).strip()
+
+                # Validar que el contenido no esté vacío
+                if not response_text:
+                    logger.error("La respuesta de OpenAI está vacía")
+                    return EMPTY_RESPONSE_MESSAGE
+
+                return response_text
+
+            except Exception as gpt5_error:
+                responses_breaker.record_failure()
+                logger.warning(f"Error con nueva API GPT-5, usando fallback: {str(gpt5_error)}")
+                logger.debug(f"Tipo de error GPT-5: {type(gpt5_error).__name__}")
+            finally:
+                # Una llamada cancelada no pasa por record_*: liberar la prueba de half_open
+                responses_breaker.cancel_probe()
+
+        # Fallback a la API tradicional de chat completions
+        completions_breaker = get_breaker(CHAT_MODEL, "chat.completions")
         try:
-            response = openai_client.responses.create(
-                model="gpt-5-nano",
-                input=[
-                    {"role": "system", "content": current_system_message},
-                    {"role": "user", "content": user_input}
-                ],
-                reasoning={
-                    "effort": "minimal"  # Máxima velocidad, mínimo razonamiento
-                },
-                text={
-                    "verbosity": "low"   # Respuestas concisas
-                }
-            )
-            # Acceder al texto de respuesta según la documentación de GPT-5 nano
-            response_text = ""
-            if hasattr(response, 'output_text'):
-                response_text = response.output_text.strip()
-            elif hasattr(response, 'text'):
-                response_text = response.text.strip()
-            else:
-                logger.warning(f"Estructura de respuesta desconocida: {type(response)}")
-                response_text = str(response).strip()
+            async with model_slot(CHAT_MODEL):
+                response = await openai_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=build_chat_messages(current_system_message, user_input),
+                    max_completion_tokens=500       # Enfocar en tokens más probables
+                )
+        except Exception:
+            completions_breaker.record_failure()
+            raise
+        completions_breaker.record_success()
+        prompt_cache_stats.record("chat", response.usage)
+        response_text = response.choices[0].message.content.strip()
+
+        # Validar que el contenido no esté vacío
+        if not response_text:
+            logger.error("La respuesta de OpenAI (fallback) está vacía")
+            return EMPTY_RESPONSE_MESSAGE
+
+        return response_text
+        
+    except Exception as e:
+        logger.error(f"Error processing with OpenAI: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing with OpenAI: {str(e)}")
+
+
+async def stream_with_openai(user_input: str):
+    """
+    Versión en streaming de process_with_openai: produce los deltas de texto a medida
+    que llegan. Respeta el breaker de la API Responses; si falla antes del primer
+    delta (excepción o eventos response.failed / error) se usa chat completions,
+    pero si ya se emitió texto el error se propaga para no repetir frases en el avatar.
+    """
+    if not current_openai_key:
+        raise HTTPException(status_code=400, detail="OpenAI API key not configured")
 
-            # Validar que el contenido no esté vacío
-            if not response_text:
-                logger.error("La respuesta de OpenAI está vacía")
-                return "Lo siento, no pude generar una respuesta en este momento."
+    openai_client = get_openai_client(current_openai_key)
+    emitted = False
 
-            return response_text
-            
+    responses_breaker = get_breaker(CHAT_MODEL, "responses")
+    if responses_breaker.allow():
+        try:
+            async with model_slot(CHAT_MODEL):
+                stream = await openai_client.responses.create(
+                    model=CHAT_MODEL,
+                    input=build_chat_messages(current_system_message, user_input),
+                    reasoning={"effort": "minimal"},
+                    text={"verbosity": "low"},
+                    stream=True
+                )
+                async for event in stream:
+                    if event.type == "response.output_text.delta" and event.delta:
+                        emitted = True
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        prompt_cache_stats.record("chat", event.response.usage)
+                    elif event.type == "response.failed":
+                        # El SDK no lanza excepción: el error viene dentro del evento
+                        error = event.response.error
+                        raise RuntimeError(f"response.failed: {error.message if error else 'sin detalle'}")
+                    elif event.type == "error":
+                        raise RuntimeError(f"Evento de error en el stream: {event.message}")
+                    elif event.type == "response.incomplete":
+                        details = event.response.incomplete_details
+                        logger.warning(f"Respuesta GPT-5 incompleta: {details.reason if details else 'sin detalle'}")
+            responses_breaker.record_success()
+            return
         except Exception as gpt5_error:
-            logger.warning(f"Error con nueva API GPT-5, usando fallback: {str(gpt5_error)}")
-            logger.debug(f"Tipo de error GPT-5: {type(gpt5_error).__name__}")
-            
-            # Fallback a la API tradicional de chat completions
-            response = openai_client.chat.completions.create(
-                model="gpt-5-nano",
-                messages=[
-                    {"role": "system", "content": current_system_message},
-                    {"role": "user", "content": user_input}
-                ],
-                max_completion_tokens=500       # Enfocar en tokens más probables
+            responses_breaker.record_failure()
+            if emitted:
+                raise
+            logger.warning(f"Error con nueva API GPT-5 en streaming, usando fallback: {str(gpt5_error)}")
+        finally:
+            # Cancelación o cierre anticipado del stream (CancelledError / GeneratorExit)
+            responses_breaker.cancel_probe()
+
+    completions_breaker = get_breaker(CHAT_MODEL, "chat.completions")
+    try:
+        async with model_slot(CHAT_MODEL):
+            stream = await openai_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=build_chat_messages(current_system_message, user_input),
+                max_completion_tokens=500,
+                stream=True,
+                stream_options={"include_usage": True}
             )
-            response_text = response.choices[0].message.content.strip()
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    prompt_cache_stats.record("chat", chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    except Exception:
+        completions_breaker.record_failure()
+        raise
+    completions_breaker.record_success()
+
+
+class OrderedTaskSender:
+    """
+    Envía frases al avatar como tareas "repeat" en orden, una a la vez, sin frenar
+    la lectura de tokens. Se usa una instancia por turno de conversación.
+    """
 
-            # Validar que el contenido no esté vacío
-            if not response_text:
-                logger.error("La respuesta de OpenAI (fallback) está vacía")
-                return "Lo siento, no pude generar una respuesta en este momento."
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.sent = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._error: Optional[Exception] = None
+        self._worker = asyncio.create_task(self._run())
 
-            return response_text
-        
-    except Exception as e:
-        logger.error(f"Error processing with OpenAI: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing with OpenAI: {str(e)}")
+    def put(self, text: str):
+        self._queue.put_nowait(text)
+
+    async def _run(self):
+        while True:
+            text = await self._queue.get()
+            if text is None:
+                return
+            if self._error is not None:
+                continue  # Tras un error se descartan las frases restantes
+            try:
+                await session_manager.send_task(self.session_id, text, "repeat")
+                self.sent += 1
+            except Exception as e:
+                self._error = e
+
+    async def finish(self):
+        """Espera a que se envíen todas las frases y propaga el primer error."""
+        self._queue.put_nowait(None)
+        await self._worker
+        if self._error is not None:
+            raise self._error
+
+    async def cancel(self):
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+
+async def stream_response_to_avatar(websocket: WebSocket, session_id: str, user_input: str) -> str:
+    """
+    Consume la respuesta en streaming, la corta en frases y manda cada una al avatar
+    en orden, reenviando el texto parcial al navegador. Devuelve la respuesta completa.
+    """
+    response_text = cached_response(user_input)
+    if response_text is not None:
+        # Acierto de caché: una sola tarea al avatar, sin llamar al modelo
+        logger.info("[RESPONSE CACHE] Respuesta servida desde caché")
+        await session_manager.send_task(session_id, response_text, "repeat")
+        await websocket.send_text(json.dumps({"type": "partial_response", "index": 0, "text": response_text}))
+        return response_text
+
+    chunker = SentenceChunker(min_chars=OPENAI_STREAM_MIN_SENTENCE_CHARS)
+    sender = OrderedTaskSender(session_id)
+    response_text = ""
+    sentence_index = 0
+
+    async def dispatch(sentence: str):
+        nonlocal sentence_index
+        sender.put(sentence)
+        await websocket.send_text(json.dumps({
+            "type": "partial_response",
+            "index": sentence_index,
+            "text": sentence
+        }))
+        sentence_index += 1
+
+    try:
+        async for delta in stream_with_openai(user_input):
+            response_text += delta
+            for sentence in chunker.feed(delta):
+                await dispatch(sentence)
+        remainder = chunker.flush()
+        if remainder:
+            await dispatch(remainder)
+        await sender.finish()
+    except BaseException:
+        # También si el turno se cancela porque el usuario volvió a hablar
+        await sender.cancel()
+        raise
+    response_text = response_text.strip()
+    if not response_text:
+        logger.error("La respuesta de OpenAI en streaming está vacía")
+        response_text = EMPTY_RESPONSE_MESSAGE
+        await session_manager.send_task(session_id, response_text, "repeat")
+    remember_response(user_input, response_text)
+    return response_text
 
 
 # Endpoints REST
@@ -669,37 +979,60 @@ async def health():
         "status": "healthy",
         "service": "HeyGen Streaming API",
         "timestamp": datetime.now().isoformat(),
-        "active_sessions": len(active_sessions)
+        "active_sessions": await session_store.count(),
+        "session_store": session_store.backend,
+        "validated_emails": await session_store.email_count(),
+        "session_reaper": session_reaper.metrics(),
+        "uipath_queue": {
+            "pending": get_uipath_job_queue().pending(),
+            **get_uipath_job_queue().stats
+        },
+        "invoice_cache": invoice_cache.metrics() if invoice_cache is not None else {"enabled": False},
+        "openai_concurrency": model_concurrency_metrics(),
+        "openai_breakers": breaker_metrics(),
+        "response_cache": response_cache.metrics() if response_cache is not None else {"enabled": False},
+        "prompt_cache": prompt_cache_stats.metrics(),
+        "intent_router": intent_router.stats,
+        "session_pool": session_pool.metrics(),
+        "heygen_token": session_manager.tokens.metrics(),
+        "uipath_tracker": {
+            "in_flight": get_uipath_job_tracker().in_flight(),
+            **get_uipath_job_tracker().stats
+        }
     }
 
 @app.post("/api/sessions/create", response_model=SessionResponse)
 async def create_new_session(config: SessionConfig = SessionConfig()):
     """
     Crea una sesión, la inicia y devuelve las credenciales de LiveKit.
+    Si hay una sesión precalentada para esta configuración se entrega esa.
     """
     try:
-        # 1. Crear la sesión en HeyGen
-        create_response = await session_manager.create_session(config)
-        session_data = create_response.get('data')
-        if not session_data or 'session_id' not in session_data:
-            raise HTTPException(status_code=500, detail="Respuesta inválida al crear sesión en HeyGen.")
-
-        session_id = session_data['session_id']
-        logger.info(f"[TÉCNICO] Sesión creada en HeyGen: {session_id}")
-
-        # 2. Iniciar la sesión
-        await session_manager.start_session(session_id)
-        logger.info(f"[TÉCNICO] Sesión iniciada en HeyGen: {session_id}")
+        # 1. Tomar una sesión caliente del pool, si hay
+        session_data = await session_pool.checkout(config)
+        if session_data is not None:
+            session_id = session_data['session_id']
+            logger.info(f"[TÉCNICO] Sesión tomada del pool caliente: {session_id}")
+        else:
+            # 2. Crear e iniciar la sesión en HeyGen
+            session_data = await create_started_session(config)
+            session_id = session_data['session_id']
+            logger.info(f"[TÉCNICO] Sesión creada e iniciada en HeyGen: {session_id}")
         
         # 3. Almacenar localmente y devolver credenciales
-        active_sessions[session_id] = {
+        now = time.time()
+        await session_store.create({
             "session_id": session_id,
             "status": "active",
             "created_at": datetime.now().isoformat(),
             "livekit_url": session_data.get("url"),
             "livekit_token": session_data.get("access_token"),
-            "validated_email": None  # Will be set when user validates email
-        }
+            "validated_email": None,  # Will be set when user validates email
+            "created_ts": now,
+            "last_activity": now,
+            # HeyGen cierra la sesión tras este tiempo sin actividad; sin límite si está desactivado
+            "idle_timeout": None if config.disable_idle_timeout else config.activity_idle_timeout
+        })
         
         return SessionResponse(
             session_id=session_id,
@@ -714,22 +1047,23 @@ async def create_new_session(config: SessionConfig = SessionConfig()):
 @app.post("/api/sessions/{session_id}/task")
 async def send_session_task(session_id: str, task: TaskRequest):
     """Envía una tarea de texto a una sesión activa."""
-    if session_id not in active_sessions:
+    if not await session_store.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
     response = await session_manager.send_task(session_id, task.text, task.task_type)
+    await session_store.touch(session_id)
     return {"status": "task_sent", "response": response}
 
 @app.delete("/api/sessions/{session_id}")
 async def close_heygen_session(session_id: str):
     """Cierra una sesión activa en HeyGen."""
     # Hacer endpoint idempotente - no retornar error si la sesión ya fue cerrada
-    if session_id not in active_sessions:
+    if not await session_store.exists(session_id):
         logger.info(f"[TÉCNICO] Sesión {session_id} ya fue cerrada previamente")
         return {"status": "already_closed", "session_id": session_id}
 
     await session_manager.close_session(session_id)
-    del active_sessions[session_id]
+    await session_store.delete(session_id)
     logger.info(f"[TÉCNICO] Sesión cerrada y eliminada: {session_id}")
     return {"status": "closed", "session_id": session_id}
 
@@ -749,7 +1083,7 @@ async def validate_email(request: EmailValidationRequest):
     if is_valid:
         # Generar un ID único para esta validación de email
         validation_id = str(uuid.uuid4())
-        validated_emails[validation_id] = email
+        await session_store.save_validated_email(validation_id, email)
 
         logger.info(f"[EMAIL VALIDATION] Email válido almacenado: {email} (ID: {validation_id})")
 
@@ -771,7 +1105,7 @@ async def set_session_email(session_id: str, request: SessionEmailRequest):
     """
     Asocia un email validado con una sesión específica para usar en UiPath.
     """
-    if session_id not in active_sessions:
+    if not await session_store.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
     # Validar formato de email
@@ -781,7 +1115,7 @@ async def set_session_email(session_id: str, request: SessionEmailRequest):
         raise HTTPException(status_code=400, detail="Invalid email format")
 
     # Asociar email con la sesión
-    active_sessions[session_id]["validated_email"] = request.email
+    await session_store.update(session_id, validated_email=request.email)
     logger.info(f"[EMAIL SESSION] Email asociado a sesión {session_id}: {request.email}")
 
     return {
@@ -800,7 +1134,7 @@ async def extract_invoice_data(invoice_file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
 
     # Verificar tipo de archivo
-    allowed_types = ["image/jpeg", "image/png", "image/jpg", "application/pdf"]
+    allowed_types = INVOICE_ALLOWED_TYPES
     if invoice_file.content_type not in allowed_types:
         raise HTTPException(
             status_code=400,
@@ -826,6 +1160,134 @@ async def extract_invoice_data(invoice_file: UploadFile = File(...)):
         logger.error(f"[INVOICE] Error extracting data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error extrayendo datos: {str(e)}")
 
+@app.post("/api/invoice/extract/stream")
+async def extract_invoice_data_stream(invoice_file: UploadFile = File(...)):
+    """
+    Extrae datos de una factura en streaming (NDJSON).
+    Emite eventos "field" y "concepto" a medida que el modelo los genera y un evento final "done".
+    """
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+
+    if invoice_file.content_type not in INVOICE_ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de archivo no soportado. Permitidos: {', '.join(INVOICE_ALLOWED_TYPES)}"
+        )
+
+    file_data = await invoice_file.read()
+    filename = invoice_file.filename
+
+    async def stream_events():
+        try:
+            async for event in stream_invoice_extraction(file_data, invoice_file.content_type):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            logger.info(f"[INVOICE] Datos extraídos en streaming de {filename}")
+        except Exception as e:
+            logger.error(f"[INVOICE] Error extracting data (stream): {str(e)}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield json.dumps({"type": "error", "message": f"Error extrayendo datos: {detail}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_events(), media_type="application/x-ndjson")
+
+def expand_invoice_uploads(uploads: List[Tuple[str, str, bytes]]) -> List[Tuple[str, str, bytes]]:
+    """
+    Expande los ZIP subidos en sus facturas (PDF/JPG/PNG) y devuelve
+    una lista de (nombre, content_type, bytes) con los archivos a procesar.
+    """
+    invoices = []
+    for filename, content_type, data in uploads:
+        is_zip = content_type in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip")
+        if not is_zip:
+            invoices.append((filename, content_type, data))
+            continue
+
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or os.path.basename(member.filename).startswith("."):
+                        continue
+                    member_type = mimetypes.guess_type(member.filename)[0] or ""
+                    if member_type not in INVOICE_ALLOWED_TYPES:
+                        continue
+                    if member.file_size > INVOICE_MAX_FILE_BYTES:
+                        invoices.append((member.filename, member_type, b""))
+                        continue
+                    invoices.append((member.filename, member_type, archive.read(member)))
+        except zipfile.BadZipFile:
+            invoices.append((filename, content_type, b""))
+    return invoices
+
+
+@app.post("/api/invoice/extract/batch")
+async def extract_invoice_batch(invoice_files: List[UploadFile] = File(...)):
+    """
+    Extrae datos de varias facturas (o de un ZIP con facturas) en paralelo.
+    Devuelve NDJSON: una línea por factura en cuanto termina y una línea final de resumen.
+    """
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+
+    # Leer todo antes de empezar a responder: los UploadFile se cierran al terminar el endpoint
+    uploads = [(f.filename, f.content_type, await f.read()) for f in invoice_files]
+    invoices = expand_invoice_uploads(uploads)
+
+    if not invoices:
+        raise HTTPException(status_code=400, detail="No se encontraron facturas para procesar")
+    if len(invoices) > INVOICE_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiadas facturas en el lote ({len(invoices)}). Máximo: {INVOICE_BATCH_MAX_FILES}"
+        )
+
+    logger.info(f"[INVOICE BATCH] Procesando lote de {len(invoices)} facturas")
+
+    async def process_one(index: int, filename: str, content_type: str, data: bytes) -> dict:
+        started = time.perf_counter()
+        result = {"type": "result", "index": index, "filename": filename}
+        try:
+            if content_type not in INVOICE_ALLOWED_TYPES:
+                raise ValueError(f"Tipo de archivo no soportado: {content_type}")
+            if not data or len(data) > INVOICE_MAX_FILE_BYTES:
+                raise ValueError("Archivo vacío, dañado o demasiado grande")
+            result["extracted_data"] = await process_invoice_with_vision(data, content_type)
+            result["success"] = True
+        except HTTPException as e:
+            result.update({"success": False, "error": str(e.detail)})
+        except Exception as e:
+            result.update({"success": False, "error": str(e)})
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+        return result
+
+    async def stream_results():
+        batch_started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(process_one(index, filename, content_type, data))
+            for index, (filename, content_type, data) in enumerate(invoices)
+        ]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                succeeded += 1 if result["success"] else 0
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            # Si el cliente se desconecta, no seguir gastando llamadas al modelo
+            for task in tasks:
+                task.cancel()
+
+        elapsed_ms = round((time.perf_counter() - batch_started) * 1000)
+        logger.info(f"[INVOICE BATCH] Lote completado: {succeeded}/{len(invoices)} en {elapsed_ms} ms")
+        yield json.dumps({
+            "type": "summary",
+            "total": len(invoices),
+            "succeeded": succeeded,
+            "failed": len(invoices) - succeeded,
+            "elapsed_ms": elapsed_ms
+        }) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/api/stt/transcribe", response_model=STTResponse)
 async def transcribe_audio(audio_file: UploadFile = File(...)):
     """
@@ -905,6 +1367,7 @@ async def trigger_uipath_workflow(request: UiPathTriggerRequest = UiPathTriggerR
         result = await uipath_manager.trigger_dashboard_workflow(request.question)
 
         if result.get("status") == "success":
+            get_uipath_job_tracker().track(result.get("job_id"))
             return UiPathResponse(
                 status="success",
                 job_id=result.get("job_id"),
@@ -926,73 +1389,33 @@ async def trigger_uipath_workflow(request: UiPathTriggerRequest = UiPathTriggerR
 async def check_uipath_job_status(job_id: str):
     """
     Check the status of a UiPath job by ID.
+    Answers from the job tracker's in-memory state when this worker tracks the job;
+    otherwise (another worker, a restart or an evicted job) asks Orchestrator.
     """
     try:
         logger.info(f"[UIPATH API] Checking status for job: {job_id}")
 
-        uipath_manager = get_uipath_manager()
-        result = await uipath_manager.check_job_status(job_id)
+        job = get_uipath_job_tracker().get(job_id)
+        if job is not None:
+            return {
+                "status": "success",
+                "job_status": job["state"],
+                "job_id": job_id,
+                "updated_at": datetime.fromtimestamp(job["updated_at"]).isoformat(),
+                "details": job["details"]
+            }
 
+        result = await get_uipath_manager().check_job_status(job_id)
+        if result.get("status") == "not_found":
+            raise HTTPException(status_code=404, detail=result["message"])
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[UIPATH API] Error checking job status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error checking job status: {str(e)}")
 
-# Función para detectar consultas de facturación
-def detect_billing_query(text: str) -> bool:
-    """
-    Detecta si el texto del usuario contiene una consulta relacionada con facturación.
-
-    Args:
-        text: Texto del usuario a analizar
-
-    Returns:
-        bool: True si detecta una consulta de facturación, False en caso contrario
-    """
-    text_lower = text.lower()
-
-    # Keywords relacionados con facturación
-    billing_keywords = [
-        "tarifa", "cobr", "factura", "costo", "precio", "dashboard",
-        "desarrollador", "senior", "junior", "rpa", "soporte", "horario",
-        "domingos", "festivos", "cop", "pesos", "hora", "cargo", "cobro",
-        "contrato", "servicio", "pago", "cuánto", "cuanto", "está cobrando",
-        "estan cobrando", "me cobran", "están cobrando", "correcto",
-        "incorrecta", "no es correcta", "no hace parte"
-    ]
-
-    # Frases específicas de facturación
-    billing_phrases = [
-        "por qué me están cobrando",
-        "por que me estan cobrando",
-        "cuánto cuesta",
-        "cuanto cuesta",
-        "qué tarifa",
-        "que tarifa",
-        "tarifa del desarrollador",
-        "servicio de soporte",
-        "fuera de horario",
-        "no hace parte",
-        "no hizo parte",
-        "esto no es correcto",
-        "tarifa no es correcta"
-    ]
-
-    # Detectar keywords
-    for keyword in billing_keywords:
-        if keyword in text_lower:
-            logger.info(f"[BILLING DETECTION] Keyword detected: '{keyword}' in user query")
-            return True
-
-    # Detectar frases
-    for phrase in billing_phrases:
-        if phrase in text_lower:
-            logger.info(f"[BILLING DETECTION] Phrase detected: '{phrase}' in user query")
-            return True
-
-    return False
-
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """
@@ -1001,7 +1424,8 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     y establecer la conexión WebRTC directamente con HeyGen.
     """
     # Verificar que la sesión existe
-    if session_id not in active_sessions:
+    session_data = await session_store.get(session_id)
+    if session_data is None:
         await websocket.close(code=1008, reason="Session not found")
         return
     
@@ -1010,7 +1434,6 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     
     try:
         # Enviar información de la sesión inmediatamente después de conectar
-        session_data = active_sessions[session_id]
         await websocket.send_text(json.dumps({
             "type": "session_info",
             "data": {
@@ -1019,191 +1442,289 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 "livekit_token": session_data["livekit_token"]
             }
         }))
-        
-        # Manejar mensajes entrantes del frontend
-        while True:
-            try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                
-                if message.get("type") == "task":
-                    # Procesar tarea con OpenAI y enviar como "repeat" al avatar
-                    user_input = message.get("text", "")
-                    question_case = message.get("question_case", "")  # Extraer el caso específico
-                    if user_input:
-                        try:
-                            logger.info(f"[CONVERSACIÓN] Usuario ({session_id[:8]}): {user_input}")
-
-                            # Check if this is any predefined billing question - trigger UiPath
-                            uipath_triggered = False
-                            uipath_result = None
-
-                            # Detectar si es una consulta de facturación (de botón predefinido o por detección automática)
-                            is_billing_query = bool(question_case) or detect_billing_query(user_input)
-
-                            # If question_case exists OR billing query detected, trigger UiPath
-                            if is_billing_query:
-                                logger.info(f"[UIPATH] Detected predefined question, triggering UiPath workflow...")
-                                await websocket.send_text(json.dumps({
-                                    "type": "processing",
-                                    "message": "Iniciando proceso UiPath para consulta de facturación..."
-                                }))
-
-                                try:
-                                    # Get validated email for this session
-                                    session_data = active_sessions.get(session_id, {})
-                                    validated_email = session_data.get("validated_email")
-
-                                    if not validated_email:
-                                        logger.warning(f"[UIPATH] No validated email for session {session_id}, cannot trigger UiPath")
-                                        await websocket.send_text(json.dumps({
-                                            "type": "uipath_error",
-                                            "message": "Debes validar tu email antes de usar esta funcionalidad"
-                                        }))
-                                        continue
-
-                                    logger.info(f"[UIPATH] Using validated email for UiPath: {validated_email}")
-                                    # Use question_case if available, otherwise use user_input for auto-detected queries
-                                    caso_facturacion = question_case if question_case else user_input
-                                    logger.info(f"[UIPATH] Using question case for UiPath: {caso_facturacion[:100]}...")
-                                    uipath_manager = get_uipath_manager()
-                                    uipath_result = await uipath_manager.trigger_dashboard_workflow(user_input, validated_email, caso_facturacion)
-                                    uipath_triggered = True
-
-                                    if uipath_result.get("status") == "success":
-                                        logger.info(f"[UIPATH] Workflow triggered successfully: {uipath_result['job_id']}")
-                                        await websocket.send_text(json.dumps({
-                                            "type": "uipath_success",
-                                            "message": f"Proceso UiPath iniciado exitosamente (Job: {uipath_result['job_id']})"
-                                        }))
-                                    else:
-                                        logger.error(f"[UIPATH] Workflow failed: {uipath_result}")
-                                        await websocket.send_text(json.dumps({
-                                            "type": "uipath_error",
-                                            "message": f"Error en proceso UiPath: {uipath_result.get('message', 'Unknown error')}"
-                                        }))
-
-                                except Exception as uipath_error:
-                                    logger.error(f"[UIPATH] Exception during workflow trigger: {str(uipath_error)}")
-                                    await websocket.send_text(json.dumps({
-                                        "type": "uipath_error",
-                                        "message": f"Error ejecutando UiPath: {str(uipath_error)}"
-                                    }))
-
-                            # Determinar tipo de respuesta basado en si es pregunta de facturación
-                            if is_billing_query:
-                                # Es una consulta de facturación (predefinida o detectada) - usar respuesta fija (no OpenAI)
-                                global uipath_response_counter
-                                predefined_response = UIPATH_RESPONSES[uipath_response_counter % 3]
-                                uipath_response_counter += 1
-                                logger.info(f"[BILLING] Using predefined response #{(uipath_response_counter-1) % 3 + 1} for billing query: {user_input[:50]}...")
-
-                                # Enviar la respuesta predefinida como "repeat" al streaming
-                                await session_manager.send_task(session_id, predefined_response, "repeat")
-                                openai_response = predefined_response  # Para compatibilidad con logs
-                            else:
-                                # Pregunta normal - procesar con OpenAI como antes
-                                await websocket.send_text(json.dumps({
-                                    "type": "processing",
-                                    "message": "Procesando con OpenAI..."
-                                }))
-
-                                # Modificar el prompt si UiPath se ejecutó
-                                enhanced_input = user_input
-                                if uipath_triggered and uipath_result and uipath_result.get("status") == "success":
-                                    enhanced_input = f"{user_input}\n\n[SISTEMA]: Se ha iniciado automáticamente el proceso RPA '{uipath_result.get('release_name', 'RPA.Workflow')}' (Job ID: {uipath_result.get('job_id', 'unknown')}) para gestionar esta consulta de facturación. El proceso está ejecutándose en segundo plano."
-
-                                openai_response = await process_with_openai(enhanced_input)
-                                logger.info(f"[CONVERSACIÓN] CompAI ({session_id[:8]}): {openai_response}")
-
-                                # Enviar la respuesta de OpenAI como "repeat" al streaming
-                                await session_manager.send_task(session_id, openai_response, "repeat")
-
-                            await websocket.send_text(json.dumps({
-                                "type": "task_sent",
-                                "message": "Respuesta enviada al avatar",
-                                "user_input": user_input,
-                                "openai_response": openai_response,
-                                "uipath_triggered": uipath_triggered,
-                                "uipath_result": uipath_result
-                            }))
 
-                            logger.info(f"[TÉCNICO] Tarea completada exitosamente para sesión {session_id[:8]}")
-                        except HTTPException as http_exc:
-                            # Manejar específicamente sesiones expiradas
-                            if http_exc.status_code == 400 and "Session expired" in str(http_exc.detail):
-                                logger.warning(f"[TÉCNICO] Sesión expirada detectada: {session_id[:8]}")
-                                # Marcar sesión como expirada
-                                if session_id in active_sessions:
-                                    active_sessions[session_id]["status"] = "expired"
-
-                                # Enviar mensaje específico de sesión expirada
-                                await websocket.send_text(json.dumps({
-                                    "type": "session_expired",
-                                    "message": "Tu sesión ha expirado por inactividad. Haz clic en 'Crear Sesión' para iniciar una nueva."
-                                }))
-                            else:
-                                # Otro tipo de HTTPException
-                                logger.error(f"[TÉCNICO] HTTPException procesando tarea para sesión {session_id[:8]}: {str(http_exc.detail)}")
-                                await websocket.send_text(json.dumps({
-                                    "type": "error",
-                                    "message": f"Error: {str(http_exc.detail)}"
-                                }))
-                        except Exception as e:
-                            logger.error(f"[TÉCNICO] Error procesando tarea para sesión {session_id[:8]}: {str(e)}")
+        async def notify_uipath_result(submission_id: str, uipath_result: Dict):
+            """Envía al socket el resultado de un workflow UiPath encolado."""
+            if uipath_result.get("status") == "success":
+                logger.info(f"[UIPATH] Workflow triggered successfully: {uipath_result['job_id']}")
+                get_uipath_job_tracker().track(uipath_result["job_id"], session_id)
+                payload = {
+                    "type": "uipath_success",
+                    "submission_id": submission_id,
+                    "job_id": uipath_result["job_id"],
+                    "message": f"Proceso UiPath iniciado exitosamente (Job: {uipath_result['job_id']})"
+                }
+            else:
+                logger.error(f"[UIPATH] Workflow failed: {uipath_result}")
+                payload = {
+                    "type": "uipath_error",
+                    "submission_id": submission_id,
+                    "message": f"Error en proceso UiPath: {uipath_result.get('message', 'Unknown error')}"
+                }
+            try:
+                await websocket.send_text(json.dumps(payload))
+            except Exception as e:
+                logger.warning(f"[UIPATH] No se pudo notificar resultado a la sesión {session_id[:8]}: {e}")
+
+        async def notify_job_status(job_id: str, job: Dict):
+            """Envía al socket los cambios de estado de los jobs UiPath de esta sesión."""
+            await websocket.send_text(json.dumps({
+                "type": "uipath_job_status",
+                "job_id": job_id,
+                "job_status": job["state"],
+                "message": f"Job UiPath {job_id}: {job['state']}"
+            }))
+
+        get_uipath_job_tracker().subscribe(session_id, notify_job_status)
+
+        async def handle_task(message: Dict):
+            # Procesar tarea con OpenAI y enviar como "repeat" al avatar
+            user_input = message.get("text", "")
+            question_case = message.get("question_case", "")  # Extraer el caso específico
+            if user_input:
+                try:
+                    logger.info(f"[CONVERSACIÓN] Usuario ({session_id[:8]}): {user_input}")
+
+                    # Check if this is any predefined billing question - trigger UiPath
+                    uipath_triggered = False
+                    uipath_result = None
+
+                    # Detectar si es una consulta de facturación (de botón predefinido o por el clasificador local)
+                    is_billing_query = bool(question_case)
+                    if not is_billing_query:
+                        intent = intent_router.classify(user_input)
+                        logger.info(f"[INTENT] {intent.intent} ({intent.source}, confianza {intent.confidence})")
+                        is_billing_query = intent.intent == "billing"
+
+                    # If question_case exists OR billing query detected, trigger UiPath
+                    step_errors = {}
+                    if is_billing_query:
+                        logger.info(f"[UIPATH] Detected predefined question, triggering UiPath workflow...")
+
+                        # Get validated email for this session
+                        # Se lee del almacén: el email pudo asociarse desde otro worker
+                        session_data = await session_store.get(session_id) or {}
+                        validated_email = session_data.get("validated_email")
+
+                        if not validated_email:
+                            logger.warning(f"[UIPATH] No validated email for session {session_id}, cannot trigger UiPath")
                             await websocket.send_text(json.dumps({
-                                "type": "error",
-                                "message": f"Error procesando con OpenAI: {str(e)}"
+                                "type": "uipath_error",
+                                "message": "Debes validar tu email antes de usar esta funcionalidad"
                             }))
+                            return
 
-                elif message.get("type") == "welcome_message":
-                    # Enviar mensaje de bienvenida directo al avatar (sin procesar por OpenAI)
-                    welcome_text = message.get("text", "")
-                    if welcome_text:
-                        try:
-                            logger.info(f"[BIENVENIDA] Enviando mensaje automático para sesión {session_id[:8]}")
+                        logger.info(f"[UIPATH] Using validated email for UiPath: {validated_email}")
+                        # Use question_case if available, otherwise use user_input for auto-detected queries
+                        caso_facturacion = question_case if question_case else user_input
+                        logger.info(f"[UIPATH] Using question case for UiPath: {caso_facturacion[:100]}...")
 
-                            # Enviar directamente como "repeat" al streaming
-                            await session_manager.send_task(session_id, welcome_text, "repeat")
+                        # Es una consulta de facturación (predefinida o detectada) - usar respuesta fija (no OpenAI)
+                        global uipath_response_counter
+                        predefined_response = UIPATH_RESPONSES[uipath_response_counter % 3]
+                        uipath_response_counter += 1
+                        logger.info(f"[BILLING] Using predefined response #{(uipath_response_counter-1) % 3 + 1} for billing query: {user_input[:50]}...")
 
+                        async def notify_processing():
                             await websocket.send_text(json.dumps({
-                                "type": "welcome_sent",
-                                "message": "Mensaje de bienvenida enviado al avatar"
+                                "type": "processing",
+                                "message": "Iniciando proceso UiPath para consulta de facturación..."
                             }))
 
-                            logger.info(f"[TÉCNICO] Mensaje de bienvenida completado para sesión {session_id[:8]}")
-                        except Exception as e:
-                            logger.error(f"[TÉCNICO] Error enviando mensaje de bienvenida para sesión {session_id[:8]}: {str(e)}")
+                        async def trigger_uipath() -> Dict:
+                            # Encolar el workflow; el resultado llega al socket cuando Orchestrator responda
+                            submission_id = get_uipath_job_queue().submit(
+                                user_input, validated_email, caso_facturacion,
+                                on_result=notify_uipath_result
+                            )
                             await websocket.send_text(json.dumps({
-                                "type": "error",
-                                "message": f"Error enviando mensaje de bienvenida: {str(e)}"
+                                "type": "uipath_queued",
+                                "submission_id": submission_id,
+                                "message": f"Proceso UiPath en cola (ID: {submission_id})"
                             }))
-                
-                elif message.get("type") == "close":
-                    # Cerrar sesión en HeyGen pero NO eliminar de active_sessions
-                    # El DELETE endpoint se encargará de eliminarla
-                    await session_manager.close_session(session_id)
-                    logger.info(f"[TÉCNICO] Sesión cerrada desde WebSocket: {session_id}")
+                            return {"status": "queued", "submission_id": submission_id}
+
+                        # Los pasos son independientes: se ejecutan a la vez y el turno dura lo
+                        # que el más lento. Cada resultado o error se revisa por separado.
+                        processing_outcome, uipath_outcome, reply_outcome = await asyncio.gather(
+                            notify_processing(),
+                            trigger_uipath(),
+                            session_manager.send_task(session_id, predefined_response, "repeat"),
+                            return_exceptions=True
+                        )
+
+                        if isinstance(processing_outcome, Exception):
+                            logger.warning(f"[TÉCNICO] No se pudo notificar el procesamiento: {processing_outcome}")
+                            step_errors["processing"] = str(processing_outcome)
+
+                        if isinstance(uipath_outcome, asyncio.QueueFull):
+                            logger.warning(f"[UIPATH] Job queue full, rejecting submission for session {session_id}")
+                            step_errors["uipath"] = "queue_full"
+                            await websocket.send_text(json.dumps({
+                                "type": "uipath_error",
+                                "message": "El sistema está procesando demasiadas solicitudes, intenta de nuevo en unos segundos"
+                            }))
+                        elif isinstance(uipath_outcome, Exception):
+                            logger.error(f"[UIPATH] Exception during workflow trigger: {str(uipath_outcome)}")
+                            step_errors["uipath"] = str(uipath_outcome)
+                            await websocket.send_text(json.dumps({
+                                "type": "uipath_error",
+                                "message": f"Error ejecutando UiPath: {str(uipath_outcome)}"
+                            }))
+                        else:
+                            uipath_triggered = True
+                            uipath_result = uipath_outcome
+
+                        if isinstance(reply_outcome, BaseException):
+                            # Sesión expirada u otro error de HeyGen: lo maneja el except de la tarea
+                            raise reply_outcome
+                        openai_response = predefined_response  # Para compatibilidad con logs
+                    else:
+                        # Pregunta normal - procesar con OpenAI como antes
+                        await websocket.send_text(json.dumps({
+                            "type": "processing",
+                            "message": "Procesando con OpenAI..."
+                        }))
+
+                        # Modificar el prompt si UiPath se ejecutó
+                        enhanced_input = user_input
+                        if uipath_triggered and uipath_result and uipath_result.get("status") == "success":
+                            enhanced_input = f"{user_input}\n\n[SISTEMA]: Se ha iniciado automáticamente el proceso RPA '{uipath_result.get('release_name', 'RPA.Workflow')}' (Job ID: {uipath_result.get('job_id', 'unknown')}) para gestionar esta consulta de facturación. El proceso está ejecutándose en segundo plano."
+
+                        if OPENAI_STREAMING_ENABLED:
+                            # Cada frase se envía como "repeat" en cuanto está completa
+                            openai_response = await stream_response_to_avatar(websocket, session_id, enhanced_input)
+                            logger.info(f"[CONVERSACIÓN] CompAI ({session_id[:8]}): {openai_response}")
+                        else:
+                            openai_response = await process_with_openai(enhanced_input)
+                            logger.info(f"[CONVERSACIÓN] CompAI ({session_id[:8]}): {openai_response}")
+
+                            # Enviar la respuesta de OpenAI como "repeat" al streaming
+                            await session_manager.send_task(session_id, openai_response, "repeat")
+
+                    await websocket.send_text(json.dumps({
+                        "type": "task_sent",
+                        "message": "Respuesta enviada al avatar",
+                        "user_input": user_input,
+                        "openai_response": openai_response,
+                        "uipath_triggered": uipath_triggered,
+                        "uipath_result": uipath_result,
+                        "step_errors": step_errors
+                    }))
+
+                    logger.info(f"[TÉCNICO] Tarea completada exitosamente para sesión {session_id[:8]}")
+                except HTTPException as http_exc:
+                    # Manejar específicamente sesiones expiradas
+                    if http_exc.status_code == 400 and "Session expired" in str(http_exc.detail):
+                        logger.warning(f"[TÉCNICO] Sesión expirada detectada: {session_id[:8]}")
+                        # Marcar sesión como expirada
+                        await session_store.update(session_id, status="expired")
+
+                        # Enviar mensaje específico de sesión expirada
+                        await websocket.send_text(json.dumps({
+                            "type": "session_expired",
+                            "message": "Tu sesión ha expirado por inactividad. Haz clic en 'Crear Sesión' para iniciar una nueva."
+                        }))
+                    else:
+                        # Otro tipo de HTTPException
+                        logger.error(f"[TÉCNICO] HTTPException procesando tarea para sesión {session_id[:8]}: {str(http_exc.detail)}")
+                        await websocket.send_text(json.dumps({
+                            "type": "error",
+                            "message": f"Error: {str(http_exc.detail)}"
+                        }))
+                except Exception as e:
+                    logger.error(f"[TÉCNICO] Error procesando tarea para sesión {session_id[:8]}: {str(e)}")
+                    await websocket.send_text(json.dumps({
+                        "type": "error",
+                        "message": f"Error procesando con OpenAI: {str(e)}"
+                    }))
+
+        async def handle_welcome(message: Dict):
+            # Enviar mensaje de bienvenida directo al avatar (sin procesar por OpenAI)
+            welcome_text = message.get("text", "")
+            if welcome_text:
+                try:
+                    logger.info(f"[BIENVENIDA] Enviando mensaje automático para sesión {session_id[:8]}")
+
+                    # Enviar directamente como "repeat" al streaming
+                    await session_manager.send_task(session_id, welcome_text, "repeat")
+
+                    await websocket.send_text(json.dumps({
+                        "type": "welcome_sent",
+                        "message": "Mensaje de bienvenida enviado al avatar"
+                    }))
+
+                    logger.info(f"[TÉCNICO] Mensaje de bienvenida completado para sesión {session_id[:8]}")
+                except Exception as e:
+                    logger.error(f"[TÉCNICO] Error enviando mensaje de bienvenida para sesión {session_id[:8]}: {str(e)}")
+                    await websocket.send_text(json.dumps({
+                        "type": "error",
+                        "message": f"Error enviando mensaje de bienvenida: {str(e)}"
+                    }))
+
+        message_handlers = {"task": handle_task, "welcome_message": handle_welcome}
+
+        async def handle_message(message: Dict):
+            handler = message_handlers.get(message.get("type"))
+            if handler is not None:
+                await handler(message)
+
+        # Los mensajes se procesan en orden en el worker de la sesión; este loop solo
+        # los recibe, así un "close" o una pregunta nueva no esperan a OpenAI o HeyGen
+        pipeline = SessionTaskPipeline(session_id, handle_message)
+        last_touch = time.monotonic()
+        try:
+            while True:
+                try:
+                    data = await websocket.receive_text()
+                    message = json.loads(data)
+                    if time.monotonic() - last_touch >= SESSION_TOUCH_INTERVAL:
+                        last_touch = time.monotonic()
+                        await session_store.touch(session_id)
+
+                    if message.get("type") == "close":
+                        # Control: se adelanta a la cola y cancela lo pendiente
+                        await pipeline.stop()
+                        # Cerrar sesión en HeyGen pero NO eliminar del session_store
+                        # El DELETE endpoint se encargará de eliminarla
+                        await session_manager.close_session(session_id)
+                        # Marcada como cerrada: si el DELETE no llega, el reaper la purga sin volver a cerrarla
+                        await session_store.update(session_id, status="closed")
+                        logger.info(f"[TÉCNICO] Sesión cerrada desde WebSocket: {session_id}")
+                        break
+
+                    if message.get("type") not in message_handlers:
+                        continue
+                    if pipeline.submit(message) == REJECTED:
+                        logger.warning(f"[TÉCNICO] Cola de la sesión {session_id[:8]} llena, mensaje rechazado")
+                        await websocket.send_text(json.dumps({
+                            "type": "busy",
+                            "message": "Todavía estoy procesando tus mensajes anteriores, intenta de nuevo en unos segundos"
+                        }))
+
+                except WebSocketDisconnect:
+                    logger.info(f"[TÉCNICO] WebSocket desconectado para sesión: {session_id}")
                     break
-                    
-            except WebSocketDisconnect:
-                logger.info(f"[TÉCNICO] WebSocket desconectado para sesión: {session_id}")
-                break
-            except Exception as e:
-                logger.error(f"[TÉCNICO] Error en WebSocket para sesión {session_id}: {e}")
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "message": f"Error: {str(e)}"
-                }))
+                except Exception as e:
+                    logger.error(f"[TÉCNICO] Error en WebSocket para sesión {session_id}: {e}")
+                    await websocket.send_text(json.dumps({
+                        "type": "error",
+                        "message": f"Error: {str(e)}"
+                    }))
+        finally:
+            await pipeline.stop()
 
     except WebSocketDisconnect:
         logger.info(f"[TÉCNICO] WebSocket desconectado para sesión: {session_id}")
     except Exception as e:
         logger.error(f"[TÉCNICO] Error general en WebSocket para sesión {session_id}: {e}")
     finally:
+        get_uipath_job_tracker().unsubscribe(session_id)
         logger.info(f"[TÉCNICO] Cerrando WebSocket para sesión: {session_id}")
 
 if __name__ == "__main__":
+    # Solo para pruebas rápidas: los workers "spawn" de pdf_extraction.py vuelven a
+    # ejecutar este archivo completo. En producción usar "uvicorn main:app".
     import uvicorn
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
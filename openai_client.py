@@ -0,0 +1,258 @@
+# openai_client.py
+"""
+Cliente AsyncOpenAI compartido por el chat, la extracción de PDFs y la de imágenes.
+
+Se construye una sola vez (perezosamente) con un pool de conexiones httpx
+ajustado y HTTP/2 cuando el paquete h2 está instalado, así que las llamadas
+reutilizan las conexiones TLS abiertas. Cada modelo tiene además un semáforo
+que limita cuántas peticiones simultáneas se le envían.
+
+Los circuit breakers recuerdan qué ruta de la API (responses o
+chat.completions) funciona para cada modelo: tras varios fallos seguidos la
+ruta se salta y solo se vuelve a probar después de un tiempo de espera.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+OPENAI_HTTP_TIMEOUT = float(os.getenv("OPENAI_HTTP_TIMEOUT", "60"))
+OPENAI_HTTP_CONNECT_TIMEOUT = float(os.getenv("OPENAI_HTTP_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Segundos que se mantiene abierto un cliente reemplazado para que terminen sus peticiones
+OPENAI_CLIENT_CLOSE_GRACE = float(os.getenv("OPENAI_CLIENT_CLOSE_GRACE", "300"))
+# Peticiones simultáneas por modelo: valor por defecto y excepciones "modelo=límite,..."
+OPENAI_DEFAULT_MODEL_CONCURRENCY = int(os.getenv("OPENAI_DEFAULT_MODEL_CONCURRENCY", "16"))
+OPENAI_MODEL_CONCURRENCY = os.getenv("OPENAI_MODEL_CONCURRENCY", "")
+# Circuit breaker por modelo y ruta de la API
+OPENAI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("OPENAI_BREAKER_FAILURE_THRESHOLD", "3"))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "300"))
+
+
+def parse_model_limits(raw: str) -> Dict[str, int]:
+    """Convierte "gpt-4o=4,gpt-5-nano=32" en {"gpt-4o": 4, "gpt-5-nano": 32}."""
+    limits: Dict[str, int] = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model, limit = item.split("=", 1)
+        try:
+            limits[model.strip()] = max(1, int(limit))
+        except ValueError:
+            logger.warning(f"[OPENAI] Límite de concurrencia inválido para {model.strip()}: {limit}")
+    return limits
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+_client: Optional[AsyncOpenAI] = None
+_client_api_key: Optional[str] = None
+_model_limits: Dict[str, int] = parse_model_limits(OPENAI_MODEL_CONCURRENCY)
+_model_semaphores: Dict[str, asyncio.Semaphore] = {}
+_semaphores_loop: Optional[asyncio.AbstractEventLoop] = None
+_model_in_use: Dict[str, int] = {}
+# Cierres diferidos de clientes reemplazados (referencias fuertes hasta que terminen)
+_retired_clients: Dict[asyncio.Task, AsyncOpenAI] = {}
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Pool httpx para la API de OpenAI, con HTTP/2 si está disponible."""
+    http2 = OPENAI_HTTP2 and http2_available()
+    if OPENAI_HTTP2 and not http2:
+        logger.warning("[OPENAI] Paquete h2 no instalado, usando HTTP/1.1 con keep-alive")
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        timeout=httpx.Timeout(OPENAI_HTTP_TIMEOUT, connect=OPENAI_HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """
+    Devuelve el cliente compartido, creándolo en el primer uso.
+    Si la API key cambió (configuración dinámica) se reemplaza el cliente; el
+    anterior se cierra pasados OPENAI_CLIENT_CLOSE_GRACE segundos, para que las
+    peticiones y streams en curso terminen. Lo que siga abierto entonces se corta.
+    """
+    global _client, _client_api_key
+    if _client is None or _client_api_key != api_key:
+        previous = _client
+        _client = AsyncOpenAI(api_key=api_key, http_client=build_http_client(), max_retries=OPENAI_MAX_RETRIES)
+        _client_api_key = api_key
+        if previous is not None:
+            task = asyncio.get_running_loop().create_task(_close_after_grace(previous))
+            _retired_clients[task] = previous
+            task.add_done_callback(lambda done: _retired_clients.pop(done, None))
+        logger.info("[OPENAI] Cliente compartido inicializado")
+    return _client
+
+
+async def _close_after_grace(client: AsyncOpenAI):
+    await asyncio.sleep(OPENAI_CLIENT_CLOSE_GRACE)
+    await client.close()
+
+
+def set_default_model_concurrency(model: str, limit: int):
+    """Fija el límite de un modelo salvo que OPENAI_MODEL_CONCURRENCY ya lo defina."""
+    if model not in _model_limits:
+        _model_limits[model] = max(1, limit)
+
+
+def model_semaphore(model: str) -> asyncio.Semaphore:
+    global _semaphores_loop
+    loop = asyncio.get_running_loop()
+    if loop is not _semaphores_loop:
+        # Los semáforos quedan ligados a un event loop (p. ej. varios asyncio.run en benchmarks)
+        _model_semaphores.clear()
+        _semaphores_loop = loop
+    semaphore = _model_semaphores.get(model)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(_model_limits.get(model, OPENAI_DEFAULT_MODEL_CONCURRENCY))
+        _model_semaphores[model] = semaphore
+    return semaphore
+
+
+@asynccontextmanager
+async def model_slot(model: str):
+    """Reserva un cupo de concurrencia del modelo mientras dura la llamada."""
+    async with model_semaphore(model):
+        _model_in_use[model] = _model_in_use.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            _model_in_use[model] -= 1
+
+
+def model_concurrency_metrics() -> Dict[str, Dict[str, int]]:
+    """Límite y cupos ocupados por modelo, para /health."""
+    metrics = {}
+    for model in _model_semaphores:
+        limit = _model_limits.get(model, OPENAI_DEFAULT_MODEL_CONCURRENCY)
+        metrics[model] = {"limit": limit, "in_use": _model_in_use.get(model, 0)}
+    return metrics
+
+
+async def close_openai_client():
+    """Cierra el pool de conexiones del cliente compartido y de los reemplazados pendientes."""
+    global _client, _client_api_key
+    retired = list(_retired_clients.items())
+    for task, _ in retired:
+        task.cancel()
+    await asyncio.gather(*(task for task, _ in retired), return_exceptions=True)
+    for _, client in retired:
+        await client.close()
+    if _client is not None:
+        await _client.close()
+        _client = None
+        _client_api_key = None
+
+
+class CircuitBreaker:
+    """
+    Breaker de tres estados para una ruta de la API con un modelo.
+
+    closed: la ruta se usa normalmente.
+    open: tras failure_threshold fallos seguidos la ruta se salta.
+    half_open: pasado el cooldown se deja pasar una sola llamada de prueba;
+    si funciona se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = OPENAI_BREAKER_FAILURE_THRESHOLD,
+                 cooldown: float = OPENAI_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"successes": 0, "failures": 0, "skipped": 0, "opened": 0, "probes": 0}
+
+    def allow(self) -> bool:
+        """Indica si se puede usar la ruta ahora; en half_open solo autoriza una prueba."""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            self.stats["probes"] += 1
+            logger.info(f"[OPENAI] Probando de nuevo la ruta {self.name}")
+            return True
+        self.stats["skipped"] += 1
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"[OPENAI] Ruta {self.name} recuperada, breaker cerrado")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self.stats["successes"] += 1
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.stats["failures"] += 1
+        was_probe = self._probe_in_flight
+        self._probe_in_flight = False
+        if was_probe or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                logger.warning(
+                    f"[OPENAI] Breaker abierto para {self.name} tras {self.consecutive_failures} fallos; "
+                    f"nueva prueba en {self.cooldown:.0f}s"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def cancel_probe(self):
+        """
+        Libera la prueba de half_open sin contarla como fallo. Se llama siempre al
+        terminar la llamada (finally): si se canceló, la siguiente puede volver a probar.
+        """
+        self._probe_in_flight = False
+
+    def metrics(self) -> Dict:
+        metrics = {"state": self.state, "consecutive_failures": self.consecutive_failures, **self.stats}
+        if self.state == "open":
+            metrics["retry_in"] = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+        return metrics
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model: str, api_path: str) -> CircuitBreaker:
+    """Breaker compartido para la combinación modelo/ruta ("responses", "chat.completions")."""
+    name = f"{model}:{api_path}"
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(name)
+        _breakers[name] = breaker
+    return breaker
+
+
+def breaker_metrics() -> Dict[str, Dict]:
+    """Estado de cada breaker, para /health."""
+    return {name: breaker.metrics() for name, breaker in _breakers.items()}
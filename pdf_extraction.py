@@ -0,0 +1,250 @@
+# pdf_extraction.py
+"""
+Extracción de texto de PDFs fuera del event loop.
+
+pdfplumber y PyMuPDF son CPU-bound, así que las páginas de un documento se reparten
+en bloques entre un pool de procesos y los resultados se unen en orden de página.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Los workers se crean con "spawn": importan este módulo y además vuelven a ejecutar
+# el script principal como __mp_main__. Con "uvicorn main:app" ese script es uvicorn;
+# con "python main.py" cada worker construiría la app completa, por eso no se soporta.
+# El .env se carga aquí porque los workers no pasan por main.py.
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_CHUNK = int(os.getenv("PDF_PAGES_PER_CHUNK", "4"))
+
+# Motor de extracción: "tiered" (PyMuPDF + tablas con pdfplumber solo donde hace falta) o "pdfplumber"
+PDF_EXTRACTION_ENGINE = os.getenv("PDF_EXTRACTION_ENGINE", "tiered").lower()
+# Umbrales para decidir si una página parece contener tablas
+PDF_TABLE_MIN_RULINGS = int(os.getenv("PDF_TABLE_MIN_RULINGS", "6"))
+PDF_TABLE_MIN_ALIGNED_ROWS = int(os.getenv("PDF_TABLE_MIN_ALIGNED_ROWS", "3"))
+PDF_TABLE_MIN_COLUMNS = int(os.getenv("PDF_TABLE_MIN_COLUMNS", "3"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos compartido para extracción de PDFs."""
+    global _executor
+    if _executor is None:
+        # "spawn" evita heredar el estado del servidor (hilos, sockets) en los workers
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown_pdf_executor():
+    """Detiene el pool de procesos si fue creado."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def discard_pdf_executor(executor: ProcessPoolExecutor):
+    """Descarta un pool roto para que el próximo get_pdf_executor() cree uno nuevo."""
+    global _executor
+    executor.shutdown(wait=False, cancel_futures=True)
+    # Otra extracción concurrente puede haber creado ya el reemplazo
+    if _executor is executor:
+        _executor = None
+
+
+def count_pages(pdf_data: bytes) -> int:
+    """Cuenta las páginas del PDF sin analizar su contenido."""
+    import fitz  # pymupdf
+
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_document:
+        return len(pdf_document)
+
+
+def format_tables(page_number: int, tables: List[List[List[Optional[str]]]]) -> List[str]:
+    """Convierte las tablas de una página al formato de texto usado en el prompt."""
+    parts = [f"\n--- TABLAS PÁGINA {page_number} ---\n"]
+    for table_num, table in enumerate(tables):
+        parts.append(f"\nTabla {table_num + 1}:\n")
+        for row in table:
+            if row:  # Evitar filas vacías
+                parts.append(" | ".join([str(cell) if cell else "" for cell in row]) + "\n")
+    return parts
+
+
+def extract_pages_pdfplumber(pdf_data: bytes, start: int, end: int) -> str:
+    """Extrae texto y tablas con pdfplumber de las páginas [start, end)."""
+    import pdfplumber
+
+    parts: List[str] = []
+    with pdfplumber.open(io.BytesIO(pdf_data)) as pdf:
+        for page_num in range(start, end):
+            page = pdf.pages[page_num]
+
+            # Extraer texto de la página
+            page_text = page.extract_text()
+            if page_text:
+                parts.append(f"\n--- PÁGINA {page_num + 1} ---\n")
+                parts.append(page_text)
+
+            # Intentar extraer tablas si las hay
+            tables = page.extract_tables()
+            if tables:
+                parts.extend(format_tables(page_num + 1, tables))
+    return "".join(parts)
+
+
+def extract_pages_pymupdf(pdf_data: bytes, start: int, end: int) -> str:
+    """Extrae texto plano con PyMuPDF de las páginas [start, end)."""
+    import fitz  # pymupdf
+
+    parts: List[str] = []
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_document:
+        for page_num in range(start, end):
+            page_text = pdf_document[page_num].get_text()
+            if page_text.strip():
+                parts.append(f"\n--- PÁGINA {page_num + 1} ---\n")
+                parts.append(page_text)
+    return "".join(parts)
+
+
+def count_rulings(page) -> int:
+    """Cuenta líneas y rectángulos dibujados en una página de PyMuPDF."""
+    rulings = 0
+    for drawing in page.get_drawings():
+        for item in drawing.get("items", []):
+            if item[0] in ("l", "re", "qu"):
+                rulings += 1
+    return rulings
+
+
+def count_aligned_columns(page, gap: float = 12.0, tolerance: float = 4.0) -> int:
+    """
+    Cuenta las columnas alineadas de una página sin bordes dibujados.
+
+    Las palabras se agrupan por renglón (misma línea base) y se cortan en celdas
+    donde hay un espacio horizontal de al menos `gap` puntos. Una columna es una
+    posición x donde empieza una celda en al menos PDF_TABLE_MIN_ALIGNED_ROWS renglones.
+    La prosa normal, con espacios simples entre palabras, no genera celdas.
+    """
+    rows = {}
+    for x0, _, x1, y1, _, _, _, _ in page.get_text("words"):
+        rows.setdefault(round(y1 / 2), []).append((x0, x1))
+
+    rows_by_column = {}
+    for row_key, spans in rows.items():
+        spans.sort()
+        cell_starts = [spans[0][0]]
+        for previous, current in zip(spans, spans[1:]):
+            if current[0] - previous[1] >= gap:
+                cell_starts.append(current[0])
+        if len(cell_starts) < 2:
+            continue
+        for x0 in cell_starts:
+            rows_by_column.setdefault(round(x0 / tolerance), set()).add(row_key)
+
+    return sum(1 for row_keys in rows_by_column.values() if len(row_keys) >= PDF_TABLE_MIN_ALIGNED_ROWS)
+
+
+def looks_tabular(page) -> bool:
+    """Decide si vale la pena pasar una página por el extractor de tablas de pdfplumber."""
+    if count_rulings(page) >= PDF_TABLE_MIN_RULINGS:
+        return True
+    return count_aligned_columns(page) >= PDF_TABLE_MIN_COLUMNS
+
+
+def extract_pages_tiered(pdf_data: bytes, start: int, end: int) -> str:
+    """
+    Extrae las páginas [start, end) con PyMuPDF y solo envía a pdfplumber
+    las páginas que parecen tabulares para extraer sus tablas.
+    """
+    import fitz  # pymupdf
+
+    page_texts = {}
+    tabular_pages = []
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_document:
+        for page_num in range(start, end):
+            page = pdf_document[page_num]
+            page_texts[page_num] = page.get_text()
+            if looks_tabular(page):
+                tabular_pages.append(page_num)
+
+    page_tables = {}
+    if tabular_pages:
+        import pdfplumber
+
+        with pdfplumber.open(io.BytesIO(pdf_data)) as pdf:
+            for page_num in tabular_pages:
+                tables = pdf.pages[page_num].extract_tables()
+                if tables:
+                    page_tables[page_num] = tables
+
+    parts: List[str] = []
+    for page_num in range(start, end):
+        page_text = page_texts[page_num]
+        if page_text.strip():
+            parts.append(f"\n--- PÁGINA {page_num + 1} ---\n")
+            parts.append(page_text)
+        if page_num in page_tables:
+            parts.extend(format_tables(page_num + 1, page_tables[page_num]))
+    return "".join(parts)
+
+
+def split_pages(page_count: int) -> List[Tuple[int, int]]:
+    """Reparte las páginas en bloques contiguos, como máximo uno por worker."""
+    if page_count <= 0:
+        return []
+    chunk_count = min(PDF_EXTRACTION_WORKERS, -(-page_count // PDF_PAGES_PER_CHUNK))
+    chunk_count = max(1, chunk_count)
+    base, extra = divmod(page_count, chunk_count)
+    ranges = []
+    start = 0
+    for index in range(chunk_count):
+        end = start + base + (1 if index < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+async def _extract_chunks(executor: ProcessPoolExecutor, extractor: Callable[[bytes, int, int], str],
+                          pdf_data: bytes) -> str:
+    loop = asyncio.get_running_loop()
+    page_count = await loop.run_in_executor(executor, count_pages, pdf_data)
+    ranges = split_pages(page_count)
+    logger.info(f"[PDF] {page_count} páginas repartidas en {len(ranges)} bloques")
+
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(executor, extractor, pdf_data, start, end)
+        for start, end in ranges
+    ))
+    return "".join(chunks)
+
+
+async def extract_in_pool(extractor: Callable[[bytes, int, int], str], pdf_data: bytes) -> str:
+    """
+    Ejecuta un extractor por bloques de páginas en el pool de procesos
+    y une los resultados en orden de página.
+
+    Si un worker muere (falta de memoria, crash con un PDF malformado) el pool
+    queda inutilizable: se descarta y se reintenta una vez con un pool nuevo.
+    """
+    executor = get_pdf_executor()
+    try:
+        return await _extract_chunks(executor, extractor, pdf_data)
+    except BrokenProcessPool:
+        logger.warning("[PDF] El pool de extracción se rompió, recreándolo y reintentando...")
+        discard_pdf_executor(executor)
+    return await _extract_chunks(get_pdf_executor(), extractor, pdf_data)
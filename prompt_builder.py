@@ -0,0 +1,137 @@
+# prompt_builder.py
+"""
+Armado de prompts con un prefijo estable para aprovechar el prompt caching de OpenAI.
+
+El proveedor reutiliza el cómputo del prefijo más largo que coincide con una
+petición anterior, así que el contenido fijo (mensaje de sistema, esquema e
+instrucciones de extracción) va siempre primero y el contenido variable
+(pregunta del usuario, texto o imágenes de la factura) siempre al final.
+
+También acumula los tokens de entrada cacheados que reporta el campo usage de
+cada respuesta, para medir el ahorro.
+"""
+import textwrap
+from typing import Any, Dict, List, Optional
+
+INVOICE_SCHEMA = textwrap.dedent("""
+    {
+      "tipo_documento": "factura",
+      "empresa_emisora": "nombre de la empresa",
+      "numero_factura": "número si está visible",
+      "fecha_emision": "fecha de emisión",
+      "fecha_vencimiento": "fecha de vencimiento si está visible",
+      "periodo_facturado": "período que cubre la factura",
+      "conceptos": [
+        {
+          "item": "número de ítem",
+          "descripcion": "descripción del servicio/concepto",
+          "cantidad": numero_cantidad,
+          "valor_unitario": valor_numérico,
+          "total_concepto": valor_numérico
+        }
+      ],
+      "subtotal": valor_numérico,
+      "descuento": valor_numérico,
+      "tasa_impuestos": porcentaje_numérico,
+      "impuestos": valor_numérico,
+      "total_factura": valor_numérico,
+      "observaciones": "cualquier nota importante o servicios no contractuales detectados"
+    }
+""").strip()
+
+# Ítems que el modelo debe revisar por si quedan fuera del contrato
+NON_CONTRACT_HINTS = ("Configuración inicial", "Implementación", "Desarrollador")
+
+PDF_INVOICE_INSTRUCTIONS = textwrap.dedent("""
+    Analiza el texto extraído de una factura PDF que se envía en el siguiente mensaje y extrae los datos financieros estructurados.
+
+    Devuelve SOLO un JSON válido con esta estructura exacta:
+    {schema}
+
+    IMPORTANTE:
+    - Extrae TODOS los conceptos/ítems facturados de la tabla
+    - Identifica servicios que puedan no estar en contrato original
+    - Valores numéricos sin símbolos de moneda, puntos ni comas
+    - Si no encuentras un campo, usa null o ""
+    - Busca especialmente ítems como {hints}
+""").strip().format(schema=INVOICE_SCHEMA, hints=", ".join(f'"{hint}"' for hint in NON_CONTRACT_HINTS))
+
+IMAGE_INVOICE_INSTRUCTIONS = textwrap.dedent("""
+    Eres un experto en análisis de facturas. Extrae TODOS los datos financieros de la factura que se envía en el siguiente mensaje.
+
+    Devuelve SOLO un JSON válido con esta estructura exacta:
+    {schema}
+
+    IMPORTANTE:
+    - Extrae TODOS los conceptos facturados
+    - Identifica servicios que puedan no estar en contrato original
+    - Valores numéricos sin símbolos de moneda, puntos ni comas, solo números
+    - Si no encuentras un campo, usa null o ""
+""").strip().format(schema=INVOICE_SCHEMA)
+
+
+def build_chat_messages(system_message: str, user_input: str) -> List[Dict[str, Any]]:
+    """Mensajes de la conversación: mensaje de sistema fijo y la pregunta al final."""
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_input}
+    ]
+
+
+def build_pdf_invoice_messages(extracted_text: str) -> List[Dict[str, Any]]:
+    """Instrucciones y esquema fijos primero; el texto de la factura como último mensaje."""
+    return [
+        {"role": "system", "content": PDF_INVOICE_INSTRUCTIONS},
+        {"role": "user", "content": f"TEXTO DE LA FACTURA:\n{extracted_text}"}
+    ]
+
+
+def build_image_invoice_messages(image_urls: List[str], detail: str) -> List[Dict[str, Any]]:
+    """Instrucciones y esquema fijos primero; las imágenes de la factura como último mensaje."""
+    content = [{"type": "image_url", "image_url": {"url": url, "detail": detail}} for url in image_urls]
+    return [
+        {"role": "system", "content": IMAGE_INVOICE_INSTRUCTIONS},
+        {"role": "user", "content": content}
+    ]
+
+
+class PromptCacheStats:
+    """Acumula tokens de entrada y tokens cacheados por tipo de llamada."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, label: str, usage: Optional[Any]):
+        """
+        Registra el usage de una respuesta. Acepta el formato de chat completions
+        (prompt_tokens / prompt_tokens_details) y el de Responses (input_tokens /
+        input_tokens_details).
+        """
+        if usage is None:
+            return
+        input_tokens = getattr(usage, "prompt_tokens", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        if input_tokens is None:
+            input_tokens = getattr(usage, "input_tokens", None)
+            details = getattr(usage, "input_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+        stats = self._stats.setdefault(label, {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "calls_with_cache": 0})
+        stats["calls"] += 1
+        stats["input_tokens"] += input_tokens or 0
+        stats["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            stats["calls_with_cache"] += 1
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Totales por tipo de llamada con la fracción de tokens de entrada cacheados."""
+        return {
+            label: {
+                **stats,
+                "cached_ratio": round(stats["cached_tokens"] / stats["input_tokens"], 3) if stats["input_tokens"] else 0.0
+            }
+            for label, stats in self._stats.items()
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,194 @@
+# response_cache.py
+"""
+Caché de respuestas conversacionales para preguntas generales repetidas.
+
+Tiene dos niveles: coincidencia exacta sobre el texto normalizado y
+coincidencia aproximada con TF-IDF de n-gramas de caracteres (similitud coseno
+sobre un índice invertido local, sin llamadas externas). Las entradas expiran
+por TTL, se descartan por LRU y toda la caché se invalida cuando cambia el
+mensaje de sistema, porque las respuestas dependen de él.
+
+La coincidencia aproximada solo se acepta si ambas preguntas tienen los mismos
+números y las mismas negaciones: "plan 1" y "plan 2", o "cuál es" y "cuál no
+es", se parecen mucho en n-gramas pero no tienen la misma respuesta.
+"""
+import hashlib
+import logging
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+RESPONSE_CACHE_NGRAM_SIZE = int(os.getenv("RESPONSE_CACHE_NGRAM_SIZE", "3"))
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación, espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    text = re.sub(r"[^a-z0-9ñ]+", " ", text)
+    return text.strip()
+
+
+NEGATION_WORDS = frozenset({
+    "no", "nunca", "jamas", "sin", "ni", "tampoco", "nada", "nadie", "ningun", "ninguno", "ninguna",
+    "excepto", "salvo", "menos"
+})
+
+
+def meaning_signature(normalized: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Números y negaciones de una pregunta normalizada; deben coincidir para reutilizar una respuesta."""
+    words = normalized.split()
+    numbers = tuple(sorted(word for word in words if any(char.isdigit() for char in word)))
+    negations = tuple(sorted(word for word in words if word in NEGATION_WORDS))
+    return numbers, negations
+
+
+def char_ngrams(text: str, size: int) -> Counter:
+    """N-gramas de caracteres por palabra, con bordes marcados para distinguir prefijos."""
+    grams: Counter = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        if len(padded) <= size:
+            grams[padded] += 1
+            continue
+        for index in range(len(padded) - size + 1):
+            grams[padded[index:index + size]] += 1
+    return grams
+
+
+class ResponseCache:
+    """Caché LRU/TTL de respuestas con nivel exacto y nivel por similitud TF-IDF."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD, ngram_size: int = RESPONSE_CACHE_NGRAM_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.ngram_size = ngram_size
+        # pregunta normalizada -> (guardado en, respuesta, n-gramas)
+        self._entries: "OrderedDict[str, Tuple[float, str, Counter]]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}
+        self._context_hash: Optional[str] = None
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    def _check_context(self, system_message: str):
+        """Vacía la caché si cambió el mensaje de sistema."""
+        context_hash = hashlib.sha256(system_message.encode("utf-8")).hexdigest()
+        if context_hash != self._context_hash:
+            if self._entries:
+                logger.info(f"[RESPONSE CACHE] Mensaje de sistema cambió, descartando {len(self._entries)} respuestas")
+                self.stats["invalidations"] += 1
+            self.clear()
+            self._context_hash = context_hash
+
+    def clear(self):
+        self._entries.clear()
+        self._postings.clear()
+
+    def _remove(self, key: str):
+        _, _, grams = self._entries.pop(key)
+        for gram in grams:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def _idf(self, gram: str) -> float:
+        return math.log((1 + len(self._entries)) / (1 + len(self._postings.get(gram, ())))) + 1.0
+
+    def _weights(self, grams: Counter) -> Dict[str, float]:
+        return {gram: count * self._idf(gram) for gram, count in grams.items()}
+
+    def _find_similar(self, key: str, grams: Counter) -> Tuple[Optional[str], float]:
+        """
+        Entrada más parecida (coseno TF-IDF) entre las que comparten algún n-grama
+        y tienen los mismos números y negaciones que la pregunta.
+        """
+        candidates: Set[str] = set()
+        for gram in grams:
+            candidates.update(self._postings.get(gram, ()))
+        signature = meaning_signature(key)
+        candidates = {candidate for candidate in candidates if meaning_signature(candidate) == signature}
+        if not candidates:
+            return None, 0.0
+
+        query = self._weights(grams)
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            weights = self._weights(self._entries[key][2])
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            dot = sum(weight * weights.get(gram, 0.0) for gram, weight in query.items())
+            score = dot / (query_norm * norm) if query_norm and norm else 0.0
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+    def get(self, question: str, system_message: str) -> Optional[str]:
+        """Devuelve la respuesta guardada para la pregunta (o una muy parecida), o None."""
+        self._check_context(system_message)
+        key = normalize_question(question)
+        if not key:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            self._entries.move_to_end(key)
+            self.stats["exact_hits"] += 1
+            return entry[1]
+        if entry is not None:
+            self._remove(key)
+
+        similar_key, score = self._find_similar(key, char_ngrams(key, self.ngram_size))
+        if similar_key is not None and score >= self.threshold:
+            stored_at, response, _ = self._entries[similar_key]
+            if time.time() - stored_at <= self.ttl:
+                self._entries.move_to_end(similar_key)
+                self.stats["similar_hits"] += 1
+                logger.info(f"[RESPONSE CACHE] Coincidencia aproximada ({score:.2f}) con: {similar_key[:60]}")
+                return response
+            self._remove(similar_key)
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, question: str, response: str, system_message: str):
+        """Guarda la respuesta para la pregunta y descarta las entradas más antiguas."""
+        self._check_context(system_message)
+        key = normalize_question(question)
+        if not key or not response:
+            return
+        if key in self._entries:
+            self._remove(key)
+        grams = char_ngrams(key, self.ngram_size)
+        self._entries[key] = (time.time(), response, grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def metrics(self) -> Dict:
+        """Contadores de aciertos por nivel y tamaño de la caché."""
+        hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "similarity_threshold": self.threshold
+        }
+
+
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
@@ -0,0 +1,58 @@
+# sentence_stream.py
+"""
+Corte de la respuesta del modelo en frases mientras llegan los tokens.
+
+Cada frase completa se puede enviar al avatar como una tarea "repeat" propia,
+así HeyGen empieza a hablar en cuanto termina la primera frase en lugar de
+esperar la respuesta entera.
+"""
+import re
+from typing import List
+
+# Fin de frase: signo de cierre (con comillas/paréntesis opcionales) seguido de espacio, o salto de línea
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])[\"')\]]*\s+|\n+")
+
+# Abreviaturas frecuentes tras las que un punto no cierra la frase
+ABBREVIATIONS = {"sr", "sra", "dr", "dra", "ud", "uds", "etc", "no", "núm", "art", "s.a", "s.a.s", "aprox", "pág"}
+
+
+class SentenceChunker:
+    """
+    Acumula deltas de texto y devuelve las frases completas.
+
+    min_chars evita mandar al avatar fragmentos muy cortos ("Sí."): la frase se
+    une con la siguiente hasta llegar al mínimo.
+    """
+
+    def __init__(self, min_chars: int = 20):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """Agrega un delta y devuelve las frases que quedaron completas."""
+        self._buffer += delta
+        sentences: List[str] = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self._buffer):
+            candidate = self._buffer[start:match.start()].strip()
+            if not candidate:
+                start = match.end()
+                continue
+            if len(candidate) < self.min_chars or self._ends_with_abbreviation(candidate):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> str:
+        """Devuelve el texto pendiente al terminar el stream."""
+        remainder, self._buffer = self._buffer.strip(), ""
+        return remainder
+
+    @staticmethod
+    def _ends_with_abbreviation(text: str) -> bool:
+        if not text.endswith("."):
+            return False
+        last_word = text.rsplit(None, 1)[-1].rstrip(".").lower()
+        return last_word in ABBREVIATIONS or len(last_word) == 1
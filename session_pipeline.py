@@ -0,0 +1,118 @@
+# session_pipeline.py
+"""
+Cola de trabajo por sesión para los mensajes del WebSocket.
+
+El loop de recepción solo lee mensajes y los entrega a SessionTaskPipeline; un
+worker por sesión los procesa en orden, de a uno, para que el avatar hable en
+el mismo orden en que el usuario preguntó. Así la lectura nunca queda detrás
+de una llamada lenta a OpenAI o HeyGen y los mensajes de control (close) se
+atienden de inmediato, sin pasar por la cola.
+
+Contrapresión:
+    - Un mensaje nuevo de un tipo reemplazable ("task") descarta los pendientes
+      del mismo tipo y, con WS_CANCEL_SUPERSEDED_TASKS, cancela el que está en
+      curso: el usuario volvió a hablar y la respuesta anterior ya no interesa.
+    - Si aun así la cola tiene WS_SESSION_QUEUE_SIZE mensajes, el nuevo se rechaza.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WS_SESSION_QUEUE_SIZE = int(os.getenv("WS_SESSION_QUEUE_SIZE", "8"))
+WS_CANCEL_SUPERSEDED_TASKS = os.getenv("WS_CANCEL_SUPERSEDED_TASKS", "true").lower() == "true"
+
+# Resultados de submit()
+QUEUED = "queued"
+REJECTED = "rejected"
+
+
+class SessionTaskPipeline:
+    """
+    Cola acotada con un worker para los mensajes de una sesión.
+
+    handler(message) procesa un mensaje; sus errores se registran y el worker sigue.
+    """
+
+    def __init__(self, session_id: str, handler: Callable[[Dict], Awaitable[None]],
+                 max_pending: int = WS_SESSION_QUEUE_SIZE, cancel_superseded: bool = WS_CANCEL_SUPERSEDED_TASKS,
+                 supersede_types: Tuple[str, ...] = ("task",)):
+        self.session_id = session_id
+        self._handler = handler
+        self.max_pending = max(1, max_pending)
+        self.cancel_superseded = cancel_superseded
+        self.supersede_types = supersede_types
+        self._pending: Deque[Dict] = deque()
+        self._available = asyncio.Event()
+        self._current: Optional[asyncio.Task] = None
+        self._current_type: Optional[str] = None
+        self._closed = False
+        self._worker = asyncio.create_task(self._run())
+        self.stats = {"processed": 0, "superseded": 0, "cancelled": 0, "rejected": 0, "failed": 0}
+
+    def submit(self, message: Dict) -> str:
+        """Encola un mensaje sin esperar su procesamiento; devuelve QUEUED o REJECTED."""
+        if self._closed:
+            return REJECTED
+        message_type = message.get("type")
+        if message_type in self.supersede_types:
+            kept = deque(item for item in self._pending if item.get("type") != message_type)
+            self.stats["superseded"] += len(self._pending) - len(kept)
+            self._pending = kept
+            if (self.cancel_superseded and self._current is not None and not self._current.done()
+                    and self._current_type == message_type):
+                logger.info(f"[PIPELINE] Cancelando tarea en curso reemplazada en sesión {self.session_id[:8]}")
+                self._current.cancel()
+                self.stats["cancelled"] += 1
+
+        if len(self._pending) >= self.max_pending:
+            self.stats["rejected"] += 1
+            return REJECTED
+        self._pending.append(message)
+        self._available.set()
+        return QUEUED
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._available.clear()
+                await self._available.wait()
+                continue
+            message = self._pending.popleft()
+            self._current_type = message.get("type")
+            # Cada mensaje corre en su propia tarea para poder cancelarlo sin detener el worker
+            self._current = asyncio.create_task(self._handler(message))
+            try:
+                await self._current
+                self.stats["processed"] += 1
+            except asyncio.CancelledError:
+                if self._closed:
+                    raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"[PIPELINE] Error procesando mensaje '{self._current_type}' en sesión {self.session_id[:8]}: {e}")
+            finally:
+                self._current = None
+                self._current_type = None
+
+    async def stop(self):
+        """Descarta lo pendiente, cancela el mensaje en curso y detiene el worker."""
+        self._closed = True
+        self._pending.clear()
+        current = self._current
+        if current is not None:
+            current.cancel()
+        self._worker.cancel()
+        for task in (current, self._worker):
+            if task is None:
+                continue
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
@@ -0,0 +1,199 @@
+# session_pool.py
+"""
+Pool de sesiones HeyGen precalentadas para iniciar el avatar al instante.
+
+Mantiene sesiones ya creadas e iniciadas (streaming.new + streaming.start) con
+la configuración por defecto, de modo que /api/sessions/create solo tiene que
+tomar una del pool. Un loop en segundo plano repone las que se usan, retira
+las que están por alcanzar activity_idle_timeout y ajusta el tamaño objetivo
+a la demanda reciente (checkouts en la ventana de demanda), entre un mínimo y
+un máximo configurables. Desactivado por defecto: cada sesión caliente
+consume créditos de HeyGen.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+HEYGEN_WARM_POOL_SIZE = int(os.getenv("HEYGEN_WARM_POOL_SIZE", "0"))  # Máximo de sesiones calientes (0 = desactivado)
+HEYGEN_WARM_POOL_MIN_SIZE = int(os.getenv("HEYGEN_WARM_POOL_MIN_SIZE", "1"))
+HEYGEN_WARM_POOL_RETIRE_MARGIN = float(os.getenv("HEYGEN_WARM_POOL_RETIRE_MARGIN", "60"))
+HEYGEN_WARM_POOL_DEMAND_WINDOW = float(os.getenv("HEYGEN_WARM_POOL_DEMAND_WINDOW", "600"))
+HEYGEN_WARM_POOL_INTERVAL = float(os.getenv("HEYGEN_WARM_POOL_INTERVAL", "5"))
+HEYGEN_WARM_POOL_REFILL_CONCURRENCY = int(os.getenv("HEYGEN_WARM_POOL_REFILL_CONCURRENCY", "2"))
+
+
+class WarmSessionPool:
+    """
+    Pool de sesiones iniciadas para una configuración fija.
+
+    create_session(config) debe crear e iniciar una sesión y devolver sus datos
+    (session_id, url, access_token); close_session(session_id) la cierra.
+    """
+
+    def __init__(self, config, create_session: Callable[[object], Awaitable[Dict]],
+                 close_session: Callable[[str], Awaitable[object]],
+                 max_size: int = HEYGEN_WARM_POOL_SIZE, min_size: int = HEYGEN_WARM_POOL_MIN_SIZE,
+                 retire_margin: float = HEYGEN_WARM_POOL_RETIRE_MARGIN,
+                 demand_window: float = HEYGEN_WARM_POOL_DEMAND_WINDOW,
+                 interval: float = HEYGEN_WARM_POOL_INTERVAL,
+                 refill_concurrency: int = HEYGEN_WARM_POOL_REFILL_CONCURRENCY):
+        self.config = config
+        self._config_key = config.model_dump()
+        self._create_session = create_session
+        self._close_session = close_session
+        self.max_size = max(0, max_size)
+        self.min_size = min(max(0, min_size), self.max_size)
+        # Una sesión sin actividad expira en activity_idle_timeout: se retira antes
+        self.max_age = max(0.0, config.activity_idle_timeout - retire_margin)
+        self.demand_window = demand_window
+        self.interval = interval
+        self.refill_concurrency = max(1, refill_concurrency)
+
+        self._idle: Deque[Dict] = deque()     # {"data": ..., "created_at": ...}, más antigua primero
+        self._creating = 0
+        self._checkouts: Deque[float] = deque()
+        self._consecutive_failures = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Creaciones interrumpidas por stop(): la sesión puede existir ya en HeyGen
+        self._abandoned: Set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "misses": 0, "created": 0, "retired": 0, "failures": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def start(self):
+        """Arranca el loop de mantenimiento (llamar desde el event loop)."""
+        if not self.enabled or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"[SESSION POOL] Pool caliente activo: {self.min_size}-{self.max_size} sesiones, "
+                    f"retiro a los {self.max_age:.0f}s")
+
+    async def stop(self):
+        """Detiene el loop y cierra las sesiones que no se llegaron a usar."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._idle:
+            await self._retire(self._idle.popleft(), reason="apagado")
+        for creation in list(self._abandoned):
+            try:
+                data = await creation
+            except Exception:
+                continue  # No se llegó a crear
+            finally:
+                self._abandoned.discard(creation)
+            await self._retire({"data": data}, reason="apagado durante la creación")
+
+    def target_size(self) -> int:
+        """Sesiones calientes deseadas según los checkouts de la ventana de demanda."""
+        now = time.monotonic()
+        while self._checkouts and now - self._checkouts[0] > self.demand_window:
+            self._checkouts.popleft()
+        # Checkouts esperados durante la vida útil de una sesión caliente
+        expected = math.ceil(len(self._checkouts) * min(1.0, self.max_age / self.demand_window)) if self.demand_window else 0
+        return max(self.min_size, min(self.max_size, expected))
+
+    async def checkout(self, config) -> Optional[Dict]:
+        """Entrega una sesión caliente si la configuración es la por defecto, o None."""
+        if not self.enabled or config.model_dump() != self._config_key:
+            return None
+        self._checkouts.append(time.monotonic())
+        now = time.monotonic()
+        while self._idle:
+            entry = self._idle.popleft()
+            if now - entry["created_at"] < self.max_age:
+                self.stats["hits"] += 1
+                self._signal()
+                return entry["data"]
+            await self._retire(entry, reason="vencida")
+        self.stats["misses"] += 1
+        self._signal()
+        return None
+
+    def _signal(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _retire(self, entry: Dict, reason: str):
+        session_id = entry["data"].get("session_id")
+        self.stats["retired"] += 1
+        logger.info(f"[SESSION POOL] Retirando sesión caliente {session_id} ({reason})")
+        try:
+            await self._close_session(session_id)
+        except Exception as e:
+            logger.warning(f"[SESSION POOL] No se pudo cerrar la sesión {session_id}: {e}")
+
+    async def _create_one(self):
+        creation = asyncio.ensure_future(self._create_session(self.config))
+        try:
+            # shield: si se cancela el loop, la creación sigue y stop() cierra la sesión resultante
+            data = await asyncio.shield(creation)
+            self._idle.append({"data": data, "created_at": time.monotonic()})
+            self.stats["created"] += 1
+            self._consecutive_failures = 0
+        except asyncio.CancelledError:
+            self._abandoned.add(creation)
+            raise
+        except Exception as e:
+            self.stats["failures"] += 1
+            self._consecutive_failures += 1
+            logger.warning(f"[SESSION POOL] Error creando sesión caliente: {e}")
+        finally:
+            self._creating -= 1
+
+    async def _maintain(self):
+        now = time.monotonic()
+        while self._idle and now - self._idle[0]["created_at"] >= self.max_age:
+            await self._retire(self._idle.popleft(), reason="por expirar")
+
+        target = self.target_size()
+        while len(self._idle) > target:
+            # Demanda a la baja: liberar primero las más antiguas
+            await self._retire(self._idle.popleft(), reason="demanda baja")
+
+        missing = target - len(self._idle) - self._creating
+        batch = min(missing, self.refill_concurrency - self._creating)
+        if batch > 0:
+            self._creating += batch
+            await asyncio.gather(*(self._create_one() for _ in range(batch)))
+
+    async def _run(self):
+        while True:
+            # Se limpia antes de mantener: un checkout durante el mantenimiento vuelve a despertar el loop
+            self._wakeup.clear()
+            try:
+                await self._maintain()
+            except Exception as e:
+                logger.error(f"[SESSION POOL] Error en mantenimiento del pool: {e}")
+            # Espera más larga tras fallos seguidos de HeyGen
+            delay = min(self.interval * (2 ** min(self._consecutive_failures, 6)), 300)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def metrics(self) -> Dict:
+        """Tamaño, objetivo y tasa de aciertos del pool."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "idle": len(self._idle),
+            "creating": self._creating,
+            "target": self.target_size() if self.enabled else 0,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0
+        }
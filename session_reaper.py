@@ -0,0 +1,89 @@
+# session_reaper.py
+"""
+Purga periódica del almacén de sesiones.
+
+Cada SESSION_REAPER_INTERVAL segundos elimina:
+
+    - sesiones marcadas "expired" o "closed" (HeyGen ya las terminó)
+    - sesiones sin actividad por más de su idle_timeout (activity_idle_timeout
+      de HeyGen) + SESSION_IDLE_GRACE segundos
+    - sesiones más antiguas que SESSION_MAX_AGE, tengan o no actividad
+    - emails validados hace más de EMAIL_VALIDATION_TTL segundos
+
+Las sesiones abandonadas que seguían activas se cierran además en HeyGen con
+streaming.stop, sin reintentos: si falla, HeyGen las terminará por inactividad.
+Con el backend SQLite el cierre lo hace solo el worker que logra borrar la
+sesión, así no se repite entre workers.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_REAPER_INTERVAL = float(os.getenv("SESSION_REAPER_INTERVAL", "60"))
+SESSION_IDLE_GRACE = float(os.getenv("SESSION_IDLE_GRACE", "60"))
+SESSION_MAX_AGE = float(os.getenv("SESSION_MAX_AGE", str(4 * 3600)))
+EMAIL_VALIDATION_TTL = float(os.getenv("EMAIL_VALIDATION_TTL", "3600"))
+
+
+class SessionReaper:
+    """Loop en segundo plano que purga sesiones vencidas y emails validados antiguos."""
+
+    def __init__(self, store, close_session: Callable[[str], Awaitable[object]],
+                 interval: float = SESSION_REAPER_INTERVAL, idle_grace: float = SESSION_IDLE_GRACE,
+                 max_age: float = SESSION_MAX_AGE, email_ttl: float = EMAIL_VALIDATION_TTL):
+        self.store = store
+        self._close_session = close_session
+        self.interval = interval
+        self.idle_grace = idle_grace
+        self.max_age = max_age
+        self.email_ttl = email_ttl
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"sweeps": 0, "sessions_reaped": 0, "orphans_stopped": 0, "stop_failures": 0, "emails_reaped": 0}
+
+    def start(self):
+        """Arranca el loop (llamar desde el event loop)."""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep(self):
+        """Una pasada de purga."""
+        for record in await self.store.stale_sessions(self.max_age, self.idle_grace):
+            session_id = record["session_id"]
+            if not await self.store.delete(session_id):
+                continue  # Otro worker la purgó primero
+            self.stats["sessions_reaped"] += 1
+            if record.get("status") in ("expired", "closed"):
+                continue
+            logger.info(f"[SESSION REAPER] Cerrando sesión abandonada en HeyGen: {session_id}")
+            try:
+                await self._close_session(session_id)
+                self.stats["orphans_stopped"] += 1
+            except Exception as e:
+                self.stats["stop_failures"] += 1
+                logger.warning(f"[SESSION REAPER] No se pudo cerrar la sesión {session_id}: {e}")
+
+        self.stats["emails_reaped"] += await self.store.purge_validated_emails(self.email_ttl)
+        self.stats["sweeps"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"[SESSION REAPER] Error purgando sesiones: {e}")
+
+    def metrics(self) -> Dict:
+        return dict(self.stats)
@@ -0,0 +1,261 @@
+# session_store.py
+"""
+Almacén de sesiones del avatar y de emails validados.
+
+Dos backends con la misma interfaz asíncrona, elegidos con SESSION_STORE:
+
+    memory  - diccionarios del proceso (por defecto; un solo worker)
+    sqlite  - archivo SQLite en modo WAL (SESSION_STORE_PATH) compartido por
+              todos los workers del mismo host, p. ej. uvicorn --workers N
+
+Cada sesión es un registro compacto de columnas fijas (SESSION_FIELDS) y los
+cambios de un campo, como validated_email o status, se aplican con una única
+sentencia UPDATE, así dos workers que escriben campos distintos no se pisan.
+
+Las sesiones guardan su última actividad y su idle_timeout (el
+activity_idle_timeout de HeyGen) y los emails validados su fecha de alta, para
+que session_reaper.py pueda purgar las entradas vencidas.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.db")
+
+SESSION_FIELDS = (
+    "session_id", "status", "created_at", "livekit_url", "livekit_token", "validated_email",
+    "created_ts", "last_activity", "idle_timeout"
+)
+UPDATABLE_FIELDS = frozenset(SESSION_FIELDS) - {"session_id"}
+# Sesiones que HeyGen ya dio por terminadas: se purgan sin llamar a streaming.stop
+FINISHED_STATUSES = ("expired", "closed")
+
+
+def _check_fields(fields: Dict):
+    unknown = set(fields) - UPDATABLE_FIELDS
+    if unknown:
+        raise ValueError(f"Campos de sesión desconocidos: {sorted(unknown)}")
+
+
+def is_stale(record: Dict, now: float, max_age: float, grace: float) -> bool:
+    """Sesión terminada, inactiva más allá de su idle_timeout + grace, o más antigua que max_age."""
+    if record.get("status") in FINISHED_STATUSES:
+        return True
+    idle_timeout = record.get("idle_timeout")
+    last_activity = record.get("last_activity")
+    if idle_timeout is not None and last_activity is not None and now > last_activity + idle_timeout + grace:
+        return True
+    created_ts = record.get("created_ts")
+    return created_ts is not None and now > created_ts + max_age
+
+
+class MemorySessionStore:
+    """Backend en memoria del proceso."""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict] = {}
+        self._emails: Dict[str, tuple] = {}   # validation_id -> (email, created_ts)
+
+    async def create(self, record: Dict):
+        """Guarda (o reemplaza) una sesión; los campos no indicados quedan en None."""
+        self._sessions[record["session_id"]] = {field: record.get(field) for field in SESSION_FIELDS}
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        record = self._sessions.get(session_id)
+        return dict(record) if record is not None else None
+
+    async def exists(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    async def update(self, session_id: str, **fields) -> bool:
+        """Actualiza campos de una sesión existente; False si no existe."""
+        _check_fields(fields)
+        record = self._sessions.get(session_id)
+        if record is None:
+            return False
+        record.update(fields)
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    async def touch(self, session_id: str):
+        """Registra actividad en la sesión."""
+        record = self._sessions.get(session_id)
+        if record is not None:
+            record["last_activity"] = time.time()
+
+    async def stale_sessions(self, max_age: float, grace: float) -> List[Dict]:
+        now = time.time()
+        return [dict(record) for record in self._sessions.values() if is_stale(record, now, max_age, grace)]
+
+    async def count(self) -> int:
+        return len(self._sessions)
+
+    async def save_validated_email(self, validation_id: str, email: str):
+        self._emails[validation_id] = (email, time.time())
+
+    async def purge_validated_emails(self, ttl: float) -> int:
+        """Elimina los emails validados hace más de ttl segundos; devuelve cuántos."""
+        cutoff = time.time() - ttl
+        expired = [key for key, (_, created_ts) in self._emails.items() if created_ts < cutoff]
+        for key in expired:
+            del self._emails[key]
+        return len(expired)
+
+    async def email_count(self) -> int:
+        return len(self._emails)
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore:
+    """
+    Backend SQLite en modo WAL. Las operaciones síncronas se ejecutan en un hilo
+    con asyncio.to_thread; cada proceso abre su propia conexión al archivo.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, status TEXT, created_at TEXT, livekit_url TEXT, "
+            "livekit_token TEXT, validated_email TEXT, created_ts REAL, last_activity REAL, idle_timeout REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS validated_emails ("
+            "validation_id TEXT PRIMARY KEY, email TEXT NOT NULL, created_ts REAL)"
+        )
+        # Archivos creados antes de registrar la actividad: agregar las columnas que falten
+        self._add_missing_columns("sessions", {"created_ts": "REAL", "last_activity": "REAL", "idle_timeout": "REAL"})
+        self._add_missing_columns("validated_emails", {"created_ts": "REAL"})
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_validated_emails_created ON validated_emails(created_ts)")
+        self._conn.commit()
+
+    def _add_missing_columns(self, table: str, columns: Dict[str, str]):
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def _fetchone(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    async def create(self, record: Dict):
+        """Guarda (o reemplaza) una sesión; los campos no indicados quedan en NULL."""
+        values = tuple(record.get(field) for field in SESSION_FIELDS)
+        await asyncio.to_thread(
+            self._execute,
+            f"INSERT OR REPLACE INTO sessions ({', '.join(SESSION_FIELDS)}) VALUES ({', '.join('?' * len(SESSION_FIELDS))})",
+            values
+        )
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        row = await asyncio.to_thread(
+            self._fetchone, f"SELECT {', '.join(SESSION_FIELDS)} FROM sessions WHERE session_id = ?", (session_id,)
+        )
+        return dict(zip(SESSION_FIELDS, row)) if row is not None else None
+
+    async def exists(self, session_id: str) -> bool:
+        row = await asyncio.to_thread(self._fetchone, "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,))
+        return row is not None
+
+    async def update(self, session_id: str, **fields) -> bool:
+        """Actualiza campos de una sesión existente en una sola sentencia; False si no existe."""
+        _check_fields(fields)
+        if not fields:
+            return await self.exists(session_id)
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        cursor = await asyncio.to_thread(
+            self._execute, f"UPDATE sessions SET {assignments} WHERE session_id = ?", (*fields.values(), session_id)
+        )
+        return cursor.rowcount > 0
+
+    async def delete(self, session_id: str) -> bool:
+        cursor = await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    async def touch(self, session_id: str):
+        """Registra actividad en la sesión."""
+        await asyncio.to_thread(
+            self._execute, "UPDATE sessions SET last_activity = ? WHERE session_id = ?", (time.time(), session_id)
+        )
+
+    def _stale_rows(self, max_age: float, grace: float) -> List[Dict]:
+        now = time.time()
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(SESSION_FIELDS)} FROM sessions WHERE status IN ({placeholders}) "
+                "OR last_activity + idle_timeout + ? < ? OR created_ts + ? < ?",
+                (*FINISHED_STATUSES, grace, now, max_age, now)
+            ).fetchall()
+        return [dict(zip(SESSION_FIELDS, row)) for row in rows]
+
+    async def stale_sessions(self, max_age: float, grace: float) -> List[Dict]:
+        return await asyncio.to_thread(self._stale_rows, max_age, grace)
+
+    async def count(self) -> int:
+        row = await asyncio.to_thread(self._fetchone, "SELECT COUNT(*) FROM sessions")
+        return row[0]
+
+    async def save_validated_email(self, validation_id: str, email: str):
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO validated_emails (validation_id, email, created_ts) VALUES (?, ?, ?)",
+            (validation_id, email, time.time())
+        )
+
+    async def purge_validated_emails(self, ttl: float) -> int:
+        """Elimina los emails validados hace más de ttl segundos; devuelve cuántos."""
+        cursor = await asyncio.to_thread(
+            self._execute, "DELETE FROM validated_emails WHERE created_ts IS NULL OR created_ts < ?", (time.time() - ttl,)
+        )
+        return cursor.rowcount
+
+    async def email_count(self) -> int:
+        row = await asyncio.to_thread(self._fetchone, "SELECT COUNT(*) FROM validated_emails")
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store():
+    """Backend según SESSION_STORE; si el archivo SQLite no se puede abrir, se usa memoria."""
+    if SESSION_STORE == "sqlite":
+        try:
+            store = SQLiteSessionStore(SESSION_STORE_PATH)
+            logger.info(f"[SESSION STORE] Sesiones compartidas en SQLite: {SESSION_STORE_PATH}")
+            return store
+        except sqlite3.Error as e:
+            logger.error(f"[SESSION STORE] No se pudo abrir {SESSION_STORE_PATH}, se usa memoria: {e}")
+    elif SESSION_STORE != "memory":
+        logger.warning(f"[SESSION STORE] Backend desconocido '{SESSION_STORE}', se usa memoria")
+    return MemorySessionStore()
+
+
+session_store = create_session_store()
@@ -0,0 +1,52 @@
+# tests/test_invoice_parser.py
+from invoice_parser import parse_invoice_text
+
+RECONCILED_INVOICE = """
+--- PÁGINA 1 ---
+NovaIA S.A.S. - FACTURA ELECTRONICA DE VENTA
+Factura No: FE-1234 Fecha: 2025-03-15
+--- TABLAS PÁGINA 1 ---
+
+Tabla 1:
+Item | Descripcion | Cantidad | Valor unitario | Total
+1 | Desarrollador RPA Junior | 10 | 120.000 | 1.200.000
+2 | Soporte | 2 | 85.000 | 170.000
+ | Subtotal |  |  | 1.370.000
+ | IVA 19% |  |  | 260.300
+ | Total a pagar |  |  | 1.630.300
+"""
+
+
+def test_reconciled_invoice_is_parsed_locally():
+    result = parse_invoice_text(RECONCILED_INVOICE)
+
+    assert result is not None
+    assert result["numero_factura"] == "FE-1234"
+    assert [concepto["total_concepto"] for concepto in result["conceptos"]] == [1200000, 170000]
+    assert result["subtotal"] == 1370000
+    assert result["impuestos"] == 260300
+    assert result["tasa_impuestos"] == 19
+    assert result["total_factura"] == 1630300
+    assert result["fuente_extraccion"] == "parser_local"
+
+
+def test_totals_that_do_not_reconcile_go_to_the_model():
+    text = RECONCILED_INVOICE.replace("Total a pagar |  |  | 1.630.300", "Total a pagar |  |  | 1.700.000")
+
+    assert parse_invoice_text(text) is None
+
+
+def test_contracted_developer_lines_are_not_flagged():
+    result = parse_invoice_text(RECONCILED_INVOICE)
+
+    assert result["observaciones"] == ""
+    assert result["observaciones_evaluadas"] == "reglas_locales"
+
+
+def test_observaciones_include_notes_and_non_contract_items():
+    text = RECONCILED_INVOICE.replace("2 | Soporte | 2 | 85.000 | 170.000", "2 | Configuración inicial | 2 | 85.000 | 170.000")
+    text += "Observaciones: Pago a 30 días\n"
+
+    result = parse_invoice_text(text)
+
+    assert result["observaciones"] == "Pago a 30 días. Posibles servicios no contractuales: Configuración inicial"
@@ -1,10 +1,21 @@
-import requests
+import httpx
+import asyncio
+import json
 import os
 import logging
-from typing import Dict, Optional
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+
+class StaleReleaseError(Exception):
+    """Raised when Orchestrator rejects a StartJobs call because the cached ReleaseKey is no longer valid."""
+
 class UiPathManager:
     """
     Manager for UiPath Orchestrator integration to trigger RPA workflows.
@@ -37,26 +48,65 @@ class UiPathManager:
             'X-UIPATH-OrganizationUnitId': '421017'
         }
 
+        # HTTP pool and timeouts for Orchestrator calls
+        self.http_timeout = float(os.getenv("UIPATH_HTTP_TIMEOUT", "30"))
+        self.http_connect_timeout = float(os.getenv("UIPATH_HTTP_CONNECT_TIMEOUT", "10"))
+        self.max_connections = int(os.getenv("UIPATH_MAX_CONNECTIONS", "20"))
+        self.max_keepalive_connections = int(os.getenv("UIPATH_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # ReleaseKey cache: process name -> (release key, fetched at)
+        self.release_cache_ttl = float(os.getenv("UIPATH_RELEASE_CACHE_TTL", "3600"))
+        self._release_keys: Dict[str, Tuple[str, float]] = {}
+        self._release_lock = asyncio.Lock()
+
         logger.info(f"UiPathManager initialized for organization: {self.organization}, tenant: {self.tenant}")
 
-    async def trigger_dashboard_workflow(self, user_question: str = None, user_email: str = None, question_case: str = None) -> Dict:
+    def _get_client(self) -> httpx.AsyncClient:
         """
-        Triggers the UiPath workflow specifically for dashboard billing inquiries.
+        Return the shared keep-alive client for Orchestrator, creating it on first use.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.http_timeout, connect=self.http_connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        """
+        Close the Orchestrator connection pool.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_release_key(self, force_refresh: bool = False) -> str:
+        """
+        Return the ReleaseKey for the configured process, served from a TTL cache.
 
         Args:
-            user_question: The original user question that triggered this workflow
-            user_email: The validated email to pass as input argument to UiPath
-            question_case: The specific question case/button text to pass as input argument
+            force_refresh: Skip the cache and query Orchestrator again
 
         Returns:
-            Dict with job execution results and status information
+            The ReleaseKey string
         """
-        try:
-            logger.info(f"[UIPATH] Triggering dashboard workflow for question: {user_question[:50] if user_question else 'N/A'}...")
+        cached = self._release_keys.get(self.process_name)
+        if not force_refresh and cached and time.monotonic() - cached[1] < self.release_cache_ttl:
+            return cached[0]
+
+        async with self._release_lock:
+            # Another caller may have refreshed the key while we waited for the lock
+            cached = self._release_keys.get(self.process_name)
+            if not force_refresh and cached and time.monotonic() - cached[1] < self.release_cache_ttl:
+                return cached[0]
 
-            # 1. Get ReleaseKey for the process
             params = {"$filter": f"Name eq '{self.process_name}'"}
-            res = requests.get(self.base_url + "Releases", headers=self.headers, params=params)
+            res = await self._get_client().get("Releases", headers=self.headers, params=params)
             res.raise_for_status()
 
             releases = res.json().get("value", [])
@@ -64,90 +114,235 @@ class UiPathManager:
                 raise Exception(f"Process '{self.process_name}' not found in UiPath Orchestrator")
 
             release_key = releases[0]["Key"]
+            self._release_keys[self.process_name] = (release_key, time.monotonic())
             logger.info(f"[UIPATH] Found process release key: {release_key}")
+            return release_key
 
-            # 2. Prepare input arguments with validated email and question case
-            arguments = {}
-
-            if user_email:
-                arguments["InCorreo"] = user_email
-                logger.info(f"[UIPATH] Using email for InCorreo parameter: {user_email}")
-            else:
-                logger.warning("[UIPATH] No email provided for InCorreo parameter")
-
-            if question_case:
-                arguments["InCaso"] = question_case
-                logger.info(f"[UIPATH] Using question case for InCaso parameter: {question_case[:50]}...")
-            else:
-                logger.warning("[UIPATH] No question case provided for InCaso parameter")
-
-            # Convert to JSON string format required by UiPath
-            if arguments:
-                import json
-                input_arguments = json.dumps(arguments, ensure_ascii=False)
-                logger.info(f"[UIPATH] Final InputArguments: {input_arguments}")
-            else:
-                input_arguments = "{}"
-                logger.warning("[UIPATH] Using empty InputArguments as no parameters provided")
-
-            # 3. Start job (following the exact pattern from working script)
-            start_job_url = self.base_url + "Jobs/UiPath.Server.Configuration.OData.StartJobs"
-
-            data = {
-                "startInfo": {
-                    "ReleaseKey": release_key,
-                    "Strategy": "ModernJobsCount",
-                    "RuntimeType": "Development",
-                    "JobsCount": 1,
-                    "Source": "Manual",      # Required in Cloud
-                    "InputArguments": input_arguments,  # Dynamic input arguments with email
-                    "JobPriority": "Normal"
-                }
-            }
+    def invalidate_release_key(self):
+        """
+        Drop the cached ReleaseKey so the next trigger looks it up again.
+        """
+        self._release_keys.pop(self.process_name, None)
 
-            res = requests.post(start_job_url, headers=self.robot_headers, json=data)
-            res.raise_for_status()
-            job_info = res.json()
+    @staticmethod
+    def _is_stale_release_response(res: httpx.Response) -> bool:
+        """
+        Detect a StartJobs rejection caused by a ReleaseKey that no longer exists.
+        """
+        if res.status_code not in (400, 404, 409):
+            return False
+        return "release" in res.text.lower()
 
-            logger.info(f"[UIPATH] Job started successfully: {job_info}")
+    @staticmethod
+    def _is_retryable_error(error: Exception) -> bool:
+        """
+        StartJobs is not idempotent: only failures where Orchestrator cannot have
+        processed the request (no connection, throttling, unavailable) are safe to resend.
+        """
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in (429, 503)
+        return False
+
+    @staticmethod
+    def _is_ambiguous_error(error: Exception) -> bool:
+        """
+        Failures after the request was sent (read timeouts, dropped connections, other 5xx):
+        the job may have been created, so look it up before sending StartJobs again.
+        """
+        if isinstance(error, httpx.TransportError):
+            return not UiPathManager._is_retryable_error(error)
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500 and not UiPathManager._is_retryable_error(error)
+        return False
 
-            # Extract relevant information for response
-            job_data = job_info.get("value", [{}])[0] if job_info.get("value") else {}
+    async def _start_jobs(self, release_key: str, input_arguments: str) -> Dict:
+        """
+        Call StartJobs for the given ReleaseKey and InputArguments.
+        """
+        data = {
+            "startInfo": {
+                "ReleaseKey": release_key,
+                "Strategy": "ModernJobsCount",
+                "RuntimeType": "Development",
+                "JobsCount": 1,
+                "Source": "Manual",      # Required in Cloud
+                "InputArguments": input_arguments,  # Dynamic input arguments with email
+                "JobPriority": "Normal"
+            }
+        }
 
-            return {
-                "status": "success",
-                "job_id": job_data.get("Id", "unknown"),
-                "job_key": job_data.get("Key", "unknown"),
-                "release_name": self.process_name,
-                "message": "Proceso UiPath iniciado exitosamente para consulta de facturación",
-                "details": {
-                    "organization": self.organization,
-                    "tenant": self.tenant,
-                    "input_question": user_question,
-                    "input_email": user_email,
-                    "input_question_case": question_case,
-                    "input_arguments": input_arguments,
-                    "job_priority": "Normal",
-                    "execution_strategy": "ModernJobsCount"
-                }
+        res = await self._get_client().post(
+            "Jobs/UiPath.Server.Configuration.OData.StartJobs",
+            headers=self.robot_headers,
+            json=data
+        )
+        if self._is_stale_release_response(res):
+            raise StaleReleaseError(res.text)
+        res.raise_for_status()
+        return res.json()
+
+    async def _start_jobs_with_refresh(self, input_arguments: str) -> Dict:
+        """
+        Start jobs with the cached ReleaseKey, refreshing it once if Orchestrator reports it as stale.
+        """
+        release_key = await self.get_release_key()
+        try:
+            return await self._start_jobs(release_key, input_arguments)
+        except StaleReleaseError as e:
+            logger.warning(f"[UIPATH] Cached release key rejected, refreshing: {e}")
+            self.invalidate_release_key()
+            release_key = await self.get_release_key(force_refresh=True)
+            return await self._start_jobs(release_key, input_arguments)
+
+    @staticmethod
+    def _build_input_arguments(user_email: str = None, question_case: str = None) -> str:
+        """
+        Build the InputArguments JSON string with the validated email and question case.
+        """
+        arguments = {}
+
+        if user_email:
+            arguments["InCorreo"] = user_email
+            logger.info(f"[UIPATH] Using email for InCorreo parameter: {user_email}")
+        else:
+            logger.warning("[UIPATH] No email provided for InCorreo parameter")
+
+        if question_case:
+            arguments["InCaso"] = question_case
+            logger.info(f"[UIPATH] Using question case for InCaso parameter: {question_case[:50]}...")
+        else:
+            logger.warning("[UIPATH] No question case provided for InCaso parameter")
+
+        # Convert to JSON string format required by UiPath
+        if arguments:
+            input_arguments = json.dumps(arguments, ensure_ascii=False)
+            logger.info(f"[UIPATH] Final InputArguments: {input_arguments}")
+        else:
+            input_arguments = "{}"
+            logger.warning("[UIPATH] Using empty InputArguments as no parameters provided")
+        return input_arguments
+
+    def _build_success_result(self, job_data: Dict, user_question: str, user_email: str,
+                              question_case: str, input_arguments: str) -> Dict:
+        return {
+            "status": "success",
+            "job_id": job_data.get("Id", "unknown"),
+            "job_key": job_data.get("Key", "unknown"),
+            "release_name": self.process_name,
+            "message": "Proceso UiPath iniciado exitosamente para consulta de facturación",
+            "details": {
+                "organization": self.organization,
+                "tenant": self.tenant,
+                "input_question": user_question,
+                "input_email": user_email,
+                "input_question_case": question_case,
+                "input_arguments": input_arguments,
+                "job_priority": "Normal",
+                "execution_strategy": "ModernJobsCount"
             }
+        }
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[UIPATH] Request failed: {e}")
+    def _build_error_result(self, error: Exception) -> Dict:
+        if isinstance(error, (httpx.HTTPError, StaleReleaseError)):
+            logger.error(f"[UIPATH] Request failed: {error}")
             return {
                 "status": "error",
                 "error_type": "request_failed",
-                "message": f"Error de conexión con UiPath Orchestrator: {str(e)}",
-                "details": {"original_error": str(e)}
+                "retryable": self._is_retryable_error(error),
+                "ambiguous": self._is_ambiguous_error(error),
+                "message": f"Error de conexión con UiPath Orchestrator: {str(error)}",
+                "details": {"original_error": str(error)}
             }
+        logger.error(f"[UIPATH] Unexpected error: {error}")
+        return {
+            "status": "error",
+            "error_type": "general_error",
+            "message": f"Error ejecutando workflow UiPath: {str(error)}",
+            "details": {"original_error": str(error)}
+        }
+
+    async def trigger_dashboard_workflow(self, user_question: str = None, user_email: str = None, question_case: str = None) -> Dict:
+        """
+        Triggers the UiPath workflow specifically for dashboard billing inquiries.
+
+        Args:
+            user_question: The original user question that triggered this workflow
+            user_email: The validated email to pass as input argument to UiPath
+            question_case: The specific question case/button text to pass as input argument
+
+        Returns:
+            Dict with job execution results and status information
+        """
+        try:
+            logger.info(f"[UIPATH] Triggering dashboard workflow for question: {user_question[:50] if user_question else 'N/A'}...")
+
+            input_arguments = self._build_input_arguments(user_email, question_case)
+            job_info = await self._start_jobs_with_refresh(input_arguments)
+
+            logger.info(f"[UIPATH] Job started successfully: {job_info}")
+
+            # Extract relevant information for response
+            job_data = job_info.get("value", [{}])[0] if job_info.get("value") else {}
+            return self._build_success_result(job_data, user_question, user_email, question_case, input_arguments)
+
         except Exception as e:
-            logger.error(f"[UIPATH] Unexpected error: {e}")
-            return {
-                "status": "error",
-                "error_type": "general_error",
-                "message": f"Error ejecutando workflow UiPath: {str(e)}",
-                "details": {"original_error": str(e)}
-            }
+            return self._build_error_result(e)
+
+    async def find_started_job(self, user_question: str = None, user_email: str = None,
+                               question_case: str = None, since: datetime = None) -> Optional[Dict]:
+        """
+        Look for a job of the configured process created since `since` with the same
+        InputArguments, i.e. one started by a StartJobs call whose answer was lost.
+
+        Returns:
+            A success result for the job, or None if Orchestrator has no such job
+
+        Raises:
+            httpx.HTTPError: If Orchestrator cannot be queried
+        """
+        input_arguments = self._build_input_arguments(user_email, question_case)
+        # Margin for clock skew with Orchestrator; a same-arguments job that close is a duplicate anyway
+        since = (since or datetime.now(timezone.utc)) - timedelta(seconds=30)
+        params = {
+            "$filter": f"ReleaseName eq '{self.process_name}' and CreationTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}",
+            "$select": "Id,Key,State,InputArguments,CreationTime",
+            "$orderby": "CreationTime desc",
+            "$top": "50"
+        }
+        res = await self._get_client().get("Jobs", headers=self.robot_headers, params=params)
+        res.raise_for_status()
+
+        expected = json.loads(input_arguments)
+        for job in res.json().get("value", []):
+            try:
+                arguments = json.loads(job.get("InputArguments") or "{}")
+            except (TypeError, ValueError):
+                continue
+            if arguments == expected:
+                logger.info(f"[UIPATH] Found job {job.get('Id')} started by a StartJobs call without answer")
+                return self._build_success_result(job, user_question, user_email, question_case, input_arguments)
+        return None
+
+    async def get_jobs(self, job_ids: List[str]) -> List[Dict]:
+        """
+        Fetch the current state of several jobs with a single OData query.
+
+        Args:
+            job_ids: Numeric job ids to look up
+
+        Returns:
+            List of job dicts as returned by Orchestrator (jobs it does not know are omitted)
+        """
+        id_list = ",".join(str(int(job_id)) for job_id in job_ids)
+        params = {
+            "$filter": f"Id in ({id_list})",
+            "$select": "Id,Key,State,Info,StartTime,EndTime"
+        }
+        res = await self._get_client().get("Jobs", headers=self.robot_headers, params=params)
+        res.raise_for_status()
+        return res.json().get("value", [])
 
     async def check_job_status(self, job_id: str) -> Dict:
         """
@@ -157,11 +352,10 @@ class UiPathManager:
             job_id: The ID of the job to check
 
         Returns:
-            Dict with current job status information
+            Dict with current job status information; status is "not_found" if Orchestrator returns 404
         """
         try:
-            job_url = f"{self.base_url}Jobs({job_id})"
-            res = requests.get(job_url, headers=self.robot_headers)
+            res = await self._get_client().get(f"Jobs({job_id})", headers=self.robot_headers)
             res.raise_for_status()
 
             job_data = res.json()
@@ -173,6 +367,18 @@ class UiPathManager:
                 "details": job_data
             }
 
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return {
+                    "status": "not_found",
+                    "job_id": job_id,
+                    "message": f"Job {job_id} no existe en Orchestrator"
+                }
+            logger.error(f"[UIPATH] Error checking job status: {e}")
+            return {
+                "status": "error",
+                "message": f"Error verificando estado del job: {str(e)}"
+            }
         except Exception as e:
             logger.error(f"[UIPATH] Error checking job status: {e}")
             return {
@@ -180,8 +386,332 @@ class UiPathManager:
                 "message": f"Error verificando estado del job: {str(e)}"
             }
 
-# Global instance
+ResultCallback = Callable[[str, Dict], Awaitable[None]]
+
+
+class UiPathJobQueue:
+    """
+    In-process queue for UiPath workflow submissions.
+    Callers get a submission id immediately while a bounded pool of workers
+    talks to Orchestrator, retrying transient failures with exponential backoff.
+    After an ambiguous failure the recent jobs are checked first, so a StartJobs
+    call that Orchestrator did accept is not sent twice.
+    """
+
+    def __init__(self):
+        self.concurrency = int(os.getenv("UIPATH_QUEUE_WORKERS", "16"))
+        self.max_attempts = int(os.getenv("UIPATH_QUEUE_MAX_ATTEMPTS", "3"))
+        self.backoff_base = float(os.getenv("UIPATH_QUEUE_BACKOFF_BASE", "1.0"))
+        self.backoff_max = float(os.getenv("UIPATH_QUEUE_BACKOFF_MAX", "30"))
+        self.max_size = int(os.getenv("UIPATH_QUEUE_MAX_SIZE", "500"))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "retried": 0, "recovered": 0}
+
+    def start(self):
+        """
+        Start the worker tasks. Safe to call more than once.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.create_task(self._worker(len(self._workers))))
+        logger.info(f"[UIPATH QUEUE] Started with {self.concurrency} workers")
+
+    async def stop(self):
+        """
+        Cancel the worker tasks. Submissions still waiting in the queue are dropped.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, user_question: str = None, user_email: str = None, question_case: str = None,
+               on_result: Optional[ResultCallback] = None) -> str:
+        """
+        Queue a dashboard workflow trigger and return its submission id without waiting for Orchestrator.
+
+        Args:
+            user_question: The original user question
+            user_email: The validated email passed as InCorreo
+            question_case: The question case passed as InCaso
+            on_result: Coroutine called with (submission_id, result) once the job is started or has failed
+
+        Returns:
+            The submission id
+
+        Raises:
+            asyncio.QueueFull: If the queue already holds UIPATH_QUEUE_MAX_SIZE submissions
+        """
+        if self._queue is None or len(self._workers) < self.concurrency:
+            self.start()
+
+        submission_id = str(uuid.uuid4())
+        self._queue.put_nowait({
+            "submission_id": submission_id,
+            "user_question": user_question,
+            "user_email": user_email,
+            "question_case": question_case,
+            "on_result": on_result
+        })
+        self.stats["submitted"] += 1
+        logger.info(f"[UIPATH QUEUE] Submission {submission_id} queued (pending: {self._queue.qsize()})")
+        return submission_id
+
+    def pending(self) -> int:
+        """
+        Number of submissions waiting for a worker.
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self, worker_index: int):
+        while True:
+            submission = await self._queue.get()
+            try:
+                result = await self._run(submission)
+                result["submission_id"] = submission["submission_id"]
+                on_result = submission.get("on_result")
+                if on_result:
+                    try:
+                        await on_result(submission["submission_id"], result)
+                    except Exception as e:
+                        logger.warning(f"[UIPATH QUEUE] Result callback failed for {submission['submission_id']}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[UIPATH QUEUE] Worker {worker_index} error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, submission: Dict) -> Dict:
+        uipath_manager = get_uipath_manager()
+        started_at = datetime.now(timezone.utc)
+        attempt = 1
+        while True:
+            result = await uipath_manager.trigger_dashboard_workflow(
+                submission["user_question"], submission["user_email"], submission["question_case"]
+            )
+            if result.get("status") == "success":
+                self.stats["succeeded"] += 1
+                return result
+            retryable = result.get("retryable") or result.get("ambiguous")
+            if not retryable or attempt >= self.max_attempts:
+                self.stats["failed"] += 1
+                return result
+
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+            delay = delay * random.uniform(0.5, 1.0)
+            logger.warning(f"[UIPATH QUEUE] Submission {submission['submission_id']} attempt {attempt} failed, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+            if result.get("ambiguous"):
+                # Orchestrator may have started the job before failing: resend only if it did not
+                try:
+                    started = await uipath_manager.find_started_job(
+                        submission["user_question"], submission["user_email"], submission["question_case"], started_at
+                    )
+                except Exception as e:
+                    logger.error(f"[UIPATH QUEUE] Could not check for a started job, not resending {submission['submission_id']}: {e}")
+                    self.stats["failed"] += 1
+                    return result
+                if started is not None:
+                    self.stats["recovered"] += 1
+                    self.stats["succeeded"] += 1
+                    return started
+
+            self.stats["retried"] += 1
+            attempt += 1
+
+
+JobListener = Callable[[str, Dict], Awaitable[None]]
+
+TERMINAL_JOB_STATES = {"Successful", "Faulted", "Stopped"}
+
+
+class UiPathJobTracker:
+    """
+    Keeps the state of in-flight UiPath jobs in memory.
+    All tracked jobs are polled together with one Jobs?$filter=Id in (...) query,
+    on an interval that backs off while nothing changes, and state changes are
+    pushed to the listener registered for the owning session.
+    """
+
+    def __init__(self):
+        self.min_interval = float(os.getenv("UIPATH_TRACKER_MIN_INTERVAL", "2"))
+        self.max_interval = float(os.getenv("UIPATH_TRACKER_MAX_INTERVAL", "30"))
+        self.query_batch_size = int(os.getenv("UIPATH_TRACKER_BATCH_SIZE", "50"))
+        self.max_finished = int(os.getenv("UIPATH_TRACKER_MAX_FINISHED", "1000"))
+        # Jobs absent from this many polls in a row (deleted, purged, wrong id) stop being tracked
+        self.max_missed_polls = int(os.getenv("UIPATH_TRACKER_MAX_MISSED_POLLS", "5"))
+
+        self.jobs: Dict[str, Dict] = {}
+        self._in_flight: Dict[str, Optional[str]] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._missed_polls: Dict[str, int] = {}
+        self._listeners: Dict[str, JobListener] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.stats = {"polls": 0, "poll_errors": 0, "state_changes": 0, "dropped_missing": 0}
+
+    def track(self, job_id: str, session_id: str = None):
+        """
+        Start tracking a job, optionally owned by a session.
+        """
+        job_id = str(job_id)
+        if not job_id.isdigit():
+            logger.warning(f"[UIPATH TRACKER] Ignoring non-numeric job id: {job_id}")
+            return
+        if job_id in self.jobs and job_id not in self._in_flight:
+            return
+
+        self._in_flight[job_id] = session_id
+        self._missed_polls.pop(job_id, None)
+        self.jobs.setdefault(job_id, {
+            "job_id": job_id,
+            "session_id": session_id,
+            "state": "Pending",
+            "updated_at": time.time(),
+            "details": {}
+        })
+        logger.info(f"[UIPATH TRACKER] Tracking job {job_id} (in flight: {len(self._in_flight)})")
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    def subscribe(self, session_id: str, listener: JobListener):
+        """
+        Register the coroutine that receives (job_id, job) updates for a session.
+        """
+        self._listeners[session_id] = listener
+
+    def unsubscribe(self, session_id: str):
+        self._listeners.pop(session_id, None)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Return the last known state of a tracked job, without calling Orchestrator.
+        """
+        return self.jobs.get(str(job_id))
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = self.min_interval
+        next_poll = loop.time() + interval
+        while self._in_flight:
+            self._wakeup.clear()
+            timeout = next_poll - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    # New job tracked: make sure the next poll happens soon
+                    interval = self.min_interval
+                    next_poll = min(next_poll, loop.time() + interval)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                changed = await self._poll_once()
+            except Exception as e:
+                self.stats["poll_errors"] += 1
+                logger.error(f"[UIPATH TRACKER] Poll failed: {e}")
+                changed = False
+
+            interval = self.min_interval if changed else min(self.max_interval, interval * 2)
+            next_poll = loop.time() + interval
+
+    async def _poll_once(self) -> bool:
+        job_ids = list(self._in_flight)
+        uipath_manager = get_uipath_manager()
+        changed = False
+
+        for start in range(0, len(job_ids), self.query_batch_size):
+            batch = job_ids[start:start + self.query_batch_size]
+            jobs = await uipath_manager.get_jobs(batch)
+            self.stats["polls"] += 1
+            returned = set()
+            for job_data in jobs:
+                job_id = str(job_data.get("Id"))
+                if job_id not in self._in_flight:
+                    continue
+                returned.add(job_id)
+                self._missed_polls.pop(job_id, None)
+                if await self._update(job_id, job_data):
+                    changed = True
+            for job_id in batch:
+                if job_id not in returned and job_id in self._in_flight:
+                    self._missed_polls[job_id] = self._missed_polls.get(job_id, 0) + 1
+                    if self._missed_polls[job_id] >= self.max_missed_polls:
+                        await self._drop_missing(job_id)
+                        changed = True
+        return changed
+
+    async def _drop_missing(self, job_id: str):
+        """
+        Stop tracking a job that Orchestrator has not returned for max_missed_polls polls.
+        """
+        logger.warning(f"[UIPATH TRACKER] Job {job_id} not returned by Orchestrator "
+                       f"after {self.max_missed_polls} polls, no longer tracking it")
+        self.jobs[job_id].update({"state": "NotFound", "updated_at": time.time()})
+        self.stats["dropped_missing"] += 1
+        session_id = self._in_flight.get(job_id)
+        self._finish(job_id)
+        await self._notify(session_id, job_id)
+
+    def _finish(self, job_id: str):
+        self._in_flight.pop(job_id, None)
+        self._missed_polls.pop(job_id, None)
+        self._finished[job_id] = None
+        while len(self._finished) > self.max_finished:
+            old_job_id, _ = self._finished.popitem(last=False)
+            self.jobs.pop(old_job_id, None)
+
+    async def _update(self, job_id: str, job_data: Dict) -> bool:
+        job = self.jobs[job_id]
+        state = job_data.get("State", "Unknown")
+        if state == job["state"]:
+            return False
+
+        job.update({"state": state, "updated_at": time.time(), "details": job_data})
+        self.stats["state_changes"] += 1
+        logger.info(f"[UIPATH TRACKER] Job {job_id} -> {state}")
+
+        session_id = self._in_flight.get(job_id)
+        if state in TERMINAL_JOB_STATES:
+            self._finish(job_id)
+
+        await self._notify(session_id, job_id)
+        return True
+
+    async def _notify(self, session_id: Optional[str], job_id: str):
+        listener = self._listeners.get(session_id) if session_id else None
+        job = self.jobs.get(job_id)
+        if listener and job is not None:
+            try:
+                await listener(job_id, dict(job))
+            except Exception as e:
+                logger.warning(f"[UIPATH TRACKER] Listener failed for session {session_id}: {e}")
+
+
+# Global instances
 uipath_manager = None
+uipath_job_queue = None
+uipath_job_tracker = None
 
 def get_uipath_manager() -> UiPathManager:
     """
@@ -194,4 +724,33 @@ def get_uipath_manager() -> UiPathManager:
         except Exception as e:
             logger.error(f"Failed to initialize UiPathManager: {e}")
             raise
-    return uipath_manager
\ No newline at end of file
+    return uipath_manager
+
+def get_uipath_job_queue() -> UiPathJobQueue:
+    """
+    Get or create the global UiPathJobQueue instance.
+    """
+    global uipath_job_queue
+    if uipath_job_queue is None:
+        uipath_job_queue = UiPathJobQueue()
+    return uipath_job_queue
+
+def get_uipath_job_tracker() -> UiPathJobTracker:
+    """
+    Get or create the global UiPathJobTracker instance.
+    """
+    global uipath_job_tracker
+    if uipath_job_tracker is None:
+        uipath_job_tracker = UiPathJobTracker()
+    return uipath_job_tracker
+
+async def shutdown_uipath_manager():
+    """
+    Stop the job queue workers and tracker, and release the global UiPathManager HTTP resources.
+    """
+    if uipath_job_queue is not None:
+        await uipath_job_queue.stop()
+    if uipath_job_tracker is not None:
+        await uipath_job_tracker.stop()
+    if uipath_manager is not None:
+        await uipath_manager.aclose()